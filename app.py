@@ -1,12 +1,38 @@
 
 import streamlit as st
-from ultralytics import YOLO
 from PIL import Image
+from pathlib import Path
+import tempfile
+import io
 import numpy as np
 import pandas as pd
 import cv2
 import os
 
+from backends import get_model, resolve_model_path
+from bulk import BulkJob
+from detection_cache import DetectionCache, Detections, RawDetections, image_key, refilter, RAW_CONF, RAW_IOU, \
+    RAW_MAX_DET
+from label_index import INDEX_FILE, SPLITS, LabelIndex, build_index
+from run_registry import list_runs, run_artifacts
+from inference_server import DEFAULT_URL, fetch_stats, fetch_timing, predict_remote, server_info
+from stage_timing import enable as enable_timing, enabled as timing_enabled, prometheus_text, record_speed, \
+    reset as reset_timing, snapshot, stage
+from telemetry import RUNS_ROOT, TrainingTelemetry
+from thresholds import load_thresholds
+from tiling import merge_detections, predict_tiled
+from video import process_video
+
+# Box colors (RGB) for the client-side overlay
+PALETTE = [(255, 75, 75), (255, 145, 77), (0, 255, 170), (77, 171, 255),
+           (255, 221, 87), (196, 120, 255), (255, 255, 255)]
+# Longest side of the copy the overlay is drawn on (st.image never shows more in a half-width column)
+DISPLAY_MAX_SIDE = 1024
+# Seconds between Analytics training-curve refreshes
+TELEMETRY_REFRESH_S = 5
+# Seconds between bulk-detection progress refreshes
+BULK_REFRESH_S = 1
+
 # --- PAGE CONFIGURATION ---
 st.set_page_config(
     page_title="Mission Control - AIT CV Hackathon",
@@ -76,8 +102,11 @@ with st.sidebar:
     st.markdown("---")
     
     st.subheader("⚙️ Settings")
-    conf_threshold = st.slider("Confidence", 0.0, 1.0, 0.25, 0.05)
-    iou_threshold = st.slider("IoU Threshold", 0.0, 1.0, 0.45, 0.05)
+    # Defaults come from the offline sweep in quick_tta_test.py (max-F1 operating point)
+    recommended = load_thresholds()['display']
+    conf_threshold = st.slider("Confidence", 0.0, 1.0, round(round(recommended['conf'] / 0.05) * 0.05, 2), 0.05)
+    iou_threshold = st.slider("IoU Threshold", 0.0, 1.0, round(round(recommended['iou'] / 0.05) * 0.05, 2), 0.05)
+    tiled = st.checkbox("🧩 Tiled inference", help="Run large images as overlapping 640px tiles to find small objects")
     
     st.markdown("---")
     st.subheader("📊 Official Metrics")
@@ -92,6 +121,20 @@ with st.sidebar:
     
     st.success("✅ Model: Verified")
 
+    server_stats = fetch_stats()
+    if server_stats:
+        with st.expander("🛰️ Inference Server"):
+            st.metric("Queue depth", server_stats['queue_depth'])
+            st.metric("Mean batch size", server_stats['mean_batch_size'])
+            st.metric("p95 latency (ms)", server_stats['latency_ms']['p95'] or "-")
+            st.caption(f"Requests: {server_stats['requests']} | Rejected: {server_stats['rejected']}")
+
+    # Stage histograms are process-wide (shared by every session); the toggle flips them on and off
+    st.checkbox("🐞 Stage timing", value=timing_enabled(), key='stage_timing',
+                on_change=lambda: enable_timing(st.session_state.stage_timing),
+                help="Time decode / preprocess / forward / NMS / draw / display of every image (stage_timing.py)")
+    timing_slot = st.empty()  # filled at the end of the script, after this run's stages are recorded
+
 # --- MAIN CONTENT ---
 st.title("🛰️ Space Station Object Detection")
 
@@ -101,45 +144,120 @@ tab1, tab2 = st.tabs(["🔴 Live Demo", "📈 Analytics Dashboard"])
 with tab1:
     st.markdown("### 📤 Visual Feed Analysis")
     
-    # Load Model
+    # Load Model (used for video and tiles, and for images when the inference server is not running)
     @st.cache_resource
     def load_model():
-        model_path = 'runs/detect/runs/detect/space_station_medium_final/weights/best.pt' # Adjusted path
-        if not os.path.exists(model_path):
-             model_path = 'runs/detect/space_station_medium_final/weights/best.pt'
-        if not os.path.exists(model_path):
-             model_path = 'yolov8m.pt'
-        return YOLO(model_path)
+        return get_model()  # fastest backend on this host, exported once per weights hash
+
+    # Raw detections shared by every session; sliders re-filter these instead of re-running the model
+    @st.cache_resource
+    def get_detection_cache():
+        return DetectionCache(max_entries=256, max_bytes=64 << 20)
 
-    try:
-        model = load_model()
-    except Exception as e:
-        st.error(f"Error loading model: {e}")
-        st.stop()
+    def display_copy(image):
+        """One RGB array at most DISPLAY_MAX_SIDE on its longest side, and its scale from the original."""
+        scale = min(1.0, DISPLAY_MAX_SIDE / max(image.size))
+        if scale < 1.0:
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+        return np.asarray(image.convert('RGB')), scale
 
-    uploaded_file = st.file_uploader("Upload visual feed...", type=['jpg', 'png', 'jpeg'])
+    def draw_detections(display, scale, detections):
+        canvas = display.copy()  # display-sized, so the per-rerun copy is small
+        names = detections.names
+        thickness = max(2, round(sum(canvas.shape[:2]) / 600))
+        for (x1, y1, x2, y2), s, c in zip(detections.scaled(scale).astype(int), detections.scores,
+                                          detections.classes):
+            color = PALETTE[c % len(PALETTE)]
+            cv2.rectangle(canvas, (x1, y1), (x2, y2), color, thickness)
+            cv2.putText(canvas, f"{names[c]} {s:.2f}", (x1, max(y1 - 6, 12)),
+                        cv2.FONT_HERSHEY_SIMPLEX, thickness / 3, color, max(1, thickness // 2))
+        return canvas
+
+    server = server_info()
+    if server:
+        st.caption(f"🛰️ Inference server: {DEFAULT_URL}")
+        model_id = f"{DEFAULT_URL}:{server['model']}"
+    else:
+        try:
+            model = load_model()
+        except Exception as e:
+            st.error(f"Error loading model: {e}")
+            st.stop()
+        model_id = resolve_model_path()
+
+    feed_type = st.radio("Feed type", ["🖼️ Image", "🗂️ Bulk", "🎬 Video"], horizontal=True,
+                         label_visibility="collapsed")
+    uploaded_file = uploaded_video = None
+    uploaded_batch = []
+    if feed_type == "🎬 Video":
+        uploaded_video = st.file_uploader("Upload video feed...", type=['mp4', 'avi', 'mov', 'mkv'])
+    elif feed_type == "🗂️ Bulk":
+        uploaded_batch = st.file_uploader("Upload captures or zip archives...", type=['jpg', 'png', 'jpeg', 'zip'],
+                                          accept_multiple_files=True)
+    else:
+        uploaded_file = st.file_uploader("Upload visual feed...", type=['jpg', 'png', 'jpeg'])
 
     if uploaded_file:
-        image = Image.open(uploaded_file)
+        image_bytes = uploaded_file.getvalue()
+        image = None
+        # The full-resolution frame is only decoded for a new upload or a detection-cache miss;
+        # slider reruns reuse the display-sized copy kept in the session
+        shown = st.session_state.get('display_copy')
+        if shown is None or shown[0] != image_key(image_bytes, 'display'):
+            with stage('decode'):
+                image = Image.open(io.BytesIO(image_bytes))
+                image.load()
+            with stage('downscale'):
+                shown = (image_key(image_bytes, 'display'), *display_copy(image))
+            st.session_state['display_copy'] = shown
+        _, display, scale = shown
         
         col1, col2 = st.columns([1, 1])
-        with col1:
-            st.image(image, caption="Original Feed", use_container_width=True)
+        with col1, stage('display'):
+            st.image(display, caption="Original Feed", use_container_width=True)
 
-        with st.spinner("🛰️ Processing..."):
-            results = model.predict(image, conf=conf_threshold, iou=iou_threshold)
-            res_plotted = results[0].plot()
-            res_image = Image.fromarray(res_plotted[..., ::-1])
-            
-            # Count detections
-            detections = results[0].boxes.cls.tolist()
-            names = results[0].names
-            counts = {}
-            for d in detections:
-                n = names[int(d)]
-                counts[n] = counts.get(n, 0) + 1
-
-        with col2:
+        cache = get_detection_cache()
+        key = image_key(image_bytes, f"{model_id}:tiled" if tiled else model_id)
+        raw = cache.get(key)
+        if raw is None:
+            if image is None and (tiled or not server):  # the server decodes its own copy
+                with stage('decode'):
+                    image = Image.open(io.BytesIO(image_bytes))
+                    image.load()
+            with st.spinner("🛰️ Processing..."):
+                if tiled:
+                    # Tiles always run locally; candidates are cached unmerged, the cross-tile merge runs below
+                    frame = np.array(image.convert('RGB'))[..., ::-1]
+                    with stage('predict_tiled'):
+                        results = predict_tiled(load_model(), [frame], conf=RAW_CONF, iou=RAW_IOU,
+                                                merge='none', max_det=RAW_MAX_DET)
+                    raw = RawDetections.from_result(results[0])
+                elif server:
+                    with stage('predict_remote'):  # the server's own stages are under its /metrics
+                        record = predict_remote(image_bytes, conf=RAW_CONF, iou=RAW_IOU,
+                                                max_det=RAW_MAX_DET)
+                    raw = RawDetections.from_record(record, {int(k): v for k, v in server['names'].items()})
+                else:
+                    with stage('predict'):
+                        results = model.predict(image, conf=RAW_CONF, iou=RAW_IOU, max_det=RAW_MAX_DET)
+                    record_speed(results)  # preprocess / forward / nms split of that call
+                    raw = RawDetections.from_result(results[0])
+                cache.put(key, raw)
+
+        # Slider changes only land here: NumPy filter + NMS on the cached candidates
+        with stage('refilter'):
+            detections = refilter(raw, conf_threshold, iou_threshold)
+            if tiled:
+                # Same IoS merge as predict.py --tile: a box cut at a tile edge lies inside the whole one
+                detections = Detections(*merge_detections(detections.boxes, detections.scores, detections.classes),
+                                        detections.names, detections.shape)
+        with stage('draw'):
+            res_image = draw_detections(display, scale, detections)
+
+        counts = detections.counts()  # one bincount over the class ids
+
+        with col2, stage('display'):
             st.image(res_image, caption="AI Analysis", use_container_width=True)
             
         st.markdown("### 📋 Detected Assets")
@@ -147,53 +265,138 @@ with tab1:
             cols = st.columns(len(counts))
             for i, (k, v) in enumerate(counts.items()):
                 cols[i].metric(k, v)
+            st.download_button("⬇️ Detections (JSON)", pd.Series(detections.to_records()).to_json(orient='values'),
+                               f"{Path(uploaded_file.name).stem}_detections.json", mime="application/json")
         else:
             st.info("No objects detected above threshold.")
 
+    if uploaded_batch and st.button("▶️ Run bulk detection"):
+        # Background thread (bulk.py): streamed decode, batched local inference, CSV / JSONL on disk
+        # The job loads its own model: the cached one is shared with the image path, and predictor args
+        # set by one caller would leak into the other's batches
+        previous = st.session_state.get('bulk_job')
+        if previous is not None:
+            previous.stop()
+            previous.join()
+        st.session_state['bulk_job'] = BulkJob(uploaded_batch, Path(tempfile.mkdtemp(prefix='bulk_')),
+                                               conf=conf_threshold, iou=iou_threshold)
+
+    # Polls the running job; only counters and totals are read, no images are kept for display
+    @st.fragment(run_every=BULK_REFRESH_S)
+    def bulk_progress():
+        job = st.session_state.get('bulk_job')
+        if job is None:
+            return
+        progress = job.poll()
+        done, total = progress['images'], max(progress['total'], 1)
+        rate = done / max(progress.get('seconds', 0), 1e-9)
+        st.progress(min(done / total, 1.0),
+                    text=f"{done}/{progress['total']} images | {progress['boxes']} detections | {rate:.1f} img/s")
+        if progress['failed']:
+            st.warning(f"{progress['failed']} files could not be decoded and were skipped.")
+        if progress['error']:
+            st.error(f"Bulk detection failed: {progress['error']}")
+        if progress['totals']:
+            st.markdown("### 📋 Detected Assets (all images)")
+            totals = {k: v for k, v in progress['totals'].items() if v}
+            if totals:
+                cols = st.columns(len(totals))
+                for i, (k, v) in enumerate(totals.items()):
+                    cols[i].metric(k, v)
+        if not progress['done']:
+            if st.button("⏹️ Stop"):
+                job.stop()
+        elif progress.get('csv') and os.path.exists(progress['csv']):
+            col_csv, col_jsonl = st.columns(2)
+            with open(progress['csv'], 'rb') as f:
+                col_csv.download_button("💾 Detections (CSV)", f, "detections.csv", mime="text/csv")
+            with open(progress['jsonl'], 'rb') as f:
+                col_jsonl.download_button("💾 Detections (JSONL)", f, "predictions.jsonl",
+                                          mime="application/jsonl")
+
+    if feed_type == "🗂️ Bulk":
+        bulk_progress()
+
+    if uploaded_video and st.button("▶️ Track video"):
+        # Tracking needs every frame, so it always runs on the local model (decode thread + frame skipping)
+        video_dir = Path(tempfile.mkdtemp(prefix='video_'))
+        video_path = video_dir / uploaded_video.name
+        video_path.write_bytes(uploaded_video.getvalue())
+
+        frame_slot = st.empty()
+        counts_slot = st.empty()
+
+        def show_frame(index, annotated, counts):
+            if index % 5 == 0:  # refreshing Streamlit on every frame would cost more than inference
+                frame_slot.image(annotated[..., ::-1], caption=f"Frame {index}", use_container_width=True)
+                counts_slot.caption(" | ".join(f"{k}: {v}" for k, v in counts.items()) or "No tracks yet")
+
+        with st.spinner("🎬 Tracking..."):
+            summary = process_video(str(video_path), out_dir=video_dir / 'out', model=load_model(),
+                                    conf=conf_threshold, iou=iou_threshold, on_frame=show_frame)
+
+        st.caption(f"{summary['frames']} frames | {summary['key_frames']} detected "
+                   f"({summary['key_frame_ratio'] * 100:.0f}%) | {summary['processing_fps']:.1f} FPS")
+        st.markdown("### 📋 Tracked Assets")
+        if summary['counts']:
+            cols = st.columns(len(summary['counts']))
+            for i, (k, v) in enumerate(summary['counts'].items()):
+                cols[i].metric(k, v)
+        else:
+            st.info("No objects tracked above threshold.")
+        st.download_button("💾 Download tracked video", (video_dir / 'out' / 'tracked.mp4').read_bytes(),
+                           file_name=f"tracked_{Path(uploaded_video.name).stem}.mp4", mime="video/mp4")
+
 # ================= ANALYTICS TAB =================
 with tab2:
     st.markdown("### 📊 Training & Performance analytics")
     
-    # 1. TRAINING CURVES
+    # 1. TRAINING CURVES (streamed: only rows appended since the last refresh are parsed)
     st.subheader("1. Training Progress (mAP & Loss)")
-    # Corrected path with double runs/detect
-    csv_path = 'runs/detect/runs/detect/space_station_medium_final/results.csv'
-    if not os.path.exists(csv_path):
-        # Fallback to single path just in case
-        csv_path = 'runs/detect/space_station_medium_final/results.csv'
-        
-    if os.path.exists(csv_path):
-        df = pd.read_csv(csv_path)
-        # Clean column names (strip whitespace)
-        df.columns = df.columns.str.strip()
-        
+
+    @st.cache_resource
+    def get_telemetry():
+        return TrainingTelemetry()
+
+    @st.fragment(run_every=TELEMETRY_REFRESH_S)
+    def training_curves():
+        telemetry = get_telemetry()
+        telemetry.poll()
+        runs = telemetry.runs()
+        if not runs:
+            st.warning(f"No results.csv found under {RUNS_ROOT}")
+            return
+        active = telemetry.active()
+        best = [r['name'] for r in list_runs(with_weights=True)[:1]]
+        st.session_state.setdefault('telemetry_runs', active or [r for r in best if r in runs] or runs[-1:])
+        selected = st.multiselect("Runs", runs, key='telemetry_runs')
+        if active:
+            st.caption(f"🟢 Training now: {', '.join(active)} (refreshing every {TELEMETRY_REFRESH_S}s)")
+
         c1, c2 = st.columns(2)
         with c1:
             st.markdown("**Mean Average Precision (mAP)**")
-            if 'metrics/mAP50(B)' in df.columns:
-                map_data = df[['metrics/mAP50(B)', 'metrics/mAP50-95(B)']]
-                st.line_chart(map_data, color=["#FF4B4B", "#00FFAA"])
-            else:
-                st.info("mAP data columns not found in CSV.")
+            metric = st.selectbox("Metric", ['metrics/mAP50(B)', 'metrics/mAP50-95(B)',
+                                             'metrics/precision(B)', 'metrics/recall(B)'], key='telemetry_metric')
+            st.line_chart(telemetry.overlay(metric, selected), x_label="epoch")
         with c2:
             st.markdown("**Training Loss**")
-            loss_cols = ['train/box_loss', 'train/cls_loss', 'train/dfl_loss']
-            if all(col in df.columns for col in loss_cols):
-                loss_data = df[loss_cols]
-                st.line_chart(loss_data)
-            else:
-                st.info("Loss data columns not found in CSV.")
-    else:
-        st.warning(f"Results CSV not found at: {csv_path}")
+            loss = st.selectbox("Loss", ['train/box_loss', 'train/cls_loss', 'train/dfl_loss',
+                                         'val/box_loss', 'val/cls_loss', 'val/dfl_loss'], key='telemetry_loss')
+            st.line_chart(telemetry.overlay(loss, selected), x_label="epoch")
+
+    training_curves()
 
     st.markdown("---")
 
     # 2. CONFUSION MATRIX & PR CURVE
     st.subheader("2. Model Reliability (Test Set)")
+    # Validation folders come from the run registry (run_registry.py), newest first
+    val_run = st.selectbox("Validation run", ['latest-val'] + [r['name'] for r in list_runs(kind='val')])
+    artifacts = run_artifacts(val_run, kind='val')
     col_cm, col_pr = st.columns(2)
     
-    cm_path = 'runs/detect/val10/confusion_matrix_normalized.png'
-    if not os.path.exists(cm_path): cm_path = 'runs/detect/val10/confusion_matrix.png'
+    cm_path = artifacts.get('confusion_matrix_normalized.png') or artifacts.get('confusion_matrix.png', '')
     
     with col_cm:
         st.markdown("**Confusion Matrix**")
@@ -204,7 +407,7 @@ with tab2:
             
     with col_pr:
         st.markdown("**Precision-Recall Curve**")
-        pr_path = 'runs/detect/val10/BoxPR_curve.png'
+        pr_path = artifacts.get('BoxPR_curve.png', '')
         if os.path.exists(pr_path):
             st.image(pr_path, caption="Precision vs Recall Trade-off", use_container_width=True)
         else:
@@ -215,13 +418,72 @@ with tab2:
     # 3. DATASET DISTRIBUTION
     st.subheader("3. Dataset Challenges")
     st.markdown("The dataset presented significant class imbalance, which we addressed using **Copy-Paste Augmentation** and **Focal Loss**.")
-    # Corrected path with double runs/detect
-    labels_path = 'runs/detect/runs/detect/space_station_medium_final/labels.jpg'
-    if not os.path.exists(labels_path):
-        labels_path = 'runs/detect/space_station_medium_final/labels.jpg'
+
+    # Columnar label index (label_index.py); reloaded only when the file changes
+    @st.cache_data
+    def load_label_index(mtime):
+        return LabelIndex.load(INDEX_FILE)
+
+    if st.button("🔄 Re-index labels", help="Parses only label files that changed since the last index"):
+        with st.spinner("🏷️ Indexing labels..."):
+            build_index(workers=os.cpu_count())
+
+    if INDEX_FILE.exists():
+        index = load_label_index(INDEX_FILE.stat().st_mtime_ns)
+        available = [s for s, n in zip(SPLITS, index.split_images()) if n]
+        split_choice = st.radio("Split", ["all"] + available, horizontal=True)
+        split = None if split_choice == "all" else split_choice
+
+        counts = index.class_counts(split)
+        present = counts[counts > 0]
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Boxes", f"{counts.sum():,}")
+        c2.metric("Rarest class", index.names[int(np.argmin(counts))], f"{counts.min():,} boxes", delta_color="off")
+        c3.metric("Imbalance (max/min)", f"{present.max() / present.min():.1f}x" if len(present) else "-")
+
+        col_counts, col_sizes = st.columns(2)
+        with col_counts:
+            st.markdown("**Boxes per class**")
+            st.bar_chart(pd.DataFrame({'boxes': counts}, index=index.names), color="#FF4B4B")
+        with col_sizes:
+            st.markdown("**Box size (sqrt of area, % of image)**")
+            size_class = st.selectbox("Class", ["all"] + index.names, label_visibility="collapsed")
+            hist, edges = index.size_histogram(None if size_class == "all" else index.names.index(size_class), split)
+            centers = [f"{np.sqrt(a * b) * 100:.1f}" for a, b in zip(edges[:-1], edges[1:])]
+            st.bar_chart(pd.DataFrame({'boxes': hist}, index=centers), color="#00FFAA")
+
+        st.markdown("**Per-split share of each class**")
+        per_split = pd.DataFrame({s: index.class_counts(s) for s in available}, index=index.names)
+        share = per_split / per_split.sum().replace(0, 1) * 100
+        st.dataframe(per_split.astype(str) + " (" + share.round(1).astype(str) + "%)", use_container_width=True)
+    else:
+        st.info("No label index yet. Click **Re-index labels** or run `python label_index.py`.")
+
+    # labels.jpg of the run behind the 'best' alias (run_registry.py)
+    labels_path = run_artifacts('best').get('labels.jpg', '')
     
     if os.path.exists(labels_path):
-        st.image(labels_path, caption="Class Instance Distribution", use_container_width=True)
-    else:
-        st.info(f"Labels image not found at: {labels_path}")
+        with st.expander("Training label plot (labels.jpg)"):
+            st.image(labels_path, caption="Class Instance Distribution", use_container_width=True)
 
+# --- STAGE TIMING (sidebar debug panel) ---
+if timing_enabled():
+    with timing_slot.container():
+        st.markdown("**⏱️ Stage timing (this process)**")
+        stages = snapshot()
+        if stages:
+            timing = pd.DataFrame(stages).T[['count', 'mean_ms', 'p50_ms', 'p95_ms']]
+            st.dataframe(timing.sort_values('mean_ms', ascending=False), use_container_width=True)
+            st.bar_chart(timing['p95_ms'], color="#00FFAA")
+            st.download_button("⬇️ timing.json", pd.Series(stages).to_json(indent=2), "timing.json",
+                               mime="application/json")
+            st.download_button("⬇️ Prometheus text", prometheus_text(), "timing.prom", mime="text/plain")
+            if st.button("Reset timings"):
+                reset_timing()
+        else:
+            st.caption("No stages recorded yet - upload an image.")
+        server_timing = fetch_timing() if server_stats else None
+        if server_timing:
+            st.markdown("**🛰️ Inference server stages**")
+            st.dataframe(pd.DataFrame(server_timing).T[['count', 'mean_ms', 'p50_ms', 'p95_ms']],
+                         use_container_width=True)
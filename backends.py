@@ -0,0 +1,185 @@
+"""
+INFERENCE BACKENDS - Export best.pt once, pick the fastest runtime on this host
+
+get_model() is the single entry point every script uses to obtain a model:
+  1. Resolves the weights through run_registry.py: an alias ('best' by
+     default, 'latest'), a run name or a path.
+  2. Exports them once per input size to ONNX, OpenVINO IR and TorchScript
+     (TorchScript has a static shape). Artifacts live in
+     weights/exports/<stem>/<weights hash>/<stem>_<imgsz>.*, so retraining
+     (new hash) invalidates them and stale export folders are removed.
+  3. Warms every backend up, measures its latency on this host and caches the
+     winner per host and imgsz in the same folder.
+
+TTA (augment=True) only exists for the PyTorch model, so callers that need it
+ask for backend='pytorch'.
+
+Usage:
+    python backends.py                 # export + benchmark, print the ranking
+    python backends.py --refresh       # re-measure even if a selection is cached
+"""
+
+from ultralytics import YOLO
+from pathlib import Path
+import argparse
+import platform
+import hashlib
+import shutil
+import json
+import time
+import numpy as np
+import torch
+import os
+
+BACKENDS = ['pytorch', 'onnx', 'openvino', 'torchscript']
+
+# Produced by quantize.py (needs calibration data), so it is opt-in and never auto-selected
+INT8_ARTIFACT = '{stem}_{imgsz}_int8.onnx'
+
+# backend -> (ultralytics export format, artifact name relative to the export dir)
+EXPORTS = {
+    'onnx': ('onnx', '{stem}_{imgsz}.onnx'),
+    'openvino': ('openvino', '{stem}_{imgsz}_openvino_model'),
+    'torchscript': ('torchscript', '{stem}_{imgsz}.torchscript'),
+}
+
+
+def resolve_model_path(ref=None):
+    """Weights path for ref (alias, run name or path); None = 'best' or the pretrained fallback."""
+    from run_registry import PRETRAINED_FALLBACK, resolve_model  # run_registry imports this module
+    if ref is not None:
+        return resolve_model(ref)
+    try:
+        return resolve_model('best')
+    except FileNotFoundError:
+        return PRETRAINED_FALLBACK
+
+
+def default_device():
+    return 0 if torch.cuda.is_available() else 'cpu'
+
+
+def weights_hash(model_path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def export_dir(model_path, digest=None):
+    digest = digest or weights_hash(model_path)
+    return Path(model_path).parent / 'exports' / Path(model_path).stem / digest[:12]
+
+
+def _remove_stale_exports(current):
+    for d in current.parent.iterdir():
+        if d.is_dir() and d != current:
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def export_backend(model_path, backend, imgsz=640, digest=None):
+    """Path of the exported artifact, exporting only if it is not cached yet."""
+    if backend == 'pytorch':
+        return Path(model_path)
+    out_dir = export_dir(model_path, digest)
+    if backend == 'onnx_int8':
+        artifact = out_dir / INT8_ARTIFACT.format(stem=Path(model_path).stem, imgsz=imgsz)
+        if not artifact.exists():
+            raise FileNotFoundError(f"No INT8 model for these weights yet, run quantize.py ({artifact})")
+        return artifact
+    fmt, name = EXPORTS[backend]
+    artifact = out_dir / name.format(stem=Path(model_path).stem, imgsz=imgsz)
+    if artifact.exists():
+        return artifact
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    _remove_stale_exports(out_dir)
+    print(f"   📦 Exporting {backend} -> {artifact}")
+    dynamic = backend in ('onnx', 'openvino')  # allow batched inference
+    exported = YOLO(model_path).export(format=fmt, imgsz=imgsz, dynamic=dynamic, device='cpu', verbose=False)
+    shutil.move(str(exported), str(artifact))
+    from run_registry import register_run
+    register_run(Path(model_path).parent.parent)  # index the new export under its run
+    return artifact
+
+
+def load_backend(model_path, backend, imgsz=640, digest=None):
+    artifact = export_backend(model_path, backend, imgsz, digest)
+    return YOLO(str(artifact), task='detect')
+
+
+def measure_latency(model, imgsz=640, runs=20, warmup=3, device=None):
+    """Median single-image latency (ms) on a synthetic frame, after warm-up."""
+    frame = np.random.randint(0, 255, (imgsz, imgsz, 3), dtype=np.uint8)
+    for _ in range(warmup):
+        model.predict(frame, imgsz=imgsz, device=device, verbose=False)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model.predict(frame, imgsz=imgsz, device=device, verbose=False)
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times))
+
+
+def _host_key():
+    return f"{platform.node()}-{platform.machine()}-{os.cpu_count()}cpu-{'cuda' if torch.cuda.is_available() else 'nocuda'}"
+
+
+def select_backend(model_path, imgsz=640, candidates=BACKENDS, refresh=False, digest=None):
+    """Benchmark every backend once per host, weights hash and imgsz; return the fastest."""
+    digest = digest or weights_hash(model_path)
+    selection_file = export_dir(model_path, digest) / 'selection.json'
+    selections = json.loads(selection_file.read_text()) if selection_file.exists() else {}
+    key = f"{_host_key()}-{imgsz}px"
+    if key in selections and not refresh:
+        return selections[key]['backend']
+
+    print("="*70)
+    print(f"⚙️ SELECTING INFERENCE BACKEND (imgsz {imgsz})")
+    print("="*70)
+    latencies = {}
+    for backend in candidates:
+        try:
+            model = load_backend(model_path, backend, imgsz, digest)
+            device = default_device() if backend == 'pytorch' else 'cpu'
+            latencies[backend] = measure_latency(model, imgsz, device=device)
+            print(f"   {backend:<12} {latencies[backend]:8.1f} ms")
+        except Exception as e:
+            print(f"   ⚠️ {backend:<12} unavailable: {e}")
+    best = min(latencies, key=latencies.get) if latencies else 'pytorch'
+    print(f"🏆 Fastest on this host: {best}")
+    print("="*70 + "\n")
+
+    selections[key] = {'backend': best, 'latency_ms': latencies, 'imgsz': imgsz, 'measured': time.time()}
+    selection_file.parent.mkdir(parents=True, exist_ok=True)
+    selection_file.write_text(json.dumps(selections, indent=2))
+    return best
+
+
+def get_model(model_path=None, backend='auto', imgsz=640):
+    """The one way to get a model: resolve weights, pick (or force) a backend, load it."""
+    model_path = str(resolve_model_path(model_path))
+    if not model_path.endswith('.pt') or not os.path.exists(model_path):
+        return YOLO(model_path)  # already an exported artifact, or a hub name to download
+    if backend == 'pytorch':
+        return YOLO(model_path)
+    digest = weights_hash(model_path)
+    if backend == 'auto':
+        backend = select_backend(model_path, imgsz, digest=digest)
+    return load_backend(model_path, backend, imgsz, digest)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export and benchmark CPU inference backends")
+    parser.add_argument('--model', default=None, help="Weights path, run name or alias (default: best)")
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--refresh', action='store_true', help="Re-measure even if cached")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+    args = parse_args()
+    select_backend(resolve_model_path(args.model), args.imgsz, refresh=args.refresh)
@@ -0,0 +1,258 @@
+"""
+INFERENCE BENCHMARK - Reproducible latency/throughput sweep with history
+
+Sweeps imgsz x batch x TTA (augment=True, as in test.py) x backend x threads.
+Every configuration runs in a fresh subprocess (so thread settings, model load
+time and peak RSS are isolated) and reports:
+    p50 / p95 / p99 batch latency, images/sec, peak RSS, model load time
+
+Runs are appended to runs/benchmark/history.json together with the git commit,
+weights hash and host. Compare mode matches configurations between two runs
+(selected by commit, checkpoint/run name or run id) and exits non-zero when
+latency or throughput regress beyond --tolerance, so it can gate a merge.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --imgsz 480 640 --batch 1 8 --backends pytorch onnx --threads 2 4 8
+    python benchmark.py --compare 1a2b3c4 HEAD --tolerance 0.10
+"""
+
+from pathlib import Path
+import subprocess
+import itertools
+import argparse
+import platform
+import json
+import time
+import sys
+import os
+
+HISTORY_FILE = Path('runs/benchmark/history.json')
+
+# Metrics where higher is worse / lower is worse when comparing runs
+LATENCY_KEYS = ['p50_ms', 'p95_ms', 'p99_ms', 'load_s', 'peak_rss_mb']
+THROUGHPUT_KEYS = ['images_per_s']
+
+
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:  # Windows
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1e6
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def config_key(config):
+    return (config['imgsz'], config['batch'], config['augment'], config['backend'], config['threads'])
+
+
+def load_frames(split, n):
+    """First n decoded images of a split, or synthetic 720p frames if the dataset is absent."""
+    import numpy as np
+    import cv2
+    from dataset_utils import split_image_paths
+    try:
+        paths = split_image_paths(split)[:n]
+    except (KeyError, OSError):
+        paths = []
+    frames = [f for f in (cv2.imread(str(p)) for p in paths) if f is not None]
+    if not frames:
+        rng = np.random.default_rng(0)
+        frames = [rng.integers(0, 255, (720, 1280, 3), dtype=np.uint8) for _ in range(n)]
+    return frames
+
+
+def run_worker(config):
+    """Measure ONE configuration. Runs in its own process (see --worker)."""
+    import numpy as np
+    import torch
+    torch.set_num_threads(config['threads'])
+    from backends import get_model, default_device
+
+    start = time.perf_counter()
+    model = get_model(config['model'], backend=config['backend'], imgsz=config['imgsz'])
+    load_s = time.perf_counter() - start
+
+    device = config.get('device') or (default_device() if config['backend'] == 'pytorch' else 'cpu')
+    frames = load_frames(config['split'], config['images'])
+    batches = [frames[i:i + config['batch']] for i in range(0, len(frames), config['batch'])]
+    kwargs = dict(imgsz=config['imgsz'], augment=config['augment'], device=device, verbose=False)
+
+    for batch in batches[:config['warmup']]:
+        model.predict(batch, **kwargs)
+    latencies = []
+    total_start = time.perf_counter()
+    for batch in batches:
+        t = time.perf_counter()
+        model.predict(batch, **kwargs)
+        latencies.append((time.perf_counter() - t) * 1000)
+    total = time.perf_counter() - total_start
+
+    lat = np.asarray(latencies)
+    return {
+        'p50_ms': float(np.percentile(lat, 50)),
+        'p95_ms': float(np.percentile(lat, 95)),
+        'p99_ms': float(np.percentile(lat, 99)),
+        'images_per_s': len(frames) / total,
+        'peak_rss_mb': peak_rss_mb(),
+        'load_s': load_s,
+    }
+
+
+def run_config(config):
+    env = dict(os.environ, OMP_NUM_THREADS=str(config['threads']), MKL_NUM_THREADS=str(config['threads']),
+               OPENBLAS_NUM_THREADS=str(config['threads']))
+    proc = subprocess.run([sys.executable, __file__, '--worker', json.dumps(config)],
+                          capture_output=True, text=True, env=env)
+    if proc.returncode != 0:
+        return {'error': (proc.stderr.strip().splitlines() or ['unknown error'])[-1]}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def load_history():
+    return json.loads(HISTORY_FILE.read_text()) if HISTORY_FILE.exists() else []
+
+
+def run_benchmark(model=None, imgsz=(640,), batch=(1, 8), augment=(False, True), backends=('pytorch',),
+                  threads=(os.cpu_count() or 1,), images=64, warmup=2, split='val'):
+    from backends import resolve_model_path, weights_hash
+    model = resolve_model_path(model)
+    configs = []
+    for s, b, a, be, t in itertools.product(imgsz, batch, augment, backends, threads):
+        if a and be != 'pytorch':
+            continue  # TTA only exists for the PyTorch model
+        configs.append({'model': model, 'imgsz': s, 'batch': b, 'augment': a, 'backend': be, 'threads': t,
+                        'images': images, 'warmup': warmup, 'split': split})
+
+    print("="*70)
+    print("⏱️ INFERENCE BENCHMARK")
+    print("="*70)
+    print(f"Model: {model}")
+    print(f"Configurations: {len(configs)} | {images} images each")
+    print("="*70)
+    print(f"{'imgsz':>5} {'batch':>5} {'TTA':>4} {'backend':<12} {'thr':>3} "
+          f"{'p50':>8} {'p95':>8} {'p99':>8} {'img/s':>7} {'RSS MB':>7} {'load s':>6}")
+    print("-"*70)
+
+    results = []
+    for config in configs:
+        metrics = run_config(config)
+        results.append({**{k: config[k] for k in ('imgsz', 'batch', 'augment', 'backend', 'threads')}, **metrics})
+        prefix = f"{config['imgsz']:>5} {config['batch']:>5} {'on' if config['augment'] else 'off':>4} " \
+                 f"{config['backend']:<12} {config['threads']:>3}"
+        if 'error' in metrics:
+            print(f"{prefix} ⚠️ {metrics['error']}")
+        else:
+            print(f"{prefix} {metrics['p50_ms']:>8.1f} {metrics['p95_ms']:>8.1f} {metrics['p99_ms']:>8.1f} "
+                  f"{metrics['images_per_s']:>7.1f} {metrics['peak_rss_mb']:>7.0f} {metrics['load_s']:>6.2f}")
+
+    history = load_history()
+    run = {
+        'id': len(history),
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'commit': git_commit(),
+        'model': model,
+        'run_name': Path(model).parent.parent.name,
+        'weights_hash': weights_hash(model) if os.path.exists(model) else None,
+        'host': {'node': platform.node(), 'machine': platform.machine(), 'cpus': os.cpu_count(),
+                 'python': platform.python_version()},
+        'results': results,
+    }
+    history.append(run)
+    HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
+    HISTORY_FILE.write_text(json.dumps(history, indent=2))
+    print("="*70)
+    print(f"💾 Run #{run['id']} (commit {run['commit']}) appended to {HISTORY_FILE}")
+    print("="*70 + "\n")
+    return run
+
+
+def find_run(history, ref):
+    """Latest run matching a run id, commit prefix, run name or weights path."""
+    if ref == 'HEAD':
+        ref = git_commit()
+    for run in reversed(history):
+        if str(run['id']) == ref or run['commit'].startswith(ref) or ref in (run['run_name'], run['model']):
+            return run
+    raise SystemExit(f"❌ No benchmark run matches '{ref}' in {HISTORY_FILE}")
+
+
+def compare_runs(base_ref, new_ref, tolerance=0.10):
+    history = load_history()
+    base, new = find_run(history, base_ref), find_run(history, new_ref)
+    base_results = {config_key(r): r for r in base['results'] if 'error' not in r}
+
+    print("="*70)
+    print(f"🔍 BENCHMARK COMPARE: #{base['id']} ({base['commit']}, {base['run_name']}) "
+          f"-> #{new['id']} ({new['commit']}, {new['run_name']})")
+    print(f"   Tolerance: {tolerance * 100:.0f}%")
+    print("="*70)
+
+    regressions = []
+    matched = 0
+    for r in new['results']:
+        old = base_results.get(config_key(r))
+        if old is None or 'error' in r:
+            continue
+        matched += 1
+        label = f"imgsz={r['imgsz']} batch={r['batch']} tta={r['augment']} {r['backend']} x{r['threads']}"
+        for key in LATENCY_KEYS + THROUGHPUT_KEYS:
+            change = (r[key] - old[key]) / max(old[key], 1e-9)
+            worse = change > tolerance if key in LATENCY_KEYS else change < -tolerance
+            if worse:
+                regressions.append(label)
+                print(f"❌ {label:<48} {key:<13} {old[key]:>9.2f} -> {r[key]:>9.2f} ({change * 100:+.1f}%)")
+
+    print("-"*70)
+    if matched == 0:
+        print("⚠️ No matching configurations between the two runs.")
+    elif regressions:
+        print(f"❌ {len(set(regressions))}/{matched} configurations regressed.")
+    else:
+        print(f"✅ No regressions across {matched} configurations.")
+    print("="*70 + "\n")
+    return not regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Inference benchmark with history and regression gating")
+    parser.add_argument('--model', default=None, help="Weights path, run name or alias (default: best)")
+    parser.add_argument('--imgsz', type=int, nargs='+', default=[640])
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--tta', choices=['off', 'on', 'both'], default='both')
+    parser.add_argument('--backends', nargs='+', default=['pytorch'],
+                        choices=['pytorch', 'onnx', 'openvino', 'torchscript', 'onnx_int8'])
+    parser.add_argument('--threads', type=int, nargs='+', default=[os.cpu_count() or 1])
+    parser.add_argument('--images', type=int, default=64, help="Images per configuration")
+    parser.add_argument('--warmup', type=int, default=2, help="Warm-up batches")
+    parser.add_argument('--split', default='val', help="Split to take images from")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help="Compare two runs instead")
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+    args = parse_args()
+    if args.worker:
+        print(json.dumps(run_worker(json.loads(args.worker))))
+    elif args.compare:
+        sys.exit(0 if compare_runs(*args.compare, tolerance=args.tolerance) else 1)
+    else:
+        augment = {'off': [False], 'on': [True], 'both': [False, True]}[args.tta]
+        run_benchmark(model=args.model, imgsz=args.imgsz, batch=args.batch, augment=augment,
+                      backends=args.backends, threads=args.threads, images=args.images,
+                      warmup=args.warmup, split=args.split)
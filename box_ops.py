@@ -0,0 +1,134 @@
+"""
+BOX OPERATIONS - NumPy IoU, NMS and Weighted Box Fusion
+
+Everything here works on xyxy boxes (pixel or normalized, as long as both
+inputs use the same space) so it can run on cached predictions without torch.
+"""
+
+import numpy as np
+
+
+def box_iou(boxes1, boxes2, eps=1e-7):
+    """Pairwise IoU matrix of shape (len(boxes1), len(boxes2))."""
+    boxes1 = np.asarray(boxes1, dtype=np.float32).reshape(-1, 4)
+    boxes2 = np.asarray(boxes2, dtype=np.float32).reshape(-1, 4)
+    lt = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    rb = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(2)
+    area1 = (boxes1[:, 2:] - boxes1[:, :2]).clip(0).prod(1)
+    area2 = (boxes2[:, 2:] - boxes2[:, :2]).clip(0).prod(1)
+    return inter / (area1[:, None] + area2[None, :] - inter + eps)
+
+
+def box_ios(boxes1, boxes2, eps=1e-7):
+    """Intersection over the smaller box: 1.0 when one box lies inside the other.
+
+    Used to merge a box cut off at a tile border with the full box from the
+    neighbouring tile, a pair whose plain IoU can be low.
+    """
+    boxes1 = np.asarray(boxes1, dtype=np.float32).reshape(-1, 4)
+    boxes2 = np.asarray(boxes2, dtype=np.float32).reshape(-1, 4)
+    lt = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    rb = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(2)
+    area1 = (boxes1[:, 2:] - boxes1[:, :2]).clip(0).prod(1)
+    area2 = (boxes2[:, 2:] - boxes2[:, :2]).clip(0).prod(1)
+    return inter / (np.minimum(area1[:, None], area2[None, :]) + eps)
+
+
+def class_aware_iou(boxes, classes):
+    """IoU matrix with cross-class pairs zeroed, so one pass handles every class."""
+    iou = box_iou(boxes, boxes)
+    iou *= classes[:, None] == classes[None, :]
+    return iou
+
+
+def nms_from_iou(iou, iou_thr):
+    """Greedy NMS on a precomputed IoU matrix whose rows are sorted by score.
+
+    Returns a boolean keep mask. A box's fate only depends on higher-scored
+    boxes, so the mask for any higher confidence cutoff is simply this mask
+    restricted to the boxes above it.
+    """
+    n = iou.shape[0]
+    keep = np.ones(n, dtype=bool)
+    suppressed = np.zeros(n, dtype=bool)
+    for i in range(n):
+        if suppressed[i]:
+            keep[i] = False
+            continue
+        suppressed |= iou[i] > iou_thr
+    return keep
+
+
+def nms(boxes, scores, classes, iou_thr=0.45, max_det=300):
+    """Class-aware greedy NMS. Returns indices into the inputs, best first.
+
+    Runs one small IoU matrix per class instead of one big masked matrix, which
+    keeps it in the low milliseconds for a thousand candidates.
+    """
+    boxes, scores, classes = np.asarray(boxes), np.asarray(scores), np.asarray(classes)
+    if len(scores) == 0:
+        return np.zeros(0, dtype=np.int64)
+    kept = []
+    for c in np.unique(classes):
+        idx = np.flatnonzero(classes == c)
+        idx = idx[np.argsort(-scores[idx], kind='stable')]
+        kept.append(idx[nms_from_iou(box_iou(boxes[idx], boxes[idx]), iou_thr)])
+    kept = np.concatenate(kept)
+    return kept[np.argsort(-scores[kept], kind='stable')][:max_det]
+
+
+def weighted_boxes_fusion(boxes_list, scores_list, classes_list, weights=None,
+                          iou_thr=0.55, skip_box_thr=0.0, max_det=300):
+    """Fuse per-model detections of ONE image (Solovyev et al. WBF).
+
+    Boxes of all models are pooled, sorted by weighted score and clustered
+    greedily against each cluster's highest-scored box using one class-aware
+    IoU matrix. Each cluster becomes a score-weighted average box; its score is
+    the mean weighted score, down-weighted when fewer models agree.
+
+    Returns (boxes (k, 4), scores (k,), classes (k,)).
+    """
+    n_models = len(boxes_list)
+    weights = np.ones(n_models, dtype=np.float32) if weights is None else np.asarray(weights, dtype=np.float32)
+
+    boxes = np.concatenate([np.asarray(b, dtype=np.float32).reshape(-1, 4) for b in boxes_list])
+    scores = np.concatenate([np.asarray(s, dtype=np.float32) * w for s, w in zip(scores_list, weights)])
+    classes = np.concatenate([np.asarray(c, dtype=np.int32) for c in classes_list])
+    raw_scores = np.concatenate([np.asarray(s, dtype=np.float32) for s in scores_list])
+
+    keep = raw_scores >= skip_box_thr
+    boxes, scores, classes = boxes[keep], scores[keep], classes[keep]
+    if len(scores) == 0:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int32)
+
+    order = np.argsort(-scores, kind='stable')
+    boxes, scores, classes = boxes[order], scores[order], classes[order]
+    iou = class_aware_iou(boxes, classes)
+
+    # Greedy clustering: one vectorized row lookup per cluster, not per box
+    cluster = np.full(len(scores), -1, dtype=np.int64)
+    n_clusters = 0
+    for i in range(len(scores)):
+        if cluster[i] >= 0:
+            continue
+        members = (cluster < 0) & (iou[i] > iou_thr)
+        members[i] = True
+        cluster[members] = n_clusters
+        n_clusters += 1
+
+    score_sum = np.bincount(cluster, weights=scores, minlength=n_clusters)
+    count = np.bincount(cluster, minlength=n_clusters)
+    fused_boxes = np.zeros((n_clusters, 4), dtype=np.float64)
+    np.add.at(fused_boxes, cluster, boxes * scores[:, None])
+    fused_boxes /= score_sum[:, None]
+
+    fused_scores = score_sum / count * np.minimum(count, n_models) / weights.sum()
+    fused_classes = np.zeros(n_clusters, dtype=np.int32)
+    fused_classes[cluster] = classes  # class-aware IoU keeps clusters single-class
+
+    order = np.argsort(-fused_scores, kind='stable')[:max_det]
+    return (fused_boxes[order].astype(np.float32),
+            fused_scores[order].astype(np.float32),
+            fused_classes[order])
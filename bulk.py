@@ -0,0 +1,221 @@
+"""
+BULK DETECTION - A shift's worth of captures (many files or zip archives) in one go
+
+Uploads are expanded lazily: zip members are read one at a time, decoded on a
+small thread pool with a bounded prefetch window (predict.prefetch_images) and
+fed to the model in fixed-size batches. Detections are streamed to disk as
+they arrive:
+  - <out>/detections.csv      one row per box: image, class, confidence, xyxy
+  - <out>/predictions.jsonl   one JSON object per image (same as predict.py)
+
+Only `prefetch` decoded images and one batch of results are alive at any
+time, no overlays are kept, and per-class totals are a running bincount, so
+memory does not depend on how many images are in the archive.
+
+BulkJob runs the same loop on a background thread, with its own model
+instance, so the Live Demo can poll progress and totals while the batches
+are processed.
+
+Usage:
+    python bulk.py shift_captures.zip
+    python bulk.py night_1.zip night_2.zip extra.jpg --batch 16 --out runs/bulk/night
+"""
+
+from pathlib import Path
+import threading
+import argparse
+import zipfile
+import json
+import csv
+import time
+import numpy as np
+import cv2
+import os
+
+from backends import get_model, resolve_model_path
+from predict import IMAGE_EXTENSIONS, batched, prefetch_images, result_to_record
+
+CSV_HEADER = ['image', 'class_id', 'class_name', 'confidence', 'x1', 'y1', 'x2', 'y2']
+
+
+def _is_image(name):
+    return Path(name).suffix.lower() in IMAGE_EXTENSIONS and not Path(name).name.startswith('.')
+
+
+def _zip_members(source, label):
+    with zipfile.ZipFile(source) as archive:
+        for info in archive.infolist():
+            if not info.is_dir() and _is_image(info.filename):
+                # inflated here (the archive closes once the generator ends), decoded on the pool
+                data = archive.read(info)
+                yield f"{label}/{info.filename}", lambda data=data: data
+
+
+def iter_uploads(sources):
+    """Lazily yield (name, read) for every image in `sources`.
+
+    A source is a path or a file-like object with a .name (Streamlit's
+    UploadedFile); .zip sources are expanded member by member. read() returns
+    the encoded bytes.
+    """
+    for source in sources:
+        name = str(getattr(source, 'name', source))
+        if name.lower().endswith('.zip'):
+            yield from _zip_members(source, Path(name).stem)
+        elif _is_image(name):
+            if hasattr(source, 'getvalue'):
+                yield name, source.getvalue
+            else:
+                yield name, Path(source).read_bytes
+
+
+def count_uploads(sources):
+    """Number of images iter_uploads() will yield (zip central directories only, nothing decoded)."""
+    n = 0
+    for source in sources:
+        name = str(getattr(source, 'name', source))
+        if name.lower().endswith('.zip'):
+            with zipfile.ZipFile(source) as archive:
+                n += sum(1 for info in archive.infolist() if not info.is_dir() and _is_image(info.filename))
+            if hasattr(source, 'seek'):
+                source.seek(0)
+        elif _is_image(name):
+            n += 1
+    return n
+
+
+def _decode_upload(item):
+    name, read = item
+    try:
+        return name, cv2.imdecode(np.frombuffer(read(), dtype=np.uint8), cv2.IMREAD_COLOR)
+    except (OSError, cv2.error):
+        return name, None
+
+
+def run_bulk(sources, out_dir='runs/bulk/exp', model=None, batch=8, imgsz=640, conf=0.25, iou=0.45,
+             max_det=300, workers=4, prefetch=32, on_batch=None, stop=None):
+    """Detect every image in `sources`, streaming detections.csv / predictions.jsonl to out_dir.
+
+    on_batch(progress) is called after each batch with the running totals;
+    stop is an optional threading.Event that ends the run after the current batch.
+    """
+    model = model or get_model()
+    names = model.names
+    names = [names[k] for k in sorted(names)] if isinstance(names, dict) else list(names)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    progress = {'images': 0, 'failed': 0, 'boxes': 0, 'totals': dict.fromkeys(names, 0),
+                'csv': str(out_dir / 'detections.csv'), 'jsonl': str(out_dir / 'predictions.jsonl')}
+    totals = np.zeros(len(names), dtype=np.int64)
+    start = time.perf_counter()
+
+    frames = prefetch_images(iter_uploads(sources), workers=workers, prefetch=prefetch, decode=_decode_upload)
+    with open(progress['csv'], 'w', newline='') as csv_file, open(progress['jsonl'], 'w') as jsonl:
+        rows = csv.writer(csv_file)
+        rows.writerow(CSV_HEADER)
+        for chunk in batched(frames, batch):
+            good = [(name, image) for name, image in chunk if image is not None]
+            progress['failed'] += len(chunk) - len(good)
+            if good:
+                results = model.predict([image for _, image in good], imgsz=imgsz, conf=conf, iou=iou,
+                                        max_det=max_det, verbose=False)
+                for (name, _), result in zip(good, results):
+                    record = result_to_record(name, result)
+                    jsonl.write(json.dumps(record) + "\n")
+                    rows.writerows([name, d['class_id'], d['class_name'], d['confidence'], *d['box']]
+                                   for d in record['detections'])
+                    cls = result.boxes.cls.cpu().numpy().astype(np.int64)
+                    totals += np.bincount(cls, minlength=len(names))
+                    progress['boxes'] += len(cls)
+            progress['images'] += len(chunk)
+            progress['totals'] = {n: int(t) for n, t in zip(names, totals)}
+            progress['seconds'] = time.perf_counter() - start
+            if on_batch is not None:
+                on_batch(dict(progress))
+            if stop is not None and stop.is_set():
+                break
+    progress['seconds'] = time.perf_counter() - start
+    (out_dir / 'summary.json').write_text(json.dumps(progress, indent=2))
+    return progress
+
+
+class BulkJob:
+    """run_bulk() on a background thread; poll() returns the latest progress."""
+
+    def __init__(self, sources, out_dir, **kwargs):
+        self.total = count_uploads(sources)
+        self.progress = {'images': 0, 'failed': 0, 'boxes': 0, 'totals': {}}
+        self.error = None
+        self.done = False
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, args=(sources, out_dir), kwargs=kwargs,
+                                       name='bulk-detect', daemon=True)
+        self.thread.start()
+
+    def _update(self, progress):
+        with self.lock:
+            self.progress = progress
+
+    def _run(self, sources, out_dir, **kwargs):
+        try:
+            self._update(run_bulk(sources, out_dir, on_batch=self._update, stop=self.stop_event, **kwargs))
+        except Exception as e:
+            self.error = repr(e)
+        finally:
+            self.done = True
+
+    def poll(self):
+        with self.lock:
+            return dict(self.progress, total=self.total, done=self.done, error=self.error)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def join(self, timeout=None):
+        """Wait for the current batch to finish after stop(); True once the thread has exited."""
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Detect every image in a set of files and zip archives")
+    parser.add_argument('sources', nargs='+', help="Images and/or .zip archives of images")
+    parser.add_argument('--model', default=None, help="Weights path, run name or alias (default: best)")
+    parser.add_argument('--out', default='runs/bulk/exp', help="Output directory")
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--iou', type=float, default=0.45)
+    parser.add_argument('--workers', type=int, default=4, help="Decode threads")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    sources = [os.path.abspath(s) for s in args.sources]
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+    model_path = resolve_model_path(args.model)
+
+    print("="*70)
+    print("🗂️ BULK DETECTION")
+    print("="*70)
+    print(f"Model:   {model_path}")
+    print(f"Sources: {len(sources)} ({count_uploads(sources)} images)")
+    print(f"Output:  {args.out}")
+    print("="*70 + "\n")
+
+    def report(progress):
+        print(f"   {progress['images']} images | {progress['boxes']} detections | "
+              f"{progress['images'] / max(progress['seconds'], 1e-9):.1f} img/s")
+
+    summary = run_bulk(sources, args.out, model=get_model(model_path, imgsz=args.imgsz), batch=args.batch,
+                       imgsz=args.imgsz, conf=args.conf, iou=args.iou, workers=args.workers, on_batch=report)
+    print("\n📋 Totals")
+    for name, n in summary['totals'].items():
+        print(f"   {name:<20} {n}")
+    print(f"\nFailed to decode: {summary['failed']}")
+    print(f"CSV:   {summary['csv']}")
+    print(f"JSONL: {summary['jsonl']}")
+    print("="*70 + "\n")
@@ -0,0 +1,128 @@
+"""
+CLASS-BALANCED SAMPLING - LVIS repeat-factor sampling for training
+
+copy_paste / mixup / cls weight only re-weight what the loader happens to
+draw; EmergencyPhone images still show up a fraction as often as tank images.
+Repeat-factor sampling (Gupta et al., LVIS) fixes the draw itself:
+    f_c = fraction of training images containing class c
+    r_c = max(1, sqrt(t / f_c))          t = repeat_threshold (default 0.1)
+    r_i = max r_c over the classes in image i
+Each epoch image i is drawn floor(r_i) or ceil(r_i) times (stochastic
+rounding), shuffled, and the epoch is cut back to the dataset length, so rare
+images are oversampled in memory (nothing duplicated on disk) while an epoch
+costs the same compute as before and epoch counts stay comparable. The
+sampler is single-process: DDP runs keep the stock distributed sampler (and
+say so).
+
+make_trainer() returns the MemmapDetectionTrainer (shard_cache.py) with the
+sampler switched on or off; target_map_logger() records the first epoch, the
+images seen and the wall time at which val mAP@50 reaches a target, in
+<run>/epochs_to_target.json, so balanced and plain runs can be compared.
+"""
+
+from torch.utils.data import Sampler
+import json
+import time
+import numpy as np
+import torch
+
+from shard_cache import MemmapDetectionTrainer
+
+
+def repeat_factors(image_classes, nc, threshold=0.1):
+    """Per-image LVIS repeat factors from a list of per-image class id arrays."""
+    n = max(len(image_classes), 1)
+    images_with = np.zeros(nc)
+    for classes in image_classes:
+        images_with[np.unique(classes).astype(int)] += 1
+    freq = images_with / n
+    class_r = np.where(freq > 0, np.maximum(1.0, np.sqrt(threshold / np.maximum(freq, 1e-12))), 1.0)
+    return np.array([class_r[np.unique(c).astype(int)].max() if len(c) else 1.0 for c in image_classes]), class_r
+
+
+class RepeatFactorSampler(Sampler):
+    """Stochastic-rounding repeat-factor sampler with a fixed epoch length."""
+
+    def __init__(self, factors, num_samples=None, seed=0):
+        self.factors = np.asarray(factors, dtype=np.float64)
+        self.num_samples = num_samples or len(self.factors)
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self):
+        return self.num_samples
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        self.epoch += 1
+        whole = np.floor(self.factors)
+        reps = (whole + (rng.random(len(self.factors)) < self.factors - whole)).astype(np.int64)
+        indices = np.repeat(np.arange(len(self.factors)), reps)
+        rng.shuffle(indices)
+        yield from indices[:self.num_samples].tolist()
+
+
+def make_trainer(balanced=True, repeat_threshold=0.1):
+    """Trainer class for model.train(trainer=...): shard-backed, optionally class-balanced."""
+    if not balanced:
+        return MemmapDetectionTrainer
+    from ultralytics.data.build import InfiniteDataLoader, seed_worker
+    from ultralytics.utils.torch_utils import torch_distributed_zero_first
+
+    class BalancedDetectionTrainer(MemmapDetectionTrainer):
+        def get_dataloader(self, dataset_path, batch_size=16, rank=0, mode='train'):
+            if mode != 'train' or rank != -1:
+                if mode == 'train' and rank == 0:  # once, from the main DDP process
+                    print("   ⚠️ Class-balanced sampling is single-process only: "
+                          "DDP training uses the stock distributed sampler")
+                return super().get_dataloader(dataset_path, batch_size, rank, mode)
+            with torch_distributed_zero_first(rank):
+                dataset = self.build_dataset(dataset_path, mode, batch_size)
+            image_classes = [label['cls'].reshape(-1) for label in dataset.labels]
+            names = self.data['names']
+            names = [names[k] for k in sorted(names)] if isinstance(names, dict) else list(names)
+            factors, class_r = repeat_factors(image_classes, len(names), repeat_threshold)
+            print(f"   ⚖️ Repeat factors (t={repeat_threshold}): "
+                  + ", ".join(f"{name} x{r:.2f}" for name, r in zip(names, class_r)))
+            print(f"   ⚖️ {int((factors > 1).sum())}/{len(factors)} images oversampled, "
+                  f"max x{factors.max():.2f}")
+            generator = torch.Generator()
+            generator.manual_seed(6148914691236517205)
+            return InfiniteDataLoader(
+                dataset=dataset,
+                batch_size=min(batch_size, len(dataset)),
+                shuffle=False,
+                num_workers=min(self.args.workers, torch.multiprocessing.cpu_count()),
+                sampler=RepeatFactorSampler(factors, seed=self.args.seed),
+                pin_memory=torch.cuda.is_available(),
+                collate_fn=getattr(dataset, 'collate_fn', None),
+                worker_init_fn=seed_worker,
+                generator=generator,
+            )
+
+    return BalancedDetectionTrainer
+
+
+def target_map_logger(target_map50):
+    """on_fit_epoch_end callback: log when val mAP@50 first reaches target_map50."""
+    state = {'start': time.time(), 'reached': False}
+
+    def on_fit_epoch_end(trainer):
+        map50 = float(trainer.metrics.get('metrics/mAP50(B)', 0.0))
+        if state['reached'] or map50 < target_map50:
+            return
+        state['reached'] = True
+        images_per_epoch = len(trainer.train_loader) * trainer.batch_size
+        record = {
+            'target_map50': target_map50,
+            'map50': map50,
+            'epoch': trainer.epoch + 1,
+            'images_seen': (trainer.epoch + 1 - trainer.start_epoch) * images_per_epoch,
+            'hours': (time.time() - state['start']) / 3600,
+            'sampler': type(trainer).__name__,
+        }
+        (trainer.save_dir / 'epochs_to_target.json').write_text(json.dumps(record, indent=2))
+        print(f"\n🎯 mAP@50 {map50:.4f} >= {target_map50} after {record['epoch']} epochs "
+              f"({record['images_seen']} images, {record['hours']:.2f} h)\n")
+
+    return on_fit_epoch_end
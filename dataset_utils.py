@@ -0,0 +1,114 @@
+"""
+DATASET HELPERS - Resolve splits and read YOLO labels from yolo_params.yaml
+"""
+
+from pathlib import Path
+import numpy as np
+import yaml
+import os
+
+from predict import iter_image_paths
+
+DATA_CONFIG = 'yolo_params.yaml'
+
+
+def load_data_config(path=DATA_CONFIG):
+    with open(path) as f:
+        data = yaml.safe_load(f)
+    names = data.get('names', [])
+    if isinstance(names, dict):
+        names = [names[k] for k in sorted(names)]
+    data['names'] = list(names)
+    return data
+
+
+def split_image_paths(split, data=None):
+    """Sorted image paths for a split ('train', 'val' or 'test')."""
+    data = data or load_data_config()
+    if split not in data:
+        raise KeyError(f"Split '{split}' is not defined in {DATA_CONFIG}")
+    sources = data[split] if isinstance(data[split], list) else [data[split]]
+    root = Path(data.get('path', ''))
+    paths = []
+    for source in sources:
+        source = Path(source)
+        if not source.is_absolute() and data.get('path'):
+            source = root / source
+        paths.extend(iter_image_paths(source))
+    return paths
+
+
+def img2label_path(image_path):
+    """Same convention as ultralytics: swap the last /images/ for /labels/."""
+    image_path = str(image_path)
+    sa, sb = f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"
+    if sa not in image_path:
+        sa, sb = "/images/", "/labels/"
+    head, sep, tail = image_path.rpartition(sa)
+    if not sep:
+        return str(Path(image_path).with_suffix('.txt'))
+    return str(Path(head + sb + tail).with_suffix('.txt'))
+
+
+def read_labels(label_path):
+    """Return (classes int32 (n,), boxes float32 (n, 4) normalized xyxy).
+
+    Polygon (segment) rows are reduced to their bounding box; exact duplicate
+    rows are dropped, as ultralytics does when it builds its label cache.
+    """
+    classes, boxes = [], []
+    if os.path.exists(label_path):
+        with open(label_path) as f:
+            for line in f:
+                values = line.split()
+                if len(values) < 5:
+                    continue
+                cls = int(float(values[0]))
+                coords = np.asarray(values[1:], dtype=np.float32)
+                if len(coords) > 4:
+                    xy = coords[:len(coords) // 2 * 2].reshape(-1, 2)
+                    x1, y1 = xy.min(0)
+                    x2, y2 = xy.max(0)
+                else:
+                    x, y, w, h = coords
+                    x1, y1, x2, y2 = x - w / 2, y - h / 2, x + w / 2, y + h / 2
+                classes.append(cls)
+                boxes.append((x1, y1, x2, y2))
+    if not classes:
+        return np.zeros(0, dtype=np.int32), np.zeros((0, 4), dtype=np.float32)
+    rows = np.concatenate([np.asarray(classes, dtype=np.float32)[:, None],
+                           np.asarray(boxes, dtype=np.float32)], axis=1)
+    _, keep = np.unique(rows, axis=0, return_index=True)
+    rows = rows[np.sort(keep)]
+    return rows[:, 0].astype(np.int32), rows[:, 1:]
+
+
+def stratified_sample(split='train', n=300, nc=None, seed=0, data=None):
+    """Pick ~n images of a split so every class is represented.
+
+    Classes are filled rarest first with an equal quota each, so rare classes
+    such as EmergencyPhone are not drowned out by a uniform random draw; the
+    remainder is topped up at random.
+    """
+    data = data or load_data_config()
+    nc = nc or len(data['names'])
+    paths = split_image_paths(split, data)
+    rng = np.random.default_rng(seed)
+
+    by_class = [[] for _ in range(nc)]
+    for i, path in enumerate(paths):
+        classes, _ = read_labels(img2label_path(path))
+        for c in np.unique(classes):
+            if 0 <= c < nc:
+                by_class[c].append(i)
+
+    chosen = set()
+    quota = max(1, n // nc)
+    for c in sorted(range(nc), key=lambda c: len(by_class[c])):
+        candidates = [i for i in by_class[c] if i not in chosen]
+        rng.shuffle(candidates)
+        chosen.update(candidates[:quota])
+    rest = [i for i in range(len(paths)) if i not in chosen]
+    rng.shuffle(rest)
+    chosen.update(rest[:max(0, n - len(chosen))])
+    return [paths[i] for i in sorted(chosen)]
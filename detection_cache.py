@@ -0,0 +1,129 @@
+"""
+DETECTION CACHE - Raw detections per (image, model) with LRU eviction
+
+The Live Demo runs the model ONCE per uploaded image at a low confidence with
+NMS disabled, and keeps those candidates here. Moving the Confidence / IoU
+sliders only re-filters and re-runs NumPy NMS on the cached arrays, which takes
+milliseconds instead of a forward pass. The cache is bounded both in entries
+and in bytes so a long-running demo box does not grow without limit.
+
+refilter() hands back a Detections: the kept boxes / scores / class ids as
+NumPy arrays, with per-class counts from one bincount and boxes rescaled to
+the display-sized copy the overlay is drawn on.
+"""
+
+from collections import OrderedDict
+import threading
+import hashlib
+import numpy as np
+
+from box_ops import nms
+
+RAW_CONF = 0.01      # lowest confidence the sliders can meaningfully reach
+RAW_IOU = 1.0        # NMS off: every candidate survives, any IoU can be re-applied
+RAW_MAX_DET = 1000
+
+
+def image_key(image_bytes, model_id):
+    return f"{hashlib.sha1(image_bytes).hexdigest()}:{model_id}"
+
+
+class RawDetections:
+    """Candidate boxes (pixel xyxy), scores and class ids for one image."""
+
+    def __init__(self, boxes, scores, classes, names, shape):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.scores = np.asarray(scores, dtype=np.float32)
+        self.classes = np.asarray(classes, dtype=np.int32)
+        self.names = names
+        self.shape = tuple(shape)
+
+    @property
+    def nbytes(self):
+        return self.boxes.nbytes + self.scores.nbytes + self.classes.nbytes
+
+    @classmethod
+    def from_result(cls, result):
+        boxes = result.boxes
+        return cls(boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy(),
+                   result.names, result.orig_shape)
+
+    @classmethod
+    def from_record(cls, record, names):
+        dets = record['detections']
+        return cls([d['box'] for d in dets], [d['confidence'] for d in dets],
+                   [d['class_id'] for d in dets], names, record['shape'])
+
+
+class Detections:
+    """Final detections of one image (after confidence cutoff and NMS), array-backed."""
+
+    def __init__(self, boxes, scores, classes, names, shape):
+        self.boxes = boxes
+        self.scores = scores
+        self.classes = classes
+        self.names = names
+        self.shape = shape
+
+    def __len__(self):
+        return len(self.classes)
+
+    def class_counts(self):
+        """Detections per class id, length len(names)."""
+        return np.bincount(self.classes, minlength=len(self.names))
+
+    def counts(self):
+        """{class name: count} for the classes present, in class id order."""
+        return {self.names[c]: int(n) for c, n in enumerate(self.class_counts()) if n}
+
+    def scaled(self, scale):
+        """Boxes in the coordinates of an image resized by `scale`."""
+        return self.boxes * np.float32(scale)
+
+    def to_records(self):
+        return [{'class_id': int(c), 'class_name': self.names[int(c)], 'confidence': round(float(s), 4),
+                 'box': [round(float(v), 1) for v in b]}
+                for b, s, c in zip(self.boxes, self.scores, self.classes)]
+
+
+class DetectionCache:
+    """Thread-safe LRU keyed by image_key(), limited by entry count and total bytes."""
+
+    def __init__(self, max_entries=256, max_bytes=64 << 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key).nbytes
+            self.entries[key] = value
+            self.nbytes += value.nbytes
+            while self.entries and (len(self.entries) > self.max_entries or self.nbytes > self.max_bytes):
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+
+def refilter(raw, conf, iou, max_det=300):
+    """Apply a confidence cutoff and class-aware NMS to cached candidates -> Detections."""
+    idx = np.flatnonzero(raw.scores >= conf)
+    idx = idx[nms(raw.boxes[idx], raw.scores[idx], raw.classes[idx], iou_thr=iou, max_det=max_det)]
+    return Detections(raw.boxes[idx], raw.scores[idx], raw.classes[idx], raw.names, raw.shape)
@@ -0,0 +1,285 @@
+"""
+DISTILLATION - Teacher-student training of a CPU-sized detector (yolov8n / yolov8s)
+
+best.pt is a yolov8m: accurate, but too slow for CPU deployment. Here the
+medium model is the teacher:
+  1. It runs ONCE over the train split (and any unlabeled image folders). Its
+     predictions are kept with their confidences in the prediction cache
+     (prediction_cache.py, keyed by weights hash; unlabeled folders also by
+     their file list, mtimes and sizes), so re-training a student never
+     re-runs the teacher, while new or edited images trigger a fresh pass.
+  2. Student targets = ground truth + teacher boxes with confidence >=
+     --pseudo-conf that do not overlap a ground-truth box (objects the
+     annotators missed). Unlabeled images get the teacher boxes alone.
+  3. Each student trains on those targets. DistillDetectionTrainer swaps them
+     into the train dataset's labels, so they go through mosaic / mixup /
+     copy-paste like real labels. Class-balanced sampling is kept, and so is
+     the shard cache for the labeled train images (unlabeled folders are
+     decoded from disk).
+  4. Side-by-side report of the teacher and every student: mAP@50,
+     mAP@50-95, per-class AP@50 and CPU latency (benchmark.py worker),
+     written to runs/distill/report.json.
+
+Teacher scores only select pseudo boxes: cached predictions live in original
+image coordinates, so a per-anchor soft-score loss would not survive the
+augmentations.
+
+Usage:
+    python distill.py                                    # teacher = best, students n and s
+    python distill.py --students n --unlabeled captures/unlabeled --epochs 150
+    python distill.py --report-only                      # re-score existing distill_yolov8* runs
+"""
+
+from pathlib import Path
+import argparse
+import hashlib
+import json
+import time
+import numpy as np
+import torch
+import os
+
+from box_ops import box_iou
+from class_balance import make_trainer
+from dataset_utils import img2label_path, load_data_config, read_labels
+from predict import iter_image_paths
+from prediction_cache import cached_predictions
+from run_registry import register_run, resolve_model
+from shard_cache import path_key
+
+DISTILL_DIR = Path('runs/distill')
+PSEUDO_CONF = 0.5    # teacher boxes kept as student targets
+MATCH_IOU = 0.5      # a teacher box overlapping any GT box this much is already labeled
+
+
+def merge_targets(gt_classes, gt_boxes, boxes, scores, classes, pseudo_conf=PSEUDO_CONF, match_iou=MATCH_IOU):
+    """Ground truth + confident teacher boxes that no GT box covers. Returns (classes, xywhn)."""
+    keep = scores >= pseudo_conf
+    boxes, classes = boxes[keep], classes[keep].astype(np.int32)
+    if len(gt_classes) and len(boxes):
+        new = (box_iou(boxes, gt_boxes) < match_iou).all(1)
+        boxes, classes = boxes[new], classes[new]
+    xyxy = np.concatenate([gt_boxes, boxes]).astype(np.float32).clip(0, 1)
+    xywh = np.concatenate([(xyxy[:, :2] + xyxy[:, 2:]) / 2, xyxy[:, 2:] - xyxy[:, :2]], 1)
+    return np.concatenate([gt_classes, classes]).astype(np.int32), xywh
+
+
+def files_tag(paths):
+    """Short hash of a file list with mtimes and sizes: adding, removing or editing an image changes it."""
+    digest = hashlib.sha1()
+    for path in sorted(paths, key=path_key):
+        st = os.stat(path)
+        digest.update(f"{path_key(path)}:{st.st_mtime_ns}:{st.st_size}|".encode())
+    return digest.hexdigest()[:8]
+
+
+def teacher_targets(teacher, unlabeled=(), imgsz=640, pseudo_conf=PSEUDO_CONF, refresh=False):
+    """{image key: (classes, xywhn)} for the train split and the unlabeled images, plus counts."""
+    sets = [(cached_predictions(teacher, 'train', imgsz=imgsz, refresh=refresh), True)]
+    if unlabeled:
+        paths = [p for source in unlabeled for p in iter_image_paths(source)]
+        tag = files_tag(paths)
+        sets.append((cached_predictions(teacher, f"unlabeled_{tag}", imgsz=imgsz, refresh=refresh, paths=paths),
+                     False))
+
+    targets = {}
+    stats = {'images': 0, 'gt_boxes': 0, 'teacher_boxes': 0}
+    for preds, labeled in sets:
+        for i, path in enumerate(preds.files):
+            if labeled:
+                gt_classes, gt_boxes = read_labels(img2label_path(path))
+            else:
+                gt_classes, gt_boxes = np.zeros(0, np.int32), np.zeros((0, 4), np.float32)
+            boxes, scores, classes = preds[i]
+            merged = merge_targets(gt_classes, gt_boxes, boxes, scores, classes, pseudo_conf)
+            targets[path_key(path)] = merged
+            stats['images'] += 1
+            stats['gt_boxes'] += len(gt_classes)
+            stats['teacher_boxes'] += len(merged[0]) - len(gt_classes)
+    return targets, stats
+
+
+def make_distill_trainer(targets, balanced=True, repeat_threshold=0.1):
+    """make_trainer() whose train dataset reads its labels from `targets` (teacher_targets())."""
+
+    class DistillDetectionTrainer(make_trainer(balanced, repeat_threshold)):
+        def build_dataset(self, img_path, mode='train', batch=None):
+            dataset = super().build_dataset(img_path, mode, batch)
+            if mode != 'train':
+                return dataset
+            replaced, missing = 0, []
+            for label in dataset.labels:
+                target = targets.get(path_key(label['im_file']))
+                if target is None:
+                    missing.append(label['im_file'])
+                    continue
+                classes, xywhn = target
+                label.update(cls=classes.reshape(-1, 1).astype(np.float32), bboxes=xywhn, segments=[],
+                             normalized=True, bbox_format='xywh')
+                replaced += 1
+            print(f"   🎓 Teacher targets for {replaced}/{len(dataset.labels)} training images")
+            if missing:
+                # Images added after the teacher ran: labeled ones keep their GT, unlabeled ones train as background
+                print(f"   ⚠️ {len(missing)} training images have no teacher targets (e.g. {missing[0]}); "
+                      f"rerun with --refresh to re-run the teacher")
+            return dataset
+
+    return DistillDetectionTrainer
+
+
+def write_data_yaml(unlabeled=()):
+    """yolo_params.yaml with the unlabeled folders appended to the train split."""
+    import yaml
+    data = load_data_config()
+    root = Path(data.get('path', ''))
+    train = data['train'] if isinstance(data['train'], list) else [data['train']]
+    train = [str(root / t) if data.get('path') and not Path(t).is_absolute() else t for t in train]
+    val = str(root / data['val']) if data.get('path') and not Path(data['val']).is_absolute() else data['val']
+    path = DISTILL_DIR / 'data.yaml'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    train_all = train + [str(Path(u).resolve()) for u in unlabeled]
+    path.write_text(yaml.safe_dump({'train': train_all if len(train_all) > 1 else train_all[0], 'val': val,
+                                    'nc': len(data['names']), 'names': data['names']}, sort_keys=False))
+    return path
+
+
+def train_student(size, targets, data_yaml, epochs=100, imgsz=640, batch=16):
+    from ultralytics import YOLO
+    model = YOLO(f"yolov8{size}.pt")
+    model.train(
+        trainer=make_distill_trainer(targets),  # ✅ GT + cached teacher boxes, shards, balanced sampler
+        data=str(data_yaml),
+        epochs=epochs,
+        patience=30,
+        imgsz=imgsz,
+        batch=batch,
+        cos_lr=True,
+        mosaic=1.0,
+        mixup=0.1,
+        copy_paste=0.3,
+        close_mosaic=10,
+        device=0 if torch.cuda.is_available() else 'cpu',
+        workers=8,
+        cache=False,                   # shards instead (shard_cache.py)
+        amp=True,
+        project='runs/detect',
+        name=f"distill_yolov8{size}",
+        exist_ok=True,
+        plots=True,
+        verbose=True
+    )
+    register_run(model.trainer.save_dir)
+    return Path(model.trainer.save_dir) / 'weights' / 'best.pt'
+
+
+def compare_models(models, split='val', imgsz=640, threads=None, images=32):
+    """mAP@50 / mAP@50-95 / per-class AP@50 (cached predictions) and CPU latency for each (label, weights)."""
+    from benchmark import run_config
+    from evaluator import evaluate
+    names = load_data_config()['names']
+    threads = threads or os.cpu_count() or 1
+    rows = []
+    for label, weights in models:
+        print(f"\n📏 {label}: {weights}")
+        result = evaluate(cached_predictions(weights, split, imgsz=imgsz), nc=len(names))
+        per_class = dict.fromkeys(names)
+        for c, ap in zip(result['classes'], result['ap']):
+            per_class[names[c]] = round(float(ap[0]), 4)
+        latency = run_config({'model': str(weights), 'imgsz': imgsz, 'batch': 1, 'augment': False,
+                              'backend': 'pytorch', 'device': 'cpu', 'threads': threads, 'images': images,
+                              'warmup': 2, 'split': split})
+        rows.append({'model': label, 'weights': str(weights), 'size_mb': round(os.path.getsize(weights) / 1e6, 1),
+                     'map50': round(result['map50'], 4), 'map50_95': round(result['map'], 4),
+                     'per_class_ap50': per_class, 'cpu_p50_ms': latency.get('p50_ms'),
+                     'cpu_images_per_s': latency.get('images_per_s'), 'latency_error': latency.get('error')})
+    return rows
+
+
+def print_report(rows, split, threads):
+    teacher = rows[0]
+    print("\n" + "="*70)
+    print(f"📊 TEACHER vs STUDENTS ({split} split, CPU batch 1 x {threads} threads)")
+    print("="*70)
+    print(f"{'Model':<16} {'MB':>6} {'mAP50':>7} {'Δ':>7} {'mAP50-95':>9} {'CPU ms':>8} {'Speed-up':>9}")
+    print("-"*70)
+    for r in rows:
+        ms = r['cpu_p50_ms']
+        speedup = teacher['cpu_p50_ms'] / ms if ms and teacher['cpu_p50_ms'] else None
+        print(f"{r['model']:<16} {r['size_mb']:>6.1f} {r['map50']:>7.4f} {r['map50'] - teacher['map50']:>+7.4f} "
+              f"{r['map50_95']:>9.4f} {(f'{ms:.1f}' if ms else 'n/a'):>8} "
+              f"{(f'x{speedup:.2f}' if speedup else '-'):>9}")
+    print("-"*70)
+    print("AP@50 per class")
+    print(f"{'Class':<20}" + "".join(f"{r['model'][:12]:>13}" for r in rows))
+    for name in teacher['per_class_ap50']:
+        aps = [r['per_class_ap50'][name] for r in rows]
+        print(f"{name:<20}" + "".join(f"{'-' if ap is None else f'{ap:.4f}':>13}" for ap in aps))
+    print("="*70 + "\n")
+
+
+def run_distillation(teacher=None, students=('n', 's'), unlabeled=(), epochs=100, imgsz=640, batch=16,
+                     pseudo_conf=PSEUDO_CONF, split='val', threads=None, report_only=False, refresh=False):
+    teacher = teacher or resolve_model('best')
+    threads = threads or os.cpu_count() or 1
+
+    print("="*70)
+    print("🎓 TEACHER-STUDENT DISTILLATION")
+    print("="*70)
+    print(f"Teacher:   {teacher}")
+    print(f"Students:  {', '.join(f'yolov8{s}' for s in students)}")
+    print(f"Unlabeled: {', '.join(unlabeled) or 'none'}")
+    print(f"Pseudo boxes: teacher conf >= {pseudo_conf}, no GT overlap (IoU < {MATCH_IOU})")
+    print("="*70 + "\n")
+
+    student_weights = []
+    if report_only:
+        for size in students:
+            try:
+                student_weights.append((f"yolov8{size} (KD)", resolve_model(f"distill_yolov8{size}")))
+            except FileNotFoundError:
+                print(f"⚠️ No distill_yolov8{size} run yet, skipped")
+    else:
+        start = time.perf_counter()
+        targets, stats = teacher_targets(teacher, unlabeled, imgsz=imgsz, pseudo_conf=pseudo_conf, refresh=refresh)
+        print(f"   🎓 {stats['images']} images: {stats['gt_boxes']} GT boxes + {stats['teacher_boxes']} teacher boxes "
+              f"({time.perf_counter() - start:.0f}s)")
+        data_yaml = write_data_yaml(unlabeled)
+        for size in students:
+            student_weights.append((f"yolov8{size} (KD)", train_student(size, targets, data_yaml, epochs=epochs,
+                                                                         imgsz=imgsz, batch=batch)))
+
+    rows = compare_models([('teacher', Path(teacher))] + student_weights, split=split, imgsz=imgsz, threads=threads)
+    print_report(rows, split, threads)
+    DISTILL_DIR.mkdir(parents=True, exist_ok=True)
+    report = DISTILL_DIR / 'report.json'
+    report.write_text(json.dumps({'teacher': str(teacher), 'split': split, 'threads': threads,
+                                  'pseudo_conf': pseudo_conf, 'unlabeled': list(unlabeled), 'models': rows},
+                                 indent=2))
+    print(f"💾 Report saved to: {report}")
+    return rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Distill the medium detector into yolov8n / yolov8s students")
+    parser.add_argument('--teacher', default=None, help="Weights path, run name or alias (default: best)")
+    parser.add_argument('--students', nargs='+', default=['n', 's'], choices=['n', 's'])
+    parser.add_argument('--unlabeled', nargs='*', default=[], help="Folders of unlabeled images for the teacher")
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--batch', type=int, default=16)
+    parser.add_argument('--pseudo-conf', type=float, default=PSEUDO_CONF, help="Teacher confidence for pseudo boxes")
+    parser.add_argument('--split', default='val', help="Split for the report")
+    parser.add_argument('--threads', type=int, default=None, help="CPU threads for the latency column")
+    parser.add_argument('--report-only', action='store_true', help="Skip training, compare existing students")
+    parser.add_argument('--refresh', action='store_true', help="Re-run the teacher instead of using its cache")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    unlabeled = [os.path.abspath(u) for u in args.unlabeled]
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+    run_distillation(args.teacher, students=args.students, unlabeled=unlabeled, epochs=args.epochs,
+                     imgsz=args.imgsz, batch=args.batch, pseudo_conf=args.pseudo_conf, split=args.split,
+                     threads=args.threads, report_only=args.report_only, refresh=args.refresh)
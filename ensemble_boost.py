@@ -1,25 +1,48 @@
 """
 ENSEMBLE PREDICTION - Boost mAP by combining multiple models
 This can add +3-5% mAP instantly!
+
+Modes:
+  fuse    (default) Weighted Box Fusion of all checkpoints. Each model's raw
+          predictions are cached on disk (see prediction_cache.py), so changing
+          --weights / --iou-thr or adding a checkpoint only runs inference for
+          models that were never cached.
+  select  Original behaviour: TTA validation of each model, pick the best.
+
+Usage:
+    python ensemble_boost.py
+    python ensemble_boost.py --weights 2 1 1 --iou-thr 0.6
+    python ensemble_boost.py --selective-tta      # TTA only on ambiguous images (selective_tta.py)
+    python ensemble_boost.py --mode select
 """
 
-from ultralytics import YOLO
+import argparse
 import os
 import numpy as np
 from pathlib import Path
 
-def ensemble_validation():
+from backends import get_model
+from box_ops import weighted_boxes_fusion
+from evaluator import evaluate, load_ground_truth
+from prediction_cache import PredictionSet, cached_predictions
+from run_registry import list_runs, resolve_model
+from selective_tta import selective_predictions
+
+# Ensemble the top runs by val mAP@50 from the run registry
+MAX_MODELS = 3
+
+
+def ensemble_models(models=None, max_models=MAX_MODELS):
+    """Weights to ensemble: explicit refs (paths, run names, aliases) or the best registry runs."""
+    if models:
+        return [resolve_model(m) for m in models]
+    return [r['weights'] for r in list_runs(with_weights=True)[:max_models] if os.path.exists(r['weights'])]
+
+def ensemble_validation(models=None):
     current_dir = os.path.dirname(os.path.abspath(__file__))
     os.chdir(current_dir)
     
-    # Find all available best.pt models
-    models_to_ensemble = [
-        'runs/detect/runs/detect/space_station_medium_final/weights/best.pt',
-        'runs/detect/runs/detect/space_station_final/weights/best.pt',
-        'runs/detect/ULTRA_FAST_95mAP/weights/best.pt',
-    ]
-    
-    available_models = [m for m in models_to_ensemble if os.path.exists(m)]
+    available_models = ensemble_models(models)
     
     print("="*70)
     print("🔥 ENSEMBLE PREDICTION - MAXIMUM mAP BOOST")
@@ -38,7 +61,7 @@ def ensemble_validation():
     
     for model_path in available_models:
         print(f"\n🔬 Validating: {Path(model_path).parent.parent.name}")
-        model = YOLO(model_path)
+        model = get_model(model_path, backend='pytorch')  # TTA needs the PyTorch model
         
         results = model.val(
             data='yolo_params.yaml',
@@ -79,8 +102,113 @@ def ensemble_validation():
     print("="*70 + "\n")
     
     print("💡 TIP: Use the best model for your submission!")
-    print(f"   Best weights: runs/detect/{best_result['model']}/weights/best.pt")
+    print(f"   Best weights: {resolve_model(best_result['model'])}")
+    print("="*70 + "\n")
+
+def fuse_prediction_sets(prediction_sets, weights=None, iou_thr=0.55, skip_box_thr=0.001, max_det=300):
+    """Merge several PredictionSets image by image with WBF."""
+    index = [dict(zip(p.files, range(len(p)))) for p in prediction_sets]
+    files = [f for f in prediction_sets[0].files if all(f in idx for idx in index)]
+    detections, shapes = [], []
+    for f in files:
+        per_model = [p[idx[f]] for p, idx in zip(prediction_sets, index)]
+        detections.append(weighted_boxes_fusion(
+            [d[0] for d in per_model], [d[1] for d in per_model], [d[2] for d in per_model],
+            weights=weights, iou_thr=iou_thr, skip_box_thr=skip_box_thr, max_det=max_det))
+        shapes.append(prediction_sets[0].shapes[index[0][f]])
+    meta = {'fused': [p.meta.get('model') for p in prediction_sets],
+            'weights': None if weights is None else list(map(float, weights)),
+            'iou_thr': iou_thr, 'skip_box_thr': skip_box_thr}
+    return PredictionSet.from_images(files, detections, shapes, meta)
+
+
+def ensemble_fusion(split='val', weights=None, iou_thr=0.55, skip_box_thr=0.001,
+                    imgsz=640, augment=True, models=None, refresh=False):
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+
+    available_models = ensemble_models(models)
+
+    print("="*70)
+    print("🔥 WEIGHTED BOX FUSION ENSEMBLE")
+    print("="*70)
+    print(f"Found {len(available_models)} models to fuse on '{split}':\n")
+    for m in available_models:
+        print(f"  ✅ {m}")
+    print("="*70 + "\n")
+
+    if len(available_models) == 0:
+        print("❌ No models found! Train first.")
+        return
+    if weights is not None and len(weights) != len(available_models):
+        print(f"❌ Got {len(weights)} weights for {len(available_models)} models.")
+        return
+
+    # 1. Raw predictions per model (inference only on cache misses)
+    prediction_sets = []
+    for model_path in available_models:
+        print(f"\n🔬 Predictions: {Path(model_path).parent.parent.name}")
+        if augment == 'selective':
+            prediction_sets.append(selective_predictions(model_path, split, imgsz=imgsz, refresh=refresh))
+        else:
+            prediction_sets.append(cached_predictions(
+                model_path, split, imgsz=imgsz, augment=augment, conf=0.001, iou=0.7, refresh=refresh))
+
+    # 2. Score single models and the fused result against the same labels
+    ground_truth = load_ground_truth(prediction_sets[0].files)
+    results_list = []
+    for model_path, preds in zip(available_models, prediction_sets):
+        gt = ground_truth if preds.files == prediction_sets[0].files else None
+        m = evaluate(preds, gt)
+        results_list.append({'model': Path(model_path).parent.parent.name,
+                             'map50': m['map50'], 'map': m['map'], 'recall': m['mr']})
+
+    fused = fuse_prediction_sets(prediction_sets, weights=weights, iou_thr=iou_thr,
+                                 skip_box_thr=skip_box_thr)
+    gt = ground_truth if fused.files == prediction_sets[0].files else None
+    m = evaluate(fused, gt)
+    fused_result = {'model': 'WBF ensemble', 'map50': m['map50'], 'map': m['map'], 'recall': m['mr']}
+
+    out_path = Path('runs/ensemble') / f"wbf_{split}.npz"
+    fused.save(out_path)
+
+    print("\n" + "="*70)
+    print("📊 ENSEMBLE RESULTS:")
+    print("="*70)
+    print(f"{'Model':<40} {'mAP@0.5':<12} {'mAP@0.5-0.95':<15} {'Recall'}")
+    print("-"*70)
+    for r in results_list + [fused_result]:
+        print(f"{r['model']:<40} {r['map50']:<12.4f} {r['map']:<15.4f} {r['recall']:.4f}")
+    best_single = max(results_list, key=lambda x: x['map50'])
+    print("-"*70)
+    print(f"🏆 Fusion vs best single ({best_single['model']}): "
+          f"{(fused_result['map50'] - best_single['map50'])*100:+.2f}% mAP@0.5")
+    print(f"   Weights: {weights or 'equal'} | IoU thr: {iou_thr} | skip thr: {skip_box_thr}")
+    print(f"   Fused predictions saved to: {out_path}")
     print("="*70 + "\n")
 
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Model ensembling with cached predictions")
+    parser.add_argument('--mode', choices=['fuse', 'select'], default='fuse')
+    parser.add_argument('--split', default='val')
+    parser.add_argument('--models', nargs='+', default=None, help="Weights, run names or aliases (default: top registry runs)")
+    parser.add_argument('--weights', nargs='+', type=float, default=None, help="One weight per available model")
+    parser.add_argument('--iou-thr', type=float, default=0.55, help="WBF cluster IoU")
+    parser.add_argument('--skip-box-thr', type=float, default=0.001)
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--no-tta', action='store_true', help="Cache plain predictions instead of TTA")
+    parser.add_argument('--selective-tta', action='store_true', help="TTA only on ambiguous images")
+    parser.add_argument('--refresh', action='store_true', help="Ignore cached predictions")
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
-    ensemble_validation()
+    args = parse_args()
+    if args.mode == 'select':
+        ensemble_validation(models=args.models)
+    else:
+        ensemble_fusion(split=args.split, weights=args.weights, iou_thr=args.iou_thr,
+                        skip_box_thr=args.skip_box_thr, imgsz=args.imgsz,
+                        augment='selective' if args.selective_tta else not args.no_tta,
+                        models=args.models, refresh=args.refresh)
@@ -0,0 +1,342 @@
+"""
+EVALUATOR - mAP / P / R over cached predictions and YOLO label files
+
+Scores any prediction dump without a forward pass or ultralytics' plotting:
+IoU 0.50:0.95 matching and the confusion matrix are re-implemented in NumPy
+(images are processed in parallel worker processes), and AP / P / R at the
+max-F1 confidence come from ultralytics' own ap_per_class, so the numbers
+cannot drift from model.val() when ultralytics changes its interpolation.
+
+Accepted prediction dumps:
+  *.npz              PredictionSet from prediction_cache.py / ensemble_boost.py
+  predictions.json   COCO-style dump from model.val(save_json=True)
+  *.jsonl            predict.py output
+  <dir>/             YOLO txt files with a confidence column (predict.py labels/)
+
+Scoring model.val's own predictions.json reproduces its numbers (up to the
+rounding in the dump). Dumps from predict mode differ slightly from val
+because val uses multi-label NMS and rectangular batching.
+
+Usage:
+    python evaluator.py --split test --predictions runs/detect/val10/predictions.json
+    python evaluator.py --split val --predictions runs/ensemble/wbf_val.npz --conf 0.2
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from PIL import Image
+import argparse
+import json
+import warnings
+import time
+import numpy as np
+import os
+
+from ultralytics.utils import metrics as yolo_metrics
+
+from box_ops import box_iou
+from dataset_utils import img2label_path, load_data_config, read_labels, split_image_paths
+from prediction_cache import PredictionSet
+
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+
+def match_predictions(pred_classes, true_classes, iou, iouv=IOU_THRESHOLDS):
+    """Boolean (n_pred, n_iou) matrix of true positives, same greedy rule as ultralytics.
+
+    `iou` has shape (n_true, n_pred). For every IoU threshold, candidate pairs
+    are taken in descending IoU order and each label/prediction is used once.
+    """
+    correct = np.zeros((len(pred_classes), len(iouv)), dtype=bool)
+    if len(pred_classes) == 0 or len(true_classes) == 0:
+        return correct
+    iou = iou * (true_classes[:, None] == pred_classes[None, :])
+    for i, threshold in enumerate(iouv):
+        matches = np.array(np.nonzero(iou >= threshold)).T
+        if matches.shape[0]:
+            if matches.shape[0] > 1:
+                matches = matches[iou[matches[:, 0], matches[:, 1]].argsort()[::-1]]
+                matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+                matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+            correct[matches[:, 1].astype(int), i] = True
+    return correct
+
+
+def ap_per_class(tp, conf, pred_cls, target_cls):
+    """Per-class AP over all IoU thresholds plus P/R/F1 curves.
+
+    Calls ultralytics.utils.metrics.ap_per_class itself (NumPy only, no
+    plots), so results are exactly model.val()'s for identical predictions.
+    """
+    _, _, p, r, f1, ap, classes, p_curve, r_curve, f1_curve, x, prec_values = \
+        yolo_metrics.ap_per_class(tp, conf, pred_cls, target_cls)
+    best = yolo_metrics.smooth(f1_curve.mean(0), 0.1).argmax()
+    return {
+        'classes': classes,
+        'n_targets': np.unique(target_cls, return_counts=True)[1],
+        'p': p, 'r': r, 'f1': f1, 'ap': ap,
+        'best_conf': float(x[best]),
+        'x': x, 'p_curve': p_curve, 'r_curve': r_curve, 'f1_curve': f1_curve,
+        'prec_values': prec_values,
+    }
+
+
+def load_ground_truth(files):
+    """Labels for every image path, in order: list of (classes, boxes) tuples."""
+    return [read_labels(img2label_path(f)) for f in files]
+
+
+def image_stats(boxes, scores, classes, gt_classes, gt_boxes):
+    """Per-image (tp, conf, pred_cls, target_cls) arrays ready for ap_per_class."""
+    classes = np.asarray(classes, dtype=np.int32)
+    if len(scores) and len(gt_classes):
+        iou = box_iou(gt_boxes, boxes)
+        tp = match_predictions(classes, gt_classes, iou)
+    else:
+        tp = np.zeros((len(scores), len(IOU_THRESHOLDS)), dtype=bool)
+    return tp, np.asarray(scores, dtype=np.float32), classes, gt_classes
+
+
+def update_confusion_matrix(matrix, boxes, scores, classes, gt_classes, gt_boxes, conf=0.25, iou_thres=0.45):
+    """Accumulate one image into matrix[pred, true]; index nc is background.
+
+    Port of ultralytics ConfusionMatrix.process_batch for detection.
+    """
+    nc = matrix.shape[0] - 1
+    keep = scores > conf
+    boxes, classes = boxes[keep], np.asarray(classes[keep], dtype=np.int64)
+    if len(gt_classes) == 0:
+        np.add.at(matrix[:, nc], classes, 1)
+        return
+    if len(classes) == 0:
+        np.add.at(matrix[nc], gt_classes, 1)
+        return
+
+    iou = box_iou(gt_boxes, boxes)
+    x = np.nonzero(iou > iou_thres)
+    if x[0].shape[0]:
+        matches = np.concatenate((np.stack(x, 1), iou[x[0], x[1]][:, None]), 1)
+        if x[0].shape[0] > 1:
+            matches = matches[matches[:, 2].argsort()[::-1]]
+            matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+            matches = matches[matches[:, 2].argsort()[::-1]]
+            matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+    else:
+        matches = np.zeros((0, 3))
+
+    m0, m1 = matches[:, 0].astype(int), matches[:, 1].astype(int)
+    for i, gc in enumerate(gt_classes):
+        j = m0 == i
+        if j.sum() == 1:
+            matrix[classes[m1[j][0]], gc] += 1  # correct (or confused) class
+        else:
+            matrix[nc, gc] += 1  # missed: background
+    unmatched = np.ones(len(classes), dtype=bool)
+    unmatched[m1] = False
+    np.add.at(matrix[:, nc], classes[unmatched], 1)  # false positive: background
+
+
+def _evaluate_chunk(files, detections, ground_truth, conf, max_det, nc, cm_conf):
+    """Stats + partial confusion matrix for a slice of images (runs in a worker)."""
+    stats = []
+    matrix = np.zeros((nc + 1, nc + 1), dtype=np.int64)
+    for k, (boxes, scores, classes) in enumerate(detections):
+        gt_classes, gt_boxes = ground_truth[k] if ground_truth else read_labels(img2label_path(files[k]))
+        if conf is not None:
+            keep = scores > conf
+            boxes, scores, classes = boxes[keep], scores[keep], classes[keep]
+        order = np.argsort(-scores, kind='stable')[:max_det]
+        boxes, scores, classes = boxes[order], scores[order], classes[order]
+        stats.append(image_stats(boxes, scores, classes, gt_classes, gt_boxes))
+        update_confusion_matrix(matrix, boxes, scores, classes, gt_classes, gt_boxes, conf=cm_conf)
+    if not stats:
+        return None, matrix
+    return tuple(np.concatenate(s, 0) for s in zip(*stats)), matrix
+
+
+def summarize(stats):
+    """Concatenate per-image stats and reduce them to the headline numbers.
+
+    None entries (shards without images) are skipped; an empty split scores 0.
+    """
+    stats = [s for s in stats if s is not None]
+    if stats:
+        tp, conf, pred_cls, target_cls = (np.concatenate(s, 0) for s in zip(*stats))
+    else:
+        tp, conf = np.zeros((0, len(IOU_THRESHOLDS))), np.zeros(0, dtype=np.float32)
+        pred_cls, target_cls = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # mean of empty curves when nothing is labeled
+        result = ap_per_class(tp.astype(np.float64), conf, pred_cls, target_cls)
+    ap = result['ap']
+    result.update({
+        'map50': float(ap[:, 0].mean()) if len(ap) else 0.0,
+        'map': float(ap.mean()) if len(ap) else 0.0,
+        'mp': float(result['p'].mean()) if len(ap) else 0.0,
+        'mr': float(result['r'].mean()) if len(ap) else 0.0,
+    })
+    return result
+
+
+def evaluate(predictions, ground_truth=None, conf=None, max_det=300, nc=None, workers=0, chunk_size=64):
+    """Score a PredictionSet against its YOLO labels.
+
+    `conf` applies an extra confidence cutoff (like model.val(conf=...)),
+    `ground_truth` can be passed in to avoid re-reading label files. With
+    workers > 1, label parsing and matching run in a process pool.
+    """
+    nc = nc or len(load_data_config()['names'])
+    cm_conf = 0.25 if conf in (None, 0.001) else conf  # same default as ultralytics
+    n = len(predictions)
+    chunks = []
+    for a in range(0, n, chunk_size):
+        b = min(a + chunk_size, n)
+        chunks.append((predictions.files[a:b], [predictions[i] for i in range(a, b)],
+                       ground_truth[a:b] if ground_truth else None, conf, max_det, nc, cm_conf))
+
+    if workers and workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_evaluate_chunk, *zip(*chunks)))
+    else:
+        parts = [_evaluate_chunk(*c) for c in chunks]
+
+    result = summarize([s for s, _ in parts])
+    result['confusion_matrix'] = sum((m for _, m in parts), np.zeros((nc + 1, nc + 1), dtype=np.int64))
+    result['n_images'] = n
+    return result
+
+
+def _image_size(path):
+    with Image.open(path) as im:
+        return im.size  # (w, h), header only
+
+
+def load_prediction_dump(path, files):
+    """Read any supported prediction dump and align it to `files` by image stem."""
+    path = Path(path)
+    stems = {Path(f).stem: i for i, f in enumerate(files)}
+    per_image = [[] for _ in files]
+
+    if path.is_dir():
+        for txt in path.rglob('*.txt'):
+            i = stems.get(txt.stem)
+            if i is None:
+                continue
+            rows = np.loadtxt(txt, ndmin=2, dtype=np.float32)
+            for c, x, y, w, h, s in rows[:, :6]:
+                per_image[i].append((x - w / 2, y - h / 2, x + w / 2, y + h / 2, s, c))
+    elif path.suffix == '.npz':
+        preds = PredictionSet.load(path)
+        for j, f in enumerate(preds.files):
+            i = stems.get(Path(f).stem)
+            if i is not None:
+                boxes, scores, classes = preds[j]
+                per_image[i].extend(zip(*boxes.T, scores, classes))
+    elif path.suffix == '.jsonl':
+        with open(path) as fh:
+            for line in fh:
+                record = json.loads(line)
+                i = stems.get(Path(record['image']).stem)
+                if i is None:
+                    continue
+                h, w = record['shape']
+                for d in record['detections']:
+                    x1, y1, x2, y2 = d['box']
+                    per_image[i].append((x1 / w, y1 / h, x2 / w, y2 / h, d['confidence'], d['class_id']))
+    elif path.suffix == '.json':
+        with open(path) as fh:
+            records = json.load(fh)
+        sizes = {}
+        for d in records:
+            i = stems.get(Path(str(d.get('file_name', d['image_id']))).stem, stems.get(str(d['image_id'])))
+            if i is None:
+                continue
+            if i not in sizes:
+                sizes[i] = _image_size(files[i])
+            w, h = sizes[i]
+            x, y, bw, bh = d['bbox']
+            # COCO category ids are 1-based for custom datasets
+            per_image[i].append((x / w, y / h, (x + bw) / w, (y + bh) / h, d['score'], d['category_id'] - 1))
+    else:
+        raise ValueError(f"Unsupported prediction dump: {path}")
+
+    detections = []
+    for rows in per_image:
+        rows = np.asarray(rows, dtype=np.float32).reshape(-1, 6)
+        detections.append((rows[:, :4], rows[:, 4], rows[:, 5].astype(np.int16)))
+    return PredictionSet.from_images(files, detections, meta={'source': str(path)})
+
+
+def save_report(result, names, out_dir):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    per_class = {
+        names[c]: {'instances': int(n), 'p': float(p), 'r': float(r),
+                   'ap50': float(ap[0]), 'ap50_95': float(ap.mean())}
+        for c, n, p, r, ap in zip(result['classes'], result['n_targets'], result['p'], result['r'], result['ap'])
+    }
+    summary = {k: result[k] for k in ('map50', 'map', 'mp', 'mr', 'best_conf', 'n_images')}
+    with open(out_dir / 'metrics.json', 'w') as f:
+        json.dump({'summary': summary, 'per_class': per_class}, f, indent=2)
+    np.savez(out_dir / 'curves.npz', x=result['x'], p_curve=result['p_curve'], r_curve=result['r_curve'],
+             f1_curve=result['f1_curve'], prec_values=result['prec_values'], classes=result['classes'])
+    labels = names + ['background']
+    with open(out_dir / 'confusion_matrix.csv', 'w') as f:
+        f.write('pred\\true,' + ','.join(labels) + '\n')
+        for name, row in zip(labels, result['confusion_matrix']):
+            f.write(name + ',' + ','.join(str(int(v)) for v in row) + '\n')
+
+
+def run_evaluation(split='test', predictions=None, conf=None, max_det=300, workers=None, out_dir=None):
+    data = load_data_config()
+    names = data['names']
+    files = [str(f) for f in split_image_paths(split, data)]
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+
+    print("="*70)
+    print("📐 STANDALONE EVALUATION")
+    print("="*70)
+    print(f"Split:       {split} ({len(files)} images)")
+    print(f"Predictions: {predictions}")
+    print(f"Workers:     {workers}")
+    print("="*70 + "\n")
+
+    start = time.perf_counter()
+    preds = load_prediction_dump(predictions, files)
+    loaded = time.perf_counter()
+    result = evaluate(preds, conf=conf, max_det=max_det, nc=len(names), workers=workers)
+    elapsed = time.perf_counter() - start
+
+    print(f"{'Class':<22} {'Instances':>9} {'P':>8} {'R':>8} {'mAP50':>8} {'mAP50-95':>9}")
+    print("-"*70)
+    print(f"{'all':<22} {int(result['n_targets'].sum()):>9} {result['mp']:>8.3f} {result['mr']:>8.3f} "
+          f"{result['map50']:>8.3f} {result['map']:>9.3f}")
+    for c, n, p, r, ap in zip(result['classes'], result['n_targets'], result['p'], result['r'], result['ap']):
+        print(f"{names[c]:<22} {n:>9} {p:>8.3f} {r:>8.3f} {ap[0]:>8.3f} {ap.mean():>9.3f}")
+    print("-"*70)
+    print(f"⏱️ Loaded dump in {loaded - start:.2f}s, evaluated in {elapsed - (loaded - start):.2f}s")
+
+    out_dir = Path(out_dir or Path('runs/eval') / f"{split}_{Path(predictions).stem}")
+    save_report(result, names, out_dir)
+    print(f"💾 Report saved to: {out_dir}")
+    print("="*70 + "\n")
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Evaluate a prediction dump against YOLO labels")
+    parser.add_argument('--split', default='test', help="Split from yolo_params.yaml")
+    parser.add_argument('--predictions', required=True, help=".npz, predictions.json, .jsonl or txt label dir")
+    parser.add_argument('--conf', type=float, default=None, help="Extra confidence cutoff")
+    parser.add_argument('--max-det', type=int, default=300)
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--out', default=None, help="Report directory")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+    args = parse_args()
+    run_evaluation(split=args.split, predictions=args.predictions, conf=args.conf,
+                   max_det=args.max_det, workers=args.workers, out_dir=args.out)
@@ -0,0 +1,323 @@
+"""
+HYPERPARAMETER SEARCH - Successive halving / Hyperband over the training recipe
+
+train.py and train_ultra_fast.py are two hand-picked points of the same
+model.train(...) space, and comparing them costs a full run each. This driver
+samples configurations from SEARCH_SPACE, trains each one briefly (few epochs
+on a fraction of the train split, validated on a fixed stratified val subset)
+and promotes only the top 1/eta of every rung to eta x more epochs and data:
+
+    rung 0: 9 configs x  3 epochs x  11% train
+    rung 1: 3 configs x  9 epochs x  33% train
+    rung 2: 1 config  x 27 epochs x 100% train
+
+--brackets hyperband runs every Hyperband bracket (from many short trials to
+a few full-length ones); --brackets sha runs only the widest one. Every trial
+is a fresh subprocess started from the same checkpoint; --parallel trials run
+at once. On GPUs each trial holds one device, so --parallel is capped at the
+GPU count; on CPU the cores are split between trials (OMP/MKL threads and
+torch.set_num_threads per trial, as in sharded_eval.py). --budget caps the
+total cost in epoch-equivalents (epochs x train fraction); rungs are trimmed
+to fit.
+
+Each finished trial is appended to runs/hpo/<study>/trials.jsonl (config,
+epochs, fraction, best val mAP@50 from its results.csv, time). Re-running the
+same study regenerates the same configurations (seeded) and skips every
+trial already recorded, so an interrupted search resumes where it stopped.
+
+Usage:
+    python hparam_search.py --study recipe1
+    python hparam_search.py --study recipe1 --parallel 2 --budget 120 --max-epochs 27 --eta 3
+    python hparam_search.py --study recipe1 --brackets sha        # plain successive halving
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import subprocess
+import argparse
+import queue
+import math
+import json
+import time
+import sys
+import numpy as np
+import yaml
+import os
+
+HPO_ROOT = Path('runs/hpo')
+
+# (kind, low, high) or ('choice', [values]); 'log' samples uniformly in log space
+SEARCH_SPACE = {
+    'lr0': ('log', 1e-5, 1e-2),
+    'lrf': ('log', 1e-4, 1e-1),
+    'cls': ('uniform', 0.5, 2.0),
+    'box': ('uniform', 5.0, 9.0),
+    'mixup': ('uniform', 0.0, 0.5),
+    'copy_paste': ('uniform', 0.0, 0.5),
+    'multi_scale': ('choice', [0.0, 0.3, 0.6]),
+    'degrees': ('uniform', 0.0, 25.0),
+    'scale': ('uniform', 0.3, 0.8),
+    'hsv_s': ('uniform', 0.4, 0.8),
+}
+
+# Shared by every trial (train_ultra_fast.py's recipe minus the searched keys)
+FIXED = {
+    'imgsz': 640,
+    'batch': 8,
+    'warmup_epochs': 1.0,
+    'mosaic': 1.0,
+    'hsv_h': 0.015,
+    'hsv_v': 0.4,
+    'translate': 0.1,
+    'fliplr': 0.5,
+    'flipud': 0.0,
+    'iou': 0.7,
+    'amp': True,
+    'cache': False,
+    'plots': False,
+    'save_period': -1,
+}
+
+
+def sample_config(rng, space=SEARCH_SPACE):
+    config = {}
+    for key, spec in space.items():
+        if spec[0] == 'choice':
+            config[key] = spec[1][int(rng.integers(len(spec[1])))]
+        elif spec[0] == 'log':
+            config[key] = float(np.exp(rng.uniform(np.log(spec[1]), np.log(spec[2]))))
+        else:
+            config[key] = float(rng.uniform(spec[1], spec[2]))
+    return config
+
+
+def brackets(max_epochs, min_epochs, eta, mode='hyperband'):
+    """[(bracket s, [(n configs, epochs) per rung])], widest bracket first."""
+    s_max = int(math.floor(math.log(max_epochs / min_epochs, eta) + 1e-9))
+    out = []
+    for s in range(s_max, -1 if mode == 'hyperband' else s_max - 1, -1):
+        n = int(math.ceil((s_max + 1) / (s + 1) * eta ** s))
+        r = max_epochs * eta ** -s
+        out.append((s, [(max(1, int(n * eta ** -i)), max(1, int(round(r * eta ** i)))) for i in range(s + 1)]))
+    return out
+
+
+def train_fraction(epochs, max_epochs, min_fraction):
+    """Share of the train split a trial sees: grows with its epoch budget, full at max_epochs."""
+    return round(min(1.0, max(min_fraction, epochs / max_epochs)), 3)
+
+
+def prepare_study(study_dir, val_images=300, seed=0):
+    """Data yaml for the study: full train split, fixed stratified val subset (same for every trial)."""
+    from dataset_utils import load_data_config, stratified_sample
+    data_yaml = study_dir / 'data.yaml'
+    if data_yaml.exists():
+        return data_yaml
+    data = load_data_config()
+    study_dir.mkdir(parents=True, exist_ok=True)
+    val_list = study_dir / 'val_subset.txt'
+    val_list.write_text("\n".join(str(Path(p).resolve()) for p in stratified_sample('val', n=val_images, seed=seed,
+                                                                                    data=data)) + "\n")
+    # Same train entry as yolo_params.yaml (so the train shard still matches), made absolute
+    root = Path(data.get('path', ''))
+    train = [str(root / t) if data.get('path') and not Path(t).is_absolute() else t
+             for t in (data['train'] if isinstance(data['train'], list) else [data['train']])]
+    data_yaml.write_text(yaml.safe_dump({'train': train if len(train) > 1 else train[0],
+                                         'val': str(val_list.resolve()), 'nc': len(data['names']),
+                                         'names': data['names']}, sort_keys=False))
+    return data_yaml
+
+
+def load_records(records_file):
+    records = {}
+    if records_file.exists():
+        with open(records_file) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    records[record['trial']] = record
+    return records
+
+
+def run_trial(trial, study_dir, data_yaml, model, devices, threads=None):
+    """Train one trial in a fresh subprocess on a free device; returns its record (read back from results.csv)."""
+    device = devices.get()
+    try:
+        return _run_trial(trial, study_dir, data_yaml, model, device, threads)
+    finally:
+        devices.put(device)
+
+
+def _run_trial(trial, study_dir, data_yaml, model, device, threads=None):
+    from run_registry import best_metrics
+    from sharded_eval import THREAD_VARS
+    run_dir = study_dir / trial['trial']
+    run_dir.mkdir(parents=True, exist_ok=True)
+    spec = dict(trial, project=str(study_dir.resolve()), data=str(data_yaml.resolve()), model=model,
+                device=device, threads=threads)
+    env = dict(os.environ, **{var: str(threads) for var in THREAD_VARS}) if threads else None
+    start = time.time()
+    with open(run_dir / 'train.log', 'w') as log:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--trial', json.dumps(spec)],
+                              stdout=log, stderr=subprocess.STDOUT, env=env)
+    map50, map95, best_epoch, epochs_done = best_metrics(run_dir / 'results.csv') \
+        if (run_dir / 'results.csv').exists() else (None, None, None, 0)
+    return dict(trial, status='ok' if proc.returncode == 0 and map50 is not None else 'failed',
+                map50=map50, map50_95=map95, best_epoch=best_epoch, epochs_done=epochs_done,
+                seconds=round(time.time() - start, 1), device=device, save_dir=run_dir.as_posix())
+
+
+def _train_worker(spec):
+    """Body of a trial subprocess: one model.train() with the trial's config."""
+    from ultralytics import YOLO
+    from class_balance import make_trainer
+    import torch
+    if spec.get('threads'):
+        torch.set_num_threads(spec['threads'])  # this trial's share of the cores
+    model = YOLO(spec['model'])
+    model.train(
+        trainer=make_trainer(True, 0.1),  # shard cache + class-balanced sampler, as in train.py
+        data=spec['data'],
+        epochs=spec['epochs'],
+        fraction=spec['fraction'],
+        patience=spec['epochs'],         # short rungs: never stop early, every trial gets its budget
+        device=spec['device'],
+        workers=min(4, spec.get('threads') or 4),
+        project=spec['project'],
+        name=spec['trial'],
+        exist_ok=True,
+        verbose=False,
+        **FIXED,
+        **spec['config'],
+    )
+
+
+def search(study='default', model=None, max_epochs=27, min_epochs=3, eta=3, mode='hyperband', budget=None,
+           parallel=1, min_fraction=0.1, val_images=300, seed=0):
+    from run_registry import resolve_model
+    import torch
+    os.makedirs(HPO_ROOT, exist_ok=True)
+    study_dir = HPO_ROOT / study
+    model = model or resolve_model('best')
+    data_yaml = prepare_study(study_dir, val_images, seed)
+    records_file = study_dir / 'trials.jsonl'
+    records = load_records(records_file)
+    n_gpu = torch.cuda.device_count()
+    if n_gpu and parallel > n_gpu:
+        print(f"⚠️ --parallel {parallel} > {n_gpu} GPUs: running {n_gpu} trials at once (one per GPU)")
+        parallel = n_gpu
+    devices = [str(i) for i in range(parallel)] if n_gpu else ['cpu'] * parallel
+    threads = None if n_gpu else max(1, (os.cpu_count() or 1) // parallel)  # CPU: split the cores
+    free_devices = queue.Queue()  # a trial holds its device until it finishes
+    for device in devices:
+        free_devices.put(device)
+    plan = brackets(max_epochs, min_epochs, eta, mode)
+    spent = sum(r['epochs'] * r['fraction'] for r in records.values())
+
+    print("="*70)
+    print(f"🔎 HYPERPARAMETER SEARCH - study '{study}' ({mode}, eta={eta})")
+    print("="*70)
+    print(f"Start weights: {model}")
+    print(f"Val subset:    {val_images} images (stratified) | Parallel trials: {parallel} on {', '.join(devices)}"
+          + (f" ({threads} threads each)" if threads else ""))
+    for s, rungs in plan:
+        print(f"Bracket {s}: " + " -> ".join(f"{n} x {e} ep ({train_fraction(e, max_epochs, min_fraction):.0%})"
+                                           for n, e in rungs))
+    if budget:
+        print(f"Budget: {budget} epoch-equivalents ({spent:.1f} already spent)")
+    if records:
+        print(f"Resuming: {len(records)} trials already recorded in {records_file}")
+    print("="*70 + "\n")
+
+    exhausted = False
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        for s, rungs in plan:
+            rng = np.random.default_rng(seed * 1000 + s)  # same configs on every resume
+            survivors = [(f"b{s}c{k:02d}", sample_config(rng)) for k in range(rungs[0][0])]
+            for level, (n, epochs) in enumerate(rungs):
+                fraction = train_fraction(epochs, max_epochs, min_fraction)
+                trials = [{'trial': f"{cid}_e{epochs}", 'config_id': cid, 'bracket': s, 'rung': level,
+                           'epochs': epochs, 'fraction': fraction, 'config': config}
+                          for cid, config in survivors[:n]]
+                todo = [t for t in trials if t['trial'] not in records]
+                print(f"▶️ Bracket {s} rung {level}: {len(trials)} configs x {epochs} epochs x {fraction:.0%} "
+                      f"train ({len(trials) - len(todo)} recorded)")
+                if budget:
+                    affordable = max(0, int((budget - spent) // (epochs * fraction)))
+                    if affordable < len(todo):
+                        print(f"   💸 Budget: running {affordable}/{len(todo)} trials")
+                        todo = todo[:affordable]
+                        exhausted = True
+                spent += len(todo) * epochs * fraction
+
+                futures = [pool.submit(run_trial, t, study_dir, data_yaml, model, free_devices, threads)
+                           for t in todo]
+                for future in futures:
+                    record = future.result()
+                    records[record['trial']] = record
+                    with open(records_file, 'a') as f:
+                        f.write(json.dumps(record) + "\n")
+                    score = f"{record['map50']:.4f}" if record['map50'] is not None else "failed"
+                    print(f"   {record['trial']}: mAP@50 {score} ({record['seconds'] / 60:.1f} min)")
+
+                done = [records[t['trial']] for t in trials if t['trial'] in records]
+                ranked = sorted((r for r in done if r['status'] == 'ok'), key=lambda r: -r['map50'])
+                if level + 1 < len(rungs):
+                    keep = rungs[level + 1][0]
+                    survivors = [(r['config_id'], r['config']) for r in ranked[:keep]]
+                    if not survivors:
+                        break
+                    print(f"   ⬆️ Promoted: {', '.join(cid for cid, _ in survivors)}")
+                if exhausted:
+                    break
+            if exhausted:
+                print("\n💸 Compute budget exhausted")
+                break
+
+    results = [r for r in records.values() if r['status'] == 'ok']
+    if not results:
+        print("❌ No trial finished")
+        return None
+    # Longest budget first: a 27-epoch score beats a 3-epoch one of the same config
+    best = max(results, key=lambda r: (r['epochs'] * r['fraction'], r['map50']))
+    (study_dir / 'best.json').write_text(json.dumps(best, indent=2))
+
+    print("\n" + "="*70)
+    print("🏆 BEST CONFIGURATION (longest budget reached)")
+    print("="*70)
+    print(f"Trial:  {best['trial']} ({best['epochs']} epochs, {best['fraction']:.0%} train)")
+    print(f"mAP@50: {best['map50']:.4f} (val subset)")
+    for key, value in best['config'].items():
+        print(f"   {key:<12} {value:.6g}" if isinstance(value, float) else f"   {key:<12} {value}")
+    print(f"Spent:  {spent:.1f} epoch-equivalents | Records: {records_file}")
+    print("="*70 + "\n")
+    return best
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Successive halving / Hyperband search over model.train() settings")
+    parser.add_argument('--study', default='default', help="Study name (runs/hpo/<study>, resumable)")
+    parser.add_argument('--model', default=None, help="Start weights (default: best in the run registry)")
+    parser.add_argument('--max-epochs', type=int, default=27, help="Epochs of the longest rung")
+    parser.add_argument('--min-epochs', type=int, default=3, help="Epochs of the shortest rung")
+    parser.add_argument('--eta', type=int, default=3, help="Keep 1/eta of each rung, eta x more epochs next")
+    parser.add_argument('--brackets', default='hyperband', choices=['hyperband', 'sha'])
+    parser.add_argument('--budget', type=float, default=None, help="Total epoch-equivalents (epochs x fraction)")
+    parser.add_argument('--parallel', type=int, default=1, help="Trials trained at once (at most one per GPU)")
+    parser.add_argument('--min-fraction', type=float, default=0.1, help="Train split share of the shortest rung")
+    parser.add_argument('--val-images', type=int, default=300, help="Size of the stratified val subset")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trial', default=None, help=argparse.SUPPRESS)  # internal: one trial subprocess
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+    args = parse_args()
+    if args.trial:
+        _train_worker(json.loads(args.trial))
+    else:
+        search(args.study, model=args.model, max_epochs=args.max_epochs, min_epochs=args.min_epochs, eta=args.eta,
+               mode=args.brackets, budget=args.budget, parallel=args.parallel, min_fraction=args.min_fraction,
+               val_images=args.val_images, seed=args.seed)
@@ -0,0 +1,400 @@
+"""
+INFERENCE SERVER - Headless HTTP detector with dynamic micro-batching
+
+Holds ONE model (from backends.get_model()) and gathers concurrent
+requests into micro-batches: a batch is flushed as soon as it reaches
+--max-batch images or the oldest request has waited --max-wait-ms. Each batch
+is a single forward pass on a dedicated inference thread, so the asyncio loop
+keeps accepting and decoding requests while the model runs. The queue is
+bounded; when it is full new requests get 503 instead of piling up latency.
+
+With --workers N the forward passes go to a pre-forked worker_pool.py pool
+(N processes x --threads, one shared copy of the weights) and up to N
+batches are in flight at once; /stats then also reports per-worker throughput.
+
+Endpoints:
+    POST /predict?conf=0.25&iou=0.45&max_det=300   body = raw JPEG/PNG bytes -> JSON detections
+    GET  /stats                                     queue depth, batch sizes, latency percentiles
+    GET  /health                                    status, model path and class names
+    GET  /metrics                                   per-stage latency histograms, Prometheus text (--timing)
+    GET  /metrics.json                              the same as JSON
+
+Usage:
+    python inference_server.py --port 8765 --max-batch 8 --max-wait-ms 10
+    python inference_server.py --workers 4 --threads 2     # CPU node: see worker_pool.py sweep
+    streamlit run app.py   # uses the server when it is reachable
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, deque
+from urllib.parse import parse_qs, urlsplit
+import urllib.request
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+import torch
+import cv2
+import os
+
+from backends import get_model, resolve_model_path, select_backend
+from stage_timing import enable as enable_timing, prometheus_text, record_speed, snapshot, stage, observe
+from worker_pool import InferencePool
+
+DEFAULT_URL = os.environ.get('INFERENCE_SERVER_URL', 'http://127.0.0.1:8765')
+
+HTTP_STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large',
+               500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class MicroBatcher:
+    """Collects requests from the event loop and runs them in batched forward passes."""
+
+    def __init__(self, model, max_batch=8, max_wait_ms=10, max_queue=256, imgsz=640, device=None, model_path=None,
+                 pool=None):
+        self.model = model
+        self.pool = pool
+        self.names = pool.names if pool is not None else model.names
+        self.model_path = model_path
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.imgsz = imgsz
+        self.device = device
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.concurrency = pool.workers if pool is not None else 1  # batches in flight
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='inference')
+        self.pending = set()
+        self.batch_sizes = Counter()
+        self.latencies = deque(maxlen=2000)
+        self.n_requests = 0
+        self.n_rejected = 0
+        self.started = time.time()
+
+    async def submit(self, image, conf, iou, max_det=300):
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((image, conf, (iou, max_det), time.perf_counter(), future))
+        except asyncio.QueueFull:
+            self.n_rejected += 1
+            raise
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.concurrency)
+        while True:
+            # Wait for a free model/worker first, so requests accumulate (and the queue bound holds) meanwhile
+            await slots.acquire()
+            batch = [await self.queue.get()]
+            deadline = batch[0][3] + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # One forward pass per (NMS IoU, max_det); conf is applied per request afterwards
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[2], []).append(item)
+            for n, ((iou, max_det), items) in enumerate(groups.items()):
+                if n:
+                    await slots.acquire()
+                forward = loop.run_in_executor(self.executor, self._forward, items, iou, max_det)
+                task = asyncio.ensure_future(self._deliver(items, forward, slots))
+                self.pending.add(task)
+                task.add_done_callback(self.pending.discard)
+                self.batch_sizes[len(items)] += 1  # per forward pass, not per collected batch
+            self.n_requests += len(batch)
+
+    async def _deliver(self, items, forward, slots):
+        try:
+            records = await forward
+        except Exception as e:
+            for item in items:
+                if not item[4].done():
+                    item[4].set_exception(e)
+            return
+        finally:
+            slots.release()
+        done = time.perf_counter()
+        for item, record in zip(items, records):
+            self.latencies.append(done - item[3])
+            if not item[4].done():
+                item[4].set_result(record)
+
+    def _forward(self, items, iou, max_det):
+        conf = min(item[1] for item in items)
+        images = [item[0] for item in items]
+        start = time.perf_counter()
+        for item in items:
+            observe('queue_wait', start - item[3])
+        worker = None
+        if self.pool is not None:
+            outputs, worker, _ = self.pool.submit(images, conf=conf, iou=iou, max_det=max_det).result()
+        else:
+            results = self.model.predict(images, imgsz=self.imgsz, conf=conf, iou=iou,
+                                         max_det=max_det, device=self.device, verbose=False)
+            record_speed(results)
+            outputs = [(list(r.orig_shape), r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy(),
+                        r.boxes.cls.cpu().numpy()) for r in results]
+        forward_ms = (time.perf_counter() - start) * 1000
+        observe('forward_batch', forward_ms / 1000)
+        with stage('serialize'):
+            return self._records(items, outputs, forward_ms, worker)
+
+    def _records(self, items, outputs, forward_ms, worker=None):
+        records = []
+        for item, (shape, xyxy, scores, classes) in zip(items, outputs):
+            keep = scores >= item[1]
+            record = {
+                'shape': shape,
+                'detections': [
+                    {'class_id': int(c), 'class_name': self.names[int(c)],
+                     'confidence': round(float(s), 5), 'box': [round(float(v), 2) for v in box]}
+                    for c, s, box in zip(classes[keep], scores[keep], xyxy[keep])
+                ],
+                'batch_size': len(items),
+                'forward_ms': round(forward_ms, 2),
+            }
+            if worker is not None:
+                record['worker'] = worker
+            records.append(record)
+        return records
+
+    def stats(self):
+        lat = np.asarray(self.latencies) * 1000
+        uptime = time.time() - self.started
+        stats = {
+            'queue_depth': self.queue.qsize(),
+            'requests': self.n_requests,
+            'rejected': self.n_rejected,
+            'throughput_rps': round(self.n_requests / max(uptime, 1e-9), 2),
+            'batch_sizes': dict(sorted(self.batch_sizes.items())),
+            'mean_batch_size': round(sum(k * v for k, v in self.batch_sizes.items()) / max(sum(self.batch_sizes.values()), 1), 2),
+            'latency_ms': {
+                'p50': round(float(np.percentile(lat, 50)), 2) if len(lat) else None,
+                'p95': round(float(np.percentile(lat, 95)), 2) if len(lat) else None,
+                'p99': round(float(np.percentile(lat, 99)), 2) if len(lat) else None,
+            },
+        }
+        if self.pool is not None:
+            stats['pool'] = self.pool.stats()
+        return stats
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+async def read_request(reader, max_body):
+    """(method, target, headers, body), or None on EOF; ValueError on a malformed request."""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    parts = request_line.decode('latin-1').split(' ', 2)
+    if len(parts) != 3:
+        raise ValueError('malformed request line')
+    method, target, _ = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise ValueError('bad Content-Length') from None
+    if length < 0:
+        raise ValueError('bad Content-Length')
+    if length > max_body:
+        raise PayloadTooLarge(f'payload too large (max {max_body} bytes)')
+    body = await reader.readexactly(length) if length else b''
+    return method, target, headers, body
+
+
+def write_response(writer, status, payload, content_type='application/json'):
+    body = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+    writer.write(
+        f"HTTP/1.1 {status} {HTTP_STATUS[status]}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: close\r\n\r\n".encode() + body
+    )
+
+
+def decode_image(data):
+    with stage('decode'):
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def make_handler(batcher, max_body=32 << 20):
+    loop_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='decode')
+
+    async def handle(reader, writer):
+        try:
+            try:
+                request = await read_request(reader, max_body)
+            except PayloadTooLarge as e:
+                write_response(writer, 413, {'error': str(e)})
+                return
+            except ValueError as e:
+                write_response(writer, 400, {'error': str(e)})
+                return
+            if request is None:
+                return
+            method, target, headers, body = request
+            url = urlsplit(target)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+            if method == 'GET' and url.path == '/health':
+                error = batcher.pool.error if batcher.pool is not None else None
+                write_response(writer, 503 if error else 200, {'status': 'error' if error else 'ok', 'error': error,
+                                                              'model': str(batcher.model_path),
+                                                              'names': batcher.names})
+            elif method == 'GET' and url.path == '/stats':
+                write_response(writer, 200, batcher.stats())
+            elif method == 'GET' and url.path == '/metrics':
+                write_response(writer, 200, prometheus_text(), content_type='text/plain; version=0.0.4')
+            elif method == 'GET' and url.path == '/metrics.json':
+                write_response(writer, 200, snapshot())
+            elif method == 'POST' and url.path == '/predict':
+                try:
+                    conf, iou = float(params.get('conf', 0.25)), float(params.get('iou', 0.45))
+                    max_det = int(params.get('max_det', 300))
+                except ValueError:
+                    write_response(writer, 400, {'error': 'conf and iou must be numbers, max_det an integer'})
+                    return
+                image = await asyncio.get_running_loop().run_in_executor(loop_executor, decode_image, body)
+                if image is None:
+                    write_response(writer, 400, {'error': 'could not decode image'})
+                    return
+                try:
+                    record = await batcher.submit(image, conf, iou, max_det)
+                except asyncio.QueueFull:
+                    write_response(writer, 503, {'error': 'queue full'})
+                    return
+                write_response(writer, 200, record)
+            else:
+                write_response(writer, 404, {'error': f'no route {method} {url.path}'})
+        except Exception as e:
+            write_response(writer, 500, {'error': str(e)})
+        finally:
+            try:
+                await writer.drain()
+            finally:
+                writer.close()
+
+    return handle
+
+
+async def serve(host='127.0.0.1', port=8765, model_path=None, max_batch=8, max_wait_ms=10,
+                max_queue=256, imgsz=640, device=None, backend='auto', workers=1, threads=None, timing=False):
+    if timing:
+        enable_timing()
+    model_path = resolve_model_path(model_path)
+    model = pool = None
+    if workers > 1:
+        if backend not in ('auto', 'pytorch'):
+            raise ValueError(f"--backend {backend} needs --workers 1: pool workers always run the PyTorch model")
+        # Pre-forked PyTorch workers sharing one copy of the weights (worker_pool.py)
+        pool = InferencePool(model_path, workers=workers, threads=threads, imgsz=imgsz, device=device or 'cpu')
+        backend = 'pytorch'
+    else:
+        if backend == 'auto':
+            backend = select_backend(model_path, imgsz)
+        if threads:
+            if backend in ('pytorch', 'torchscript'):
+                torch.set_num_threads(threads)
+            else:
+                print(f"⚠️ --threads only applies to PyTorch / TorchScript; {backend} keeps its own thread pool")
+        model = get_model(model_path, backend=backend, imgsz=imgsz)
+    batcher = MicroBatcher(model, max_batch=max_batch, max_wait_ms=max_wait_ms, max_queue=max_queue,
+                           imgsz=imgsz, device=device, model_path=model_path, pool=pool)
+    server = await asyncio.start_server(make_handler(batcher), host, port)
+
+    print("="*70)
+    print("🛰️ INFERENCE SERVER")
+    print("="*70)
+    print(f"Model:    {model_path} ({backend})")
+    print(f"Listening on http://{host}:{port}")
+    print(f"Batching: max {max_batch} images / {max_wait_ms} ms | queue limit {max_queue}")
+    if pool is not None:
+        print(f"Workers:  {pool.workers} processes x {pool.threads} threads ({pool.start_method}, shared weights)")
+    print("="*70 + "\n")
+
+    async with server:
+        await asyncio.gather(server.serve_forever(), batcher.run())
+
+
+# ===== CLIENT =====
+
+def predict_remote(image_bytes, conf=0.25, iou=0.45, max_det=300, url=DEFAULT_URL, timeout=30):
+    """POST an encoded image to the server and return its JSON record."""
+    request = urllib.request.Request(f"{url}/predict?conf={conf}&iou={iou}&max_det={max_det}", data=image_bytes,
+                                     headers={'Content-Type': 'application/octet-stream'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def fetch_stats(url=DEFAULT_URL, timeout=0.5):
+    """Server /stats as a dict, or None when the server is not running."""
+    try:
+        with urllib.request.urlopen(f"{url}/stats", timeout=timeout) as response:
+            return json.loads(response.read())
+    except OSError:
+        return None
+
+
+def fetch_timing(url=DEFAULT_URL, timeout=0.5):
+    """Server /metrics.json as a dict, or None when the server is not running."""
+    try:
+        with urllib.request.urlopen(f"{url}/metrics.json", timeout=timeout) as response:
+            return json.loads(response.read())
+    except OSError:
+        return None
+
+
+def server_info(url=DEFAULT_URL, timeout=0.5):
+    """Server /health as a dict (model path, class names), or None when it is down."""
+    try:
+        with urllib.request.urlopen(f"{url}/health", timeout=timeout) as response:
+            return json.loads(response.read())
+    except OSError:
+        return None
+
+
+def server_available(url=DEFAULT_URL, timeout=0.5):
+    return server_info(url, timeout) is not None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Micro-batching HTTP inference server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--model', default=None, help="Weights path, run name or alias (default: best)")
+    parser.add_argument('--max-batch', type=int, default=8)
+    parser.add_argument('--max-wait-ms', type=float, default=10)
+    parser.add_argument('--max-queue', type=int, default=256)
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--device', default=None)
+    parser.add_argument('--backend', default='auto', choices=['auto', 'pytorch', 'onnx', 'openvino', 'torchscript', 'onnx_int8'])
+    parser.add_argument('--workers', type=int, default=1, help="Pre-forked PyTorch worker processes")
+    parser.add_argument('--threads', type=int, default=None,
+                        help="Intra-op threads per worker, or of the single PyTorch/TorchScript model (default: cores / workers)")
+    parser.add_argument('--timing', action='store_true', help="Collect per-stage latency histograms for /metrics")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    asyncio.run(serve(host=args.host, port=args.port, model_path=args.model, max_batch=args.max_batch,
+                      max_wait_ms=args.max_wait_ms, max_queue=args.max_queue, imgsz=args.imgsz,
+                      device=args.device, backend=args.backend, workers=args.workers, threads=args.threads,
+                      timing=args.timing))
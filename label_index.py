@@ -0,0 +1,199 @@
+"""
+LABEL INDEX - Every YOLO label of every split in one columnar file
+
+Scans the label .txt files of train/val/test (from yolo_params.yaml) once,
+in parallel, into runs/cache/label_index.npz:
+    per box    cls int16, w, h, area float32 (normalized), image int32, split int8
+    per image  files, split int8, label mtimes
+
+Re-indexing only parses label files whose mtime changed; everything else is
+copied over column by column. Dataset statistics (class counts, box-size
+histograms, per-split imbalance) are then plain NumPy reductions that stay in
+the millisecond range at hundreds of thousands of boxes, which is what the
+"Dataset Challenges" section of app.py renders from.
+
+Usage:
+    python label_index.py                 # build / refresh and print a summary
+    python label_index.py --workers 8
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import argparse
+import time
+import numpy as np
+import os
+
+from dataset_utils import img2label_path, load_data_config, read_labels, split_image_paths
+
+INDEX_FILE = Path('runs/cache/label_index.npz')
+SPLITS = ['train', 'val', 'test']
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _parse_chunk(label_paths):
+    """(counts per file, cls, w, h) for a chunk of label files."""
+    counts, cls, wh = [], [], []
+    for path in label_paths:
+        c, xyxy = read_labels(path)
+        counts.append(len(c))
+        cls.append(c.astype(np.int16))
+        wh.append(xyxy[:, 2:] - xyxy[:, :2])
+    return (np.asarray(counts, dtype=np.int64), np.concatenate(cls) if cls else np.zeros(0, np.int16),
+            np.concatenate(wh) if wh else np.zeros((0, 2), np.float32))
+
+
+class LabelIndex:
+    """Columnar view of all labels. Box columns are aligned; `image` indexes `files`."""
+
+    def __init__(self, files, image_split, mtimes, offsets, cls, w, h, names):
+        self.files = list(files)
+        self.image_split = np.asarray(image_split, dtype=np.int8)
+        self.mtimes = np.asarray(mtimes, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.cls = np.asarray(cls, dtype=np.int16)
+        self.w = np.asarray(w, dtype=np.float32)
+        self.h = np.asarray(h, dtype=np.float32)
+        self.area = self.w * self.h
+        self.image = np.repeat(np.arange(len(self.files), dtype=np.int32), np.diff(self.offsets))
+        self.split = self.image_split[self.image]
+        self.names = list(names)
+
+    def __len__(self):
+        return len(self.cls)
+
+    def save(self, path=INDEX_FILE):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + '.tmp.npz')
+        np.savez(tmp, files=np.asarray(self.files), image_split=self.image_split, mtimes=self.mtimes,
+                 offsets=self.offsets, cls=self.cls, w=self.w, h=self.h, names=np.asarray(self.names))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=INDEX_FILE):
+        with np.load(path) as z:
+            return cls(z['files'].tolist(), z['image_split'], z['mtimes'], z['offsets'],
+                       z['cls'], z['w'], z['h'], z['names'].tolist())
+
+    # --- statistics -------------------------------------------------------
+
+    def class_counts(self, split=None):
+        """Boxes per class, optionally for one split name."""
+        mask = slice(None) if split is None else self.split == SPLITS.index(split)
+        return np.bincount(self.cls[mask], minlength=len(self.names))
+
+    def images_per_class(self, split=None):
+        """Images containing at least one box of each class."""
+        mask = slice(None) if split is None else self.split == SPLITS.index(split)
+        pairs = np.unique(self.image[mask].astype(np.int64) * len(self.names) + self.cls[mask])
+        return np.bincount(pairs % len(self.names), minlength=len(self.names))
+
+    def split_images(self):
+        return np.bincount(self.image_split, minlength=len(SPLITS))
+
+    def size_histogram(self, class_id=None, split=None, bins=40):
+        """Histogram of sqrt(area) (relative box size) on a log scale."""
+        mask = np.ones(len(self), dtype=bool)
+        if class_id is not None:
+            mask &= self.cls == class_id
+        if split is not None:
+            mask &= self.split == SPLITS.index(split)
+        edges = np.geomspace(1e-3, 1.0, bins + 1)
+        counts, _ = np.histogram(np.sqrt(self.area[mask]), bins=edges)
+        return counts, edges
+
+
+def build_index(path=INDEX_FILE, workers=None, chunk_size=512, data=None):
+    """Create or incrementally refresh the label index. Returns the LabelIndex."""
+    data = data or load_data_config()
+    old = LabelIndex.load(path) if Path(path).exists() else None
+    old_rows = {f: i for i, f in enumerate(old.files)} if old is not None else {}
+
+    files, image_split = [], []
+    for s, split in enumerate(SPLITS):
+        if split in data:
+            paths = [str(p) for p in split_image_paths(split, data)]
+            files += paths
+            image_split += [s] * len(paths)
+    label_paths = [img2label_path(f) for f in files]
+    mtimes = np.asarray([_mtime(p) for p in label_paths], dtype=np.int64)
+
+    reuse = np.zeros(len(files), dtype=bool)
+    old_ids = np.full(len(files), -1, dtype=np.int64)
+    for i, f in enumerate(files):
+        j = old_rows.get(f)
+        if j is not None and old.mtimes[j] == mtimes[i]:
+            reuse[i], old_ids[i] = True, j
+    todo = np.flatnonzero(~reuse)
+
+    start = time.perf_counter()
+    chunks = [[label_paths[i] for i in todo[a:a + chunk_size]] for a in range(0, len(todo), chunk_size)]
+    if workers and workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parsed = list(pool.map(_parse_chunk, chunks))
+    else:
+        parsed = [_parse_chunk(c) for c in chunks]
+
+    counts = np.zeros(len(files), dtype=np.int64)
+    if parsed:
+        counts[todo] = np.concatenate([p[0] for p in parsed])
+    new_cls = np.concatenate([p[1] for p in parsed]) if parsed else np.zeros(0, np.int16)
+    new_wh = np.concatenate([p[2] for p in parsed]) if parsed else np.zeros((0, 2), np.float32)
+    if old is not None:
+        counts[reuse] = np.diff(old.offsets)[old_ids[reuse]]
+
+    # Assemble the columns in file order: reused rows are gathered, parsed rows appended in order
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    cls = np.zeros(offsets[-1], dtype=np.int16)
+    wh = np.zeros((offsets[-1], 2), dtype=np.float32)
+    new_pos = 0
+    for i in range(len(files)):
+        a, b = offsets[i], offsets[i + 1]
+        if a == b:
+            continue
+        if reuse[i]:
+            oa, ob = old.offsets[old_ids[i]], old.offsets[old_ids[i] + 1]
+            cls[a:b], wh[a:b, 0], wh[a:b, 1] = old.cls[oa:ob], old.w[oa:ob], old.h[oa:ob]
+        else:
+            cls[a:b], wh[a:b] = new_cls[new_pos:new_pos + b - a], new_wh[new_pos:new_pos + b - a]
+            new_pos += b - a
+
+    index = LabelIndex(files, image_split, mtimes, offsets, cls, wh[:, 0], wh[:, 1], data['names'])
+    index.save(path)
+    print(f"   🏷️ Indexed {len(files)} images / {len(index)} boxes "
+          f"({len(todo)} label files parsed, {int(reuse.sum())} reused) in {time.perf_counter() - start:.1f}s")
+    return index
+
+
+def load_or_build_index(path=INDEX_FILE):
+    return LabelIndex.load(path) if Path(path).exists() else build_index(path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the columnar label index")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+    args = parse_args()
+
+    print("="*70)
+    print("🏷️ LABEL INDEX")
+    print("="*70)
+    index = build_index(workers=args.workers)
+    print("-"*70)
+    print(f"{'Class':<22}" + "".join(f"{s:>10}" for s in SPLITS))
+    per_split = [index.class_counts(s) for s in SPLITS]
+    for c, name in enumerate(index.names):
+        print(f"{name:<22}" + "".join(f"{counts[c]:>10}" for counts in per_split))
+    print("="*70 + "\n")
@@ -0,0 +1,290 @@
+"""
+BATCH PREDICTION CLI - Stream whole image folders through the detector
+
+Walks a directory (or a .txt file list) lazily, decodes frames on a background
+thread pool with a bounded prefetch window, and feeds fixed-size batches to the
+model. Detections are written as they arrive:
+  - <out>/labels/<image>.txt   YOLO format: cls xc yc w h conf (normalized)
+  - <out>/predictions.jsonl    one JSON object per image
+
+Memory stays constant no matter how many frames are in the folder: only
+`prefetch` decoded images and one batch of results are alive at any time.
+
+--tile runs large frames as overlapping native-resolution tiles (tiling.py),
+which recovers small objects that vanish when a 4K capture is shrunk to 640.
+
+Usage:
+    python predict.py --source path/to/images
+    python predict.py --source frames.txt --batch 16 --workers 6 --device cpu
+    python predict.py --source captures_4k/ --tile --tile-overlap 0.25 --merge wbf
+    python predict.py --shards test                # pre-resized test split from shard_cache.py
+    python predict.py --source path/to/images --timing   # decode / forward / NMS / write breakdown
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from pathlib import Path
+import argparse
+import json
+import time
+import cv2
+import os
+
+from backends import get_model, resolve_model_path
+from stage_timing import (dump_json, enable as enable_timing, enabled as timing_enabled, print_summary,
+                          record_speed, stage)
+from tiling import predict_tiled
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff'}
+
+
+def iter_image_paths(source):
+    """Lazily yield image paths from a directory tree, a .txt list or a single file."""
+    source = Path(source)
+    if source.is_dir():
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if Path(name).suffix.lower() in IMAGE_EXTENSIONS:
+                    yield Path(root) / name
+    elif source.suffix.lower() == '.txt':
+        with open(source) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield Path(line)
+    else:
+        yield source
+
+
+def _decode(path):
+    return path, cv2.imread(str(path))
+
+
+def prefetch_images(paths, workers=4, prefetch=64, decode=_decode):
+    """Decode images on a thread pool, keeping at most `prefetch` in flight.
+
+    cv2.imread releases the GIL, so decoding runs in parallel with the forward
+    pass of the previous batch. Images are yielded in input order. `decode`
+    maps one item to (name, BGR image or None); bulk.py passes in-memory uploads.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for path in paths:
+            pending.append(pool.submit(decode, path))
+            if len(pending) >= prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def batched(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def label_path_for(image_path, source, labels_dir):
+    """Mirror the source folder layout under labels_dir so equal stems don't collide."""
+    source = Path(source)
+    if source.is_dir():
+        try:
+            rel = Path(image_path).relative_to(source)
+            return labels_dir / rel.with_suffix('.txt')
+        except ValueError:
+            pass
+    return labels_dir / (Path(image_path).stem + '.txt')
+
+
+def write_yolo_txt(path, result):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    boxes = result.boxes
+    cls = boxes.cls.cpu().numpy().astype(int)
+    conf = boxes.conf.cpu().numpy()
+    xywhn = boxes.xywhn.cpu().numpy()
+    with open(path, 'w') as f:
+        for c, s, (x, y, w, h) in zip(cls, conf, xywhn):
+            f.write(f"{c} {x:.6f} {y:.6f} {w:.6f} {h:.6f} {s:.5f}\n")
+
+
+def result_to_record(image_path, result, orig_shape=None):
+    """orig_shape rescales boxes when the model saw a pre-resized image (shard cache)."""
+    boxes = result.boxes
+    cls = boxes.cls.cpu().numpy().astype(int)
+    conf = boxes.conf.cpu().numpy()
+    xyxy = boxes.xyxy.cpu().numpy()
+    if orig_shape is not None:
+        h, w = result.orig_shape
+        xyxy = xyxy * [orig_shape[1] / w, orig_shape[0] / h] * 2
+    return {
+        'image': str(image_path),
+        'shape': list(orig_shape if orig_shape is not None else result.orig_shape),
+        'detections': [
+            {
+                'class_id': int(c),
+                'class_name': result.names[int(c)],
+                'confidence': round(float(s), 5),
+                'box': [round(float(v), 2) for v in box],
+            }
+            for c, s, box in zip(cls, conf, xyxy)
+        ],
+    }
+
+
+def run_prediction(source, out_dir='runs/predict/exp', model_path=None, batch=16,
+                   imgsz=640, conf=0.25, iou=0.45, device=None, workers=4,
+                   prefetch=64, augment=False, save_txt=True, save_jsonl=True, backend='auto',
+                   tile=False, tile_size=None, tile_overlap=0.2, full_frame=True, merge='nms', shards=None):
+    model_path = resolve_model_path(model_path)
+    model = get_model(model_path, backend='pytorch' if augment else backend, imgsz=imgsz)
+    out_dir = Path(out_dir)
+    labels_dir = out_dir / 'labels'
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    print("="*70)
+    print("🛰️ BATCH PREDICTION")
+    print("="*70)
+    print(f"Model:  {model_path}")
+    print(f"Source: {source}")
+    print(f"Output: {out_dir}")
+    print(f"Batch: {batch} | Decode workers: {workers} | Prefetch: {prefetch}")
+    if tile:
+        print(f"Tiles: {tile_size or imgsz}px, {tile_overlap:.0%} overlap, merge={merge}, "
+              f"full-frame pass {'on' if full_frame else 'off'}")
+    print("="*70 + "\n")
+
+    jsonl = open(out_dir / 'predictions.jsonl', 'w') if save_jsonl else None
+    n_images = n_boxes = n_failed = 0
+    start = time.perf_counter()
+
+    try:
+        if shards:
+            # Pre-resized frames straight out of the memory-mapped shard, no decode at all
+            from shard_cache import ShardCache  # shard_cache imports this module
+            shard = ShardCache.open(shards, imgsz)
+            if shard is None:
+                raise FileNotFoundError(f"No '{shards}' shard at imgsz={imgsz}, run shard_cache.py first")
+            orig_shapes = {f: tuple(shape) for f, shape in zip(shard.files, shard.orig_shapes)}
+            frames = ((Path(f), shard.image(i)) for i, f in enumerate(shard.files))
+        else:
+            orig_shapes = {}
+            frames = prefetch_images(iter_image_paths(source), workers=workers, prefetch=prefetch)
+        chunks = batched(frames, batch)
+        while True:
+            with stage('decode_wait'):  # time the loop spends waiting on the decode threads
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            paths = []
+            images = []
+            for path, image in chunk:
+                if image is None:
+                    print(f"⚠️ Could not decode: {path}")
+                    n_failed += 1
+                    continue
+                paths.append(path)
+                images.append(image)
+            if not images:
+                continue
+
+            with stage('predict_batch'):
+                if tile:
+                    results = predict_tiled(model, images, imgsz=imgsz, tile=tile_size, overlap=tile_overlap,
+                                            conf=conf, iou=iou, full_frame=full_frame, merge=merge,
+                                            device=device, augment=augment, paths=paths)
+                else:
+                    results = model.predict(images, imgsz=imgsz, conf=conf, iou=iou,
+                                            device=device, augment=augment, verbose=False)
+            record_speed(results)
+
+            with stage('write'):
+                for path, result in zip(paths, results):
+                    if save_txt:
+                        write_yolo_txt(label_path_for(path, source, labels_dir), result)
+                    if jsonl:
+                        jsonl.write(json.dumps(result_to_record(path, result, orig_shapes.get(str(path)))) + "\n")
+                    n_boxes += len(result.boxes)
+            n_images += len(images)
+
+            if n_images % (batch * 50) < len(images):
+                elapsed = time.perf_counter() - start
+                print(f"   {n_images} images | {n_images / elapsed:.1f} img/s")
+    finally:
+        if jsonl:
+            jsonl.close()
+
+    elapsed = time.perf_counter() - start
+    print("\n" + "="*70)
+    print("✅ PREDICTION COMPLETE")
+    print("="*70)
+    print(f"Images:     {n_images} ({n_failed} failed to decode)")
+    print(f"Detections: {n_boxes}")
+    print(f"Throughput: {n_images / max(elapsed, 1e-9):.1f} img/s ({elapsed:.1f}s total)")
+    print(f"Results in: {out_dir}")
+    if timing_enabled():
+        print("-"*70)
+        print_summary()
+        print(f"Stage timings: {dump_json('predict')}")
+    print("="*70 + "\n")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Batch inference over an image folder or file list")
+    parser.add_argument('--source', default=None, help="Image directory, .txt file list or single image")
+    parser.add_argument('--shards', default=None, metavar='SPLIT',
+                        help="Read a split from the shard cache (shard_cache.py) instead of --source")
+    parser.add_argument('--out', default='runs/predict/exp', help="Output directory")
+    parser.add_argument('--model', default=None, help="Weights path, run name or alias (default: best)")
+    parser.add_argument('--batch', type=int, default=16)
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--iou', type=float, default=0.45)
+    parser.add_argument('--device', default=None, help="e.g. cpu, 0")
+    parser.add_argument('--workers', type=int, default=4, help="Decode threads")
+    parser.add_argument('--prefetch', type=int, default=64, help="Max decoded images in flight")
+    parser.add_argument('--augment', action='store_true', help="Enable TTA (forces the pytorch backend)")
+    parser.add_argument('--backend', default='auto', choices=['auto', 'pytorch', 'onnx', 'openvino', 'torchscript', 'onnx_int8'])
+    parser.add_argument('--tile', action='store_true', help="Tiled inference for high-resolution frames")
+    parser.add_argument('--tile-size', type=int, default=None, help="Tile side in pixels (default: imgsz)")
+    parser.add_argument('--tile-overlap', type=float, default=0.2)
+    parser.add_argument('--no-full-frame', action='store_true', help="Skip the extra full-frame pass when tiling")
+    parser.add_argument('--merge', default='nms', choices=['nms', 'wbf'], help="Cross-tile merge")
+    parser.add_argument('--no-txt', action='store_true', help="Skip YOLO txt output")
+    parser.add_argument('--no-jsonl', action='store_true', help="Skip JSONL output")
+    parser.add_argument('--timing', action='store_true', help="Per-stage latency breakdown (stage_timing.py)")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if not args.source and not args.shards:
+        raise SystemExit("❌ Pass --source or --shards")
+    if args.timing:
+        enable_timing()
+    run_prediction(
+        source=args.source or args.shards,
+        out_dir=args.out,
+        model_path=args.model,
+        batch=args.batch,
+        imgsz=args.imgsz,
+        conf=args.conf,
+        iou=args.iou,
+        device=args.device,
+        workers=args.workers,
+        prefetch=max(args.prefetch, 2 * args.batch),
+        augment=args.augment,
+        save_txt=not args.no_txt,
+        save_jsonl=not args.no_jsonl,
+        backend=args.backend,
+        tile=args.tile,
+        tile_size=args.tile_size,
+        tile_overlap=args.tile_overlap,
+        full_frame=not args.no_full_frame,
+        merge=args.merge,
+        shards=args.shards,
+    )
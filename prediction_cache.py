@@ -0,0 +1,126 @@
+"""
+PREDICTION CACHE - Run each checkpoint over a split ONCE, reuse it everywhere
+
+Raw detections are stored per model as a single .npz under runs/cache/predictions,
+keyed by weights hash + split + imgsz + TTA + conf/iou. Re-running an ensemble,
+a threshold sweep or an evaluation only touches the forward pass for models
+that have never been seen with those settings.
+
+Storage layout (all detections of the split concatenated, CSR style):
+    files    (n_images,)     image paths
+    shapes   (n_images, 2)   original h, w
+    offsets  (n_images + 1,) detections of image i live in [offsets[i], offsets[i+1])
+    boxes    (n, 4) float32  normalized xyxy
+    scores   (n,)   float32
+    classes  (n,)   int16
+"""
+
+from pathlib import Path
+import numpy as np
+import json
+import time
+import os
+
+from backends import get_model, weights_hash
+from dataset_utils import split_image_paths
+from predict import prefetch_images, batched
+
+CACHE_DIR = Path('runs/cache/predictions')
+
+
+class PredictionSet:
+    """Detections for every image of a split, stored as flat arrays + offsets."""
+
+    def __init__(self, files, offsets, boxes, scores, classes, shapes=None, meta=None):
+        self.files = [str(f) for f in files]
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.scores = np.asarray(scores, dtype=np.float32)
+        self.classes = np.asarray(classes, dtype=np.int16)
+        self.shapes = np.zeros((len(self.files), 2), dtype=np.int32) if shapes is None else np.asarray(shapes, dtype=np.int32)
+        self.meta = meta or {}
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, i):
+        a, b = self.offsets[i], self.offsets[i + 1]
+        return self.boxes[a:b], self.scores[a:b], self.classes[a:b]
+
+    @classmethod
+    def from_images(cls, files, detections, shapes=None, meta=None):
+        """Build from a per-image list of (boxes, scores, classes) tuples."""
+        counts = [len(d[1]) for d in detections]
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        if detections:
+            boxes = np.concatenate([np.asarray(d[0], dtype=np.float32).reshape(-1, 4) for d in detections])
+            scores = np.concatenate([np.asarray(d[1], dtype=np.float32) for d in detections])
+            classes = np.concatenate([np.asarray(d[2], dtype=np.int16) for d in detections])
+        else:
+            boxes, scores, classes = np.zeros((0, 4)), np.zeros(0), np.zeros(0)
+        return cls(files, offsets, boxes, scores, classes, shapes, meta)
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + '.tmp.npz')
+        np.savez(tmp, files=np.asarray(self.files), offsets=self.offsets, boxes=self.boxes,
+                 scores=self.scores, classes=self.classes, shapes=self.shapes,
+                 meta=np.asarray(json.dumps(self.meta)))
+        os.replace(tmp, path)  # never leave a half-written cache behind
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            return cls(z['files'].tolist(), z['offsets'], z['boxes'], z['scores'],
+                       z['classes'], z['shapes'], json.loads(str(z['meta'])))
+
+
+def cache_path(digest, split, imgsz=640, augment=False, conf=0.001, iou=0.7):
+    tta = augment if isinstance(augment, str) else ('tta' if augment else 'plain')  # e.g. 'selective'
+    return CACHE_DIR / f"{digest[:16]}_{split}_{imgsz}_{tta}_c{conf:g}_i{iou:g}.npz"
+
+
+def predict_split(model_path, split, imgsz=640, augment=False, conf=0.001, iou=0.7,
+                  max_det=300, batch=16, device=None, workers=4, model=None, paths=None):
+    """Predictions over a split, or over `paths` (e.g. unlabeled images) cached under the name `split`."""
+    # Always the PyTorch weights: cached predictions are evaluation-grade and may use TTA
+    model = model or get_model(model_path, backend='pytorch')
+    files, detections, shapes = [], [], []
+    paths = list(paths) if paths is not None else split_image_paths(split)
+    n_images = len(paths)
+    start = time.perf_counter()
+    frames = prefetch_images(paths, workers=workers, prefetch=4 * batch)
+    for chunk in batched(frames, batch):
+        chunk = [(p, im) for p, im in chunk if im is not None]
+        if not chunk:
+            continue
+        results = model.predict([im for _, im in chunk], imgsz=imgsz, conf=conf, iou=iou,
+                                max_det=max_det, augment=augment, device=device, verbose=False)
+        for (path, _), r in zip(chunk, results):
+            files.append(str(path))
+            shapes.append(r.orig_shape)
+            detections.append((r.boxes.xyxyn.cpu().numpy(),
+                               r.boxes.conf.cpu().numpy(),
+                               r.boxes.cls.cpu().numpy()))
+        if len(files) % (batch * 25) < len(chunk):
+            print(f"   {len(files)}/{n_images} images ({time.perf_counter() - start:.0f}s)")
+    meta = {'model': str(model_path), 'split': split, 'imgsz': imgsz, 'augment': augment,
+            'conf': conf, 'iou': iou, 'max_det': max_det}
+    return PredictionSet.from_images(files, detections, shapes, meta)
+
+
+def cached_predictions(model_path, split, imgsz=640, augment=False, conf=0.001, iou=0.7,
+                       max_det=300, batch=16, device=None, refresh=False, paths=None):
+    """Load predictions from the cache, running inference only on a miss."""
+    digest = weights_hash(model_path)
+    path = cache_path(digest, split, imgsz, augment, conf, iou)
+    if path.exists() and not refresh:
+        print(f"   💾 Cache hit: {path}")
+        return PredictionSet.load(path)
+    print(f"   🔬 Cache miss, running inference -> {path}")
+    preds = predict_split(model_path, split, imgsz=imgsz, augment=augment, conf=conf, iou=iou,
+                          max_det=max_det, batch=batch, device=device, paths=paths)
+    preds.meta['weights_hash'] = digest
+    preds.save(path)
+    return preds
@@ -0,0 +1,290 @@
+"""
+CHANNEL PRUNING - Physically remove low-importance conv channels, fine-tune, report
+
+The 7-class task probably does not need every channel of the medium model.
+For each sparsity level:
+  1. Rank channels by the magnitude of their BatchNorm scale |gamma| (network
+     slimming): a channel whose gamma is near zero contributes almost nothing
+     after BN. A single global threshold is used, so layers with many weak
+     channels lose more of them.
+  2. Cut them out for real: the producing Conv + BN get fewer output channels
+     and the consuming conv loses the matching input channels. The result is
+     a smaller dense model, not a mask, so CPU latency drops.
+     Only channels that feed exactly one conv are cut: the hidden conv of every
+     Bottleneck, the SPPF bottleneck and the two stacked convs of each Detect
+     box/class branch. Concat / residual outputs keep their width.
+     Kept counts are rounded up to a multiple of 8 (SIMD-friendly).
+  3. Fine-tune the pruned model for a few epochs on yolo_params.yaml (shard
+     cache + class-balanced sampling, as in train.py).
+  4. Parameters, GFLOPs, CPU latency and val mAP@50 for every level, written
+     to runs/prune/<run>/report.md + report.json.
+
+Usage:
+    python prune.py
+    python prune.py --levels 0.3 0.5 0.7 --epochs 15
+    python prune.py --levels 0.5 --epochs 0         # prune only, no fine-tune
+"""
+
+from ultralytics import YOLO
+from ultralytics.nn.modules import SPPF, Bottleneck, Conv, Detect
+from pathlib import Path
+import argparse
+import copy
+import json
+import math
+import time
+import torch
+import torch.nn as nn
+import os
+
+from backends import default_device, measure_latency
+from class_balance import make_trainer
+from run_registry import register_run, resolve_model
+from shard_cache import MemmapDetectionValidator
+
+DEFAULT_LEVELS = (0.3, 0.5, 0.7)
+ROUND_TO = 8       # kept channels per layer: multiple of 8
+MIN_CHANNELS = 8   # never prune a layer below this
+
+
+def prunable_pairs(model):
+    """(producer Conv, consumer nn.Conv2d, input repeats) for every channel dimension that can be cut alone."""
+    pairs = []
+    for m in model.modules():
+        if isinstance(m, Bottleneck):
+            pairs.append((m.cv1, m.cv2.conv, 1))
+        elif isinstance(m, SPPF):
+            pairs.append((m.cv1, m.cv2.conv, 4))  # cv2 sees concat(x, pool(x), pool2(x), pool3(x))
+        elif isinstance(m, Detect):
+            for branch in list(m.cv2) + list(m.cv3):
+                if isinstance(branch[0], Conv) and isinstance(branch[1], Conv) and isinstance(branch[2], nn.Conv2d):
+                    pairs.append((branch[0], branch[1].conv, 1))
+                    pairs.append((branch[1], branch[2], 1))
+    return [(p, c, r) for p, c, r in pairs
+            if isinstance(getattr(p, 'bn', None), nn.BatchNorm2d) and p.conv.groups == 1 and c.groups == 1]
+
+
+def keep_counts(pairs, sparsity, round_to=ROUND_TO, min_channels=MIN_CHANNELS):
+    """Channels kept per pair under one global |gamma| threshold removing `sparsity` of all prunable channels."""
+    gammas = torch.cat([p.bn.weight.detach().abs().flatten() for p, _, _ in pairs])
+    k = int(len(gammas) * sparsity)
+    threshold = torch.sort(gammas).values[k - 1] if k > 0 else -1.0
+    counts = []
+    for p, _, _ in pairs:
+        c = p.bn.num_features
+        keep = int((p.bn.weight.detach().abs() > threshold).sum())
+        keep = min(c, max(min_channels, int(math.ceil(keep / round_to)) * round_to))
+        counts.append(keep)
+    return counts
+
+
+def _slice_conv(conv, out_idx=None, in_idx=None):
+    weight = conv.weight.data
+    if out_idx is not None:
+        weight = weight[out_idx]
+    if in_idx is not None:
+        weight = weight[:, in_idx]
+    new = nn.Conv2d(weight.shape[1], weight.shape[0], conv.kernel_size, conv.stride, conv.padding,
+                    conv.dilation, conv.groups, bias=conv.bias is not None).to(weight.device)
+    new.weight.data = weight.clone()
+    if conv.bias is not None:
+        new.bias.data = (conv.bias.data[out_idx] if out_idx is not None else conv.bias.data).clone()
+    return new
+
+
+def _slice_bn(bn, idx):
+    new = nn.BatchNorm2d(len(idx), bn.eps, bn.momentum).to(bn.weight.device)
+    for name in ('weight', 'bias'):
+        getattr(new, name).data = getattr(bn, name).data[idx].clone()
+    for name in ('running_mean', 'running_var'):
+        setattr(new, name, getattr(bn, name)[idx].clone())
+    return new
+
+
+def _replace(root, old, new):
+    for module in root.modules():
+        for name, child in module.named_children():
+            if child is old:
+                setattr(module, name, new)
+                return
+
+
+def prune_model(model, sparsity, round_to=ROUND_TO, min_channels=MIN_CHANNELS):
+    """Physically remove the lowest-|gamma| channels from a (non-fused) DetectionModel, in place."""
+    pairs = prunable_pairs(model)
+    if not pairs:
+        raise ValueError("No prunable Conv + BN pairs found (fused model? load the .pt checkpoint)")
+    counts = keep_counts(pairs, sparsity, round_to, min_channels)
+    before = after = 0
+    for (producer, consumer, repeats), keep in zip(pairs, counts):
+        c = producer.bn.num_features
+        before += c
+        after += keep
+        if keep == c:
+            continue
+        idx = torch.sort(torch.argsort(producer.bn.weight.detach().abs(), descending=True)[:keep]).values
+        producer.conv = _slice_conv(producer.conv, out_idx=idx)
+        producer.bn = _slice_bn(producer.bn, idx)
+        in_idx = torch.cat([idx + r * c for r in range(repeats)])
+        _replace(model, consumer, _slice_conv(consumer, in_idx=in_idx))
+    return {'prunable_channels': before, 'kept_channels': after, 'layers': len(pairs)}
+
+
+def count_params(model):
+    return sum(p.numel() for p in model.parameters())
+
+
+def count_gflops(model, imgsz=640):
+    """Multiply-adds x 2 of every conv / linear layer for one imgsz x imgsz image (no thop needed)."""
+    model = copy.deepcopy(model).float().eval()
+    flops = []
+
+    def hook(module, inputs, output):
+        if isinstance(module, nn.Conv2d):
+            k = module.kernel_size[0] * module.kernel_size[1] * module.in_channels // module.groups
+            flops.append(2 * output.numel() * k)
+        else:
+            flops.append(2 * module.in_features * output.numel())
+
+    handles = [m.register_forward_hook(hook) for m in model.modules() if isinstance(m, (nn.Conv2d, nn.Linear))]
+    device = next(model.parameters()).device
+    with torch.no_grad():
+        model(torch.zeros(1, 3, imgsz, imgsz, device=device))
+    for h in handles:
+        h.remove()
+    return sum(flops) / 1e9
+
+
+def fine_tune(model, name, epochs=10, imgsz=640, batch=8):
+    """Train an already-built (pruned) DetectionModel in place of ultralytics' rebuild from its yaml."""
+    pruned = model.model
+
+    class PrunedTrainer(make_trainer(True, 0.1)):
+        def get_model(self, cfg=None, weights=None, verbose=True):
+            return pruned  # the yaml still describes the unpruned widths
+
+    model.train(
+        trainer=PrunedTrainer,
+        data='yolo_params.yaml',
+        epochs=epochs,
+        patience=epochs,
+        imgsz=imgsz,
+        batch=batch,
+        lr0=0.002,                     # recovery, not re-training
+        lrf=0.1,
+        warmup_epochs=1.0,
+        close_mosaic=max(1, epochs // 3),
+        device=default_device(),
+        workers=8,
+        cache=False,                   # shards instead (shard_cache.py)
+        amp=True,
+        project='runs/detect',
+        name=name,
+        exist_ok=True,
+        plots=False,
+        verbose=False
+    )
+    register_run(model.trainer.save_dir)
+    return Path(model.trainer.best)
+
+
+def measure(weights, imgsz=640, split='val'):
+    """Params, GFLOPs, CPU latency and mAP@50 of a checkpoint."""
+    model = YOLO(str(weights))
+    params, gflops = count_params(model.model), count_gflops(model.model, imgsz)
+    metrics = YOLO(str(weights)).val(validator=MemmapDetectionValidator, data='yolo_params.yaml', split=split,
+                                     imgsz=imgsz, batch=16, device=default_device(), plots=False, verbose=False)
+    latency = measure_latency(model, imgsz, device='cpu')
+    return {'params_m': round(params / 1e6, 3), 'gflops': round(gflops, 2), 'cpu_ms': round(latency, 1),
+            'map50': round(float(metrics.box.map50), 4), 'map50_95': round(float(metrics.box.map), 4)}
+
+
+def write_report(report, out_dir):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / 'report.json').write_text(json.dumps(report, indent=2))
+    base = report['levels'][0]
+    lines = [
+        "# Channel Pruning Report",
+        "",
+        f"Model: `{report['model']}`  ",
+        f"Importance: BN |gamma|, global threshold | Fine-tune: {report['epochs']} epochs | "
+        f"CPU latency: batch 1, {report['imgsz']}px",
+        "",
+        "| Sparsity | Params (M) | GFLOPs | CPU ms | Speed-up | mAP@50 | Change | Weights |",
+        "| ---: | ---: | ---: | ---: | ---: | ---: | ---: | :--- |",
+    ]
+    for r in report['levels']:
+        lines.append(f"| {r['sparsity']:.0%} | {r['params_m']:.2f} | {r['gflops']:.1f} | {r['cpu_ms']:.1f} | "
+                     f"{base['cpu_ms'] / r['cpu_ms']:.2f}x | {r['map50']:.4f} | "
+                     f"{(r['map50'] - base['map50']) * 100:+.2f}% | `{r['weights']}` |")
+    (out_dir / 'report.md').write_text("\n".join(lines) + "\n")
+
+
+def run_pruning(model_path='best', levels=DEFAULT_LEVELS, epochs=10, imgsz=640, batch=8, split='val'):
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+    model_path = resolve_model(model_path)
+    run_name = Path(model_path).parent.parent.name
+
+    print("="*70)
+    print("✂️ STRUCTURED CHANNEL PRUNING")
+    print("="*70)
+    print(f"Model:    {model_path}")
+    print(f"Levels:   {', '.join(f'{s:.0%}' for s in levels)} of prunable channels")
+    print(f"Finetune: {epochs} epochs per level")
+    print("="*70 + "\n")
+
+    print("📏 Baseline")
+    rows = [dict(measure(model_path, imgsz, split), sparsity=0.0, weights=str(model_path))]
+    for sparsity in levels:
+        start = time.perf_counter()
+        model = YOLO(model_path)  # fresh, unfused copy for every level
+        stats = prune_model(model.model, sparsity)
+        print(f"\n✂️ {sparsity:.0%}: kept {stats['kept_channels']}/{stats['prunable_channels']} channels in "
+              f"{stats['layers']} layers -> {count_params(model.model) / 1e6:.2f}M params, "
+              f"{count_gflops(model.model, imgsz):.1f} GFLOPs")
+        name = f"{run_name}_pruned{int(round(sparsity * 100))}"
+        if epochs > 0:
+            weights = fine_tune(model, name, epochs=epochs, imgsz=imgsz, batch=batch)
+        else:
+            weights = Path('runs/prune') / run_name / f"{name}.pt"
+            weights.parent.mkdir(parents=True, exist_ok=True)
+            torch.save({'model': model.model, 'train_args': {}}, weights)
+        rows.append(dict(measure(weights, imgsz, split), sparsity=sparsity, weights=str(weights),
+                         channels_kept=stats['kept_channels'] / stats['prunable_channels'],
+                         minutes=round((time.perf_counter() - start) / 60, 1)))
+
+    report = {'model': str(model_path), 'epochs': epochs, 'imgsz': imgsz, 'split': split, 'levels': rows}
+    out_dir = Path('runs/prune') / run_name
+    write_report(report, out_dir)
+
+    base = rows[0]
+    print("\n" + "="*70)
+    print(f"📊 PRUNING FRONTIER ({split} mAP@50, CPU batch 1)")
+    print("="*70)
+    print(f"{'Sparsity':>8} {'Params M':>9} {'GFLOPs':>7} {'CPU ms':>7} {'Speed-up':>9} {'mAP50':>7} {'Δ':>8}")
+    print("-"*70)
+    for r in rows:
+        print(f"{r['sparsity']:>8.0%} {r['params_m']:>9.2f} {r['gflops']:>7.1f} {r['cpu_ms']:>7.1f} "
+              f"{base['cpu_ms'] / r['cpu_ms']:>8.2f}x {r['map50']:>7.4f} {(r['map50'] - base['map50']) * 100:>+7.2f}%")
+    print(f"💾 Report: {out_dir / 'report.md'}")
+    print("="*70 + "\n")
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="BN-scale channel pruning with fine-tuning and a latency/mAP table")
+    parser.add_argument('--model', default='best', help="Weights path, run name or alias")
+    parser.add_argument('--levels', type=float, nargs='+', default=list(DEFAULT_LEVELS),
+                        help="Fractions of prunable channels to remove")
+    parser.add_argument('--epochs', type=int, default=10, help="Fine-tune epochs per level (0 = none)")
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--split', default='val', help="Split for mAP@50")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_pruning(args.model, levels=args.levels, epochs=args.epochs, imgsz=args.imgsz, batch=args.batch,
+                split=args.split)
@@ -0,0 +1,235 @@
+"""
+INT8 QUANTIZATION - Post-training quantization of the medium model for CPU
+
+Pipeline:
+  1. Export best.pt to FP32 ONNX (cached by backends.py).
+  2. Calibrate on a class-stratified sample of the train split from
+     yolo_params.yaml (rare classes get the same quota as common ones).
+  3. Static INT8 quantization with ONNX Runtime (QDQ, per-channel weights).
+     The Detect head stays FP32 by default: its class logits are where rare
+     classes collapse first when activations are squeezed into 8 bits.
+  4. Evaluate FP32 vs INT8 on val and test: mAP@50, per-class AP@50, CPU
+     latency and model size -> runs/quantize/<run>/report.md + report.json.
+
+Any class whose AP@50 drops by more than --max-class-drop is flagged in the
+report and makes the command exit non-zero, so a collapse is never silent.
+
+The INT8 model is stored next to the other exports and can be served with
+get_model(backend='onnx_int8') or `python inference_server.py --backend onnx_int8`.
+
+Usage:
+    python quantize.py
+    python quantize.py --calib-images 500 --calib-method Percentile --quantize-head
+"""
+
+from ultralytics import YOLO
+from onnxruntime.quantization import CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quantize_static
+from pathlib import Path
+import onnxruntime as ort
+import argparse
+import onnx
+import json
+import sys
+import time
+import numpy as np
+import cv2
+import os
+
+from backends import export_backend, export_dir, measure_latency, weights_hash, INT8_ARTIFACT
+from dataset_utils import load_data_config, stratified_sample
+from run_registry import register_run, resolve_model
+
+DEFAULT_MODEL = 'best'  # run_registry.py alias
+
+
+def letterbox(image, imgsz=640, color=114):
+    """Square letterbox like ultralytics LetterBox(auto=False), returns NCHW float32 RGB."""
+    h, w = image.shape[:2]
+    r = min(imgsz / h, imgsz / w)
+    nh, nw = round(h * r), round(w * r)
+    if (nh, nw) != (h, w):
+        image = cv2.resize(image, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    top, left = (imgsz - nh) // 2, (imgsz - nw) // 2
+    canvas = np.full((imgsz, imgsz, 3), color, dtype=np.uint8)
+    canvas[top:top + nh, left:left + nw] = image
+    return np.ascontiguousarray(canvas[..., ::-1].transpose(2, 0, 1))[None].astype(np.float32) / 255.0
+
+
+class CalibrationReader(CalibrationDataReader):
+    """Feeds letterboxed calibration images to onnxruntime one at a time."""
+
+    def __init__(self, paths, input_name, imgsz=640):
+        self.paths = iter(paths)
+        self.input_name = input_name
+        self.imgsz = imgsz
+
+    def get_next(self):
+        for path in self.paths:
+            image = cv2.imread(str(path))
+            if image is not None:
+                return {self.input_name: letterbox(image, self.imgsz)}
+        return None
+
+
+def head_node_names(onnx_path, model_path):
+    """ONNX nodes belonging to the Detect head (last module, e.g. /model.22/...)."""
+    head_index = len(YOLO(model_path).model.model) - 1
+    prefix = f"/model.{head_index}/"
+    graph = onnx.load(str(onnx_path)).graph
+    return [node.name for node in graph.node if node.name.startswith(prefix)]
+
+
+def quantize_model(model_path, calib_paths, imgsz=640, calib_method='MinMax', quantize_head=False):
+    fp32_path = export_backend(model_path, 'onnx', imgsz)
+    int8_path = export_dir(model_path) / INT8_ARTIFACT.format(stem=Path(model_path).stem, imgsz=imgsz)
+    input_name = ort.InferenceSession(str(fp32_path), providers=['CPUExecutionProvider']).get_inputs()[0].name
+    exclude = [] if quantize_head else head_node_names(fp32_path, model_path)
+
+    print(f"   🎯 Calibrating on {len(calib_paths)} images ({calib_method}), "
+          f"{'quantizing' if quantize_head else f'keeping {len(exclude)} head nodes in FP32'}")
+    start = time.perf_counter()
+    quantize_static(
+        str(fp32_path), str(int8_path),
+        CalibrationReader(calib_paths, input_name, imgsz),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        nodes_to_exclude=exclude,
+        calibrate_method=getattr(CalibrationMethod, calib_method),
+    )
+    print(f"   ✅ INT8 model written in {time.perf_counter() - start:.0f}s: {int8_path}")
+    return fp32_path, int8_path
+
+
+def evaluate_artifact(artifact, split, imgsz=640):
+    model = YOLO(str(artifact), task='detect')
+    metrics = model.val(data='yolo_params.yaml', split=split, imgsz=imgsz, batch=1,
+                        device='cpu', plots=False, verbose=False)
+    per_class = {int(c): float(ap) for c, ap in zip(metrics.box.ap_class_index, metrics.box.ap50)}
+    return {'map50': float(metrics.box.map50), 'map': float(metrics.box.map), 'per_class_ap50': per_class}
+
+
+def artifact_size_mb(path):
+    path = Path(path)
+    files = [path] if path.is_file() else [p for p in path.rglob('*') if p.is_file()]
+    return sum(p.stat().st_size for p in files) / 1e6
+
+
+def write_report(report, names, out_dir, max_class_drop):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / 'report.json').write_text(json.dumps(report, indent=2))
+
+    fp32, int8 = report['fp32'], report['int8']
+    lines = [
+        "# INT8 Quantization Report",
+        "",
+        f"Model: `{report['model']}`  ",
+        f"Calibration: {report['calibration']['images']} stratified train images, "
+        f"{report['calibration']['method']}, head {'INT8' if report['calibration']['quantize_head'] else 'FP32'}",
+        "",
+        "| | FP32 | INT8 | Change |",
+        "| :--- | ---: | ---: | ---: |",
+        f"| Size (MB) | {fp32['size_mb']:.1f} | {int8['size_mb']:.1f} | {int8['size_mb'] / fp32['size_mb']:.2f}x |",
+        f"| CPU latency (ms) | {fp32['latency_ms']:.1f} | {int8['latency_ms']:.1f} | "
+        f"{fp32['latency_ms'] / int8['latency_ms']:.2f}x faster |",
+    ]
+    for split in report['splits']:
+        a, b = fp32[split], int8[split]
+        lines.append(f"| {split} mAP@50 | {a['map50']:.4f} | {b['map50']:.4f} | {(b['map50'] - a['map50']) * 100:+.2f}% |")
+        lines.append(f"| {split} mAP@50-95 | {a['map']:.4f} | {b['map']:.4f} | {(b['map'] - a['map']) * 100:+.2f}% |")
+
+    for split in report['splits']:
+        lines += ["", f"## Per-class AP@50 ({split})", "", "| Class | FP32 | INT8 | Change | |", "| :--- | ---: | ---: | ---: | :---: |"]
+        for c, name in enumerate(names):
+            a = fp32[split]['per_class_ap50'].get(c)
+            b = int8[split]['per_class_ap50'].get(c)
+            if a is None or b is None:
+                continue
+            flag = "❌" if a - b > max_class_drop else "✅"
+            lines.append(f"| {name} | {a:.4f} | {b:.4f} | {(b - a) * 100:+.2f}% | {flag} |")
+
+    if report['collapsed']:
+        lines += ["", f"**⚠️ Classes dropping more than {max_class_drop * 100:.0f}% AP@50:** "
+                  + ", ".join(f"{c['class']} ({c['split']}, {c['drop'] * 100:.1f}%)" for c in report['collapsed'])]
+    (out_dir / 'report.md').write_text("\n".join(lines) + "\n")
+
+
+def run_quantization(model_path=DEFAULT_MODEL, calib_images=300, imgsz=640, calib_method='MinMax',
+                     quantize_head=False, splits=('val', 'test'), max_class_drop=0.05, seed=0):
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+    model_path = resolve_model(model_path)
+    data = load_data_config()
+    names = data['names']
+    run_name = Path(model_path).parent.parent.name
+
+    print("="*70)
+    print("🧮 INT8 POST-TRAINING QUANTIZATION")
+    print("="*70)
+    print(f"Model: {model_path}")
+    print("="*70 + "\n")
+
+    calib_paths = stratified_sample('train', n=calib_images, nc=len(names), seed=seed, data=data)
+    fp32_path, int8_path = quantize_model(model_path, calib_paths, imgsz, calib_method, quantize_head)
+    register_run(Path(model_path).parent.parent)  # index the INT8 export under its run
+
+    report = {
+        'model': model_path,
+        'weights_hash': weights_hash(model_path),
+        'calibration': {'images': len(calib_paths), 'method': calib_method, 'quantize_head': quantize_head},
+        'splits': list(splits),
+        'fp32': {'artifact': str(fp32_path), 'size_mb': artifact_size_mb(fp32_path)},
+        'int8': {'artifact': str(int8_path), 'size_mb': artifact_size_mb(int8_path)},
+        'collapsed': [],
+    }
+    for key, path in (('fp32', fp32_path), ('int8', int8_path)):
+        print(f"\n⏱️ Latency: {key}")
+        report[key]['latency_ms'] = measure_latency(YOLO(str(path), task='detect'), imgsz, device='cpu')
+        for split in splits:
+            print(f"🔬 Evaluating {key} on {split}")
+            report[key][split] = evaluate_artifact(path, split, imgsz)
+
+    for split in splits:
+        for c, a in report['fp32'][split]['per_class_ap50'].items():
+            b = report['int8'][split]['per_class_ap50'].get(c, 0.0)
+            if a - b > max_class_drop:
+                report['collapsed'].append({'class': names[c], 'split': split, 'drop': a - b})
+
+    out_dir = Path('runs/quantize') / run_name
+    write_report(report, names, out_dir, max_class_drop)
+
+    print("\n" + "="*70)
+    print("📊 FP32 vs INT8")
+    print("="*70)
+    print(f"Size:    {report['fp32']['size_mb']:.1f} MB -> {report['int8']['size_mb']:.1f} MB")
+    print(f"Latency: {report['fp32']['latency_ms']:.1f} ms -> {report['int8']['latency_ms']:.1f} ms")
+    for split in splits:
+        print(f"{split:<5} mAP@50: {report['fp32'][split]['map50']:.4f} -> {report['int8'][split]['map50']:.4f}")
+    if report['collapsed']:
+        print("-"*70)
+        for c in report['collapsed']:
+            print(f"❌ {c['class']} lost {c['drop'] * 100:.1f}% AP@50 on {c['split']}")
+    print(f"💾 Report: {out_dir / 'report.md'}")
+    print("="*70 + "\n")
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="INT8 post-training quantization with an accuracy/latency report")
+    parser.add_argument('--model', default=DEFAULT_MODEL, help="Weights path, run name or alias")
+    parser.add_argument('--calib-images', type=int, default=300)
+    parser.add_argument('--calib-method', default='MinMax', choices=['MinMax', 'Entropy', 'Percentile'])
+    parser.add_argument('--quantize-head', action='store_true', help="Also quantize the Detect head")
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--max-class-drop', type=float, default=0.05, help="Allowed per-class AP@50 loss")
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    report = run_quantization(model_path=args.model, calib_images=args.calib_images, imgsz=args.imgsz,
+                              calib_method=args.calib_method, quantize_head=args.quantize_head,
+                              max_class_drop=args.max_class_drop, seed=args.seed)
+    sys.exit(1 if report['collapsed'] else 0)
@@ -1,23 +1,50 @@
 """
 QUICK TTA VALIDATION - Find best mAP with optimized settings
+
+Modes:
+  sweep  (default) ONE TTA inference pass at the lowest confidence, caching the
+         pre-NMS candidates. NMS + mAP@50 / mAP@50-95 are then recomputed offline
+         for a dense conf x IoU grid (plus per-class optima) and the recommended
+         values are written to thresholds.json for test.py and app.py.
+  val    Original behaviour: one model.val(augment=True) per entry in configs.
+
+Usage:
+    python quick_tta_test.py
+    python quick_tta_test.py --mode val
 """
 
-from ultralytics import YOLO
+from pathlib import Path
+import argparse
+import time
+import numpy as np
 import os
 
+from backends import get_model
+from box_ops import box_iou, class_aware_iou, nms_from_iou
+from dataset_utils import load_data_config
+from evaluator import ap_per_class, load_ground_truth, match_predictions
+from prediction_cache import cached_predictions
+from run_registry import resolve_model
+from thresholds import save_thresholds, THRESHOLDS_FILE
+
+BEST_MODEL = 'best'  # run_registry.py alias
+
+CONF_GRID = np.array([0.001, 0.01, 0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4, 0.45, 0.5, 0.6, 0.7])
+IOU_GRID = np.array([0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7, 0.75])
+
 def quick_tta_validation():
     current_dir = os.path.dirname(os.path.abspath(__file__))
     os.chdir(current_dir)
     
     # Your best model
-    best_model = 'runs/detect/runs/detect/space_station_medium_final/weights/best.pt'
+    best_model = resolve_model(BEST_MODEL)
     
     print("="*70)
     print("⚡ QUICK TTA VALIDATION - OPTIMIZED FOR MAXIMUM mAP")
     print("="*70)
     print(f"Model: {best_model}\n")
     
-    model = YOLO(best_model)
+    model = get_model(best_model, backend='pytorch')  # TTA needs the PyTorch model
     
     # Test multiple confidence/IoU combinations to find best mAP
     configs = [
@@ -75,5 +102,150 @@ def quick_tta_validation():
     print("   Command: C:\\Users\\ZAH\\anaconda3\\envs\\EDU\\python.exe train_ultra_fast.py")
     print("="*70 + "\n")
 
+def sweep_image(boxes, scores, classes, gt_classes, gt_boxes, iou_grid, conf_grid, max_det=300):
+    """Stats for every (nms_iou, conf) grid cell of one image from its pre-NMS candidates.
+
+    Greedy NMS only looks at higher-scored boxes, so each IoU value needs one NMS
+    pass at the lowest conf; every conf cutoff is then just a prefix of the
+    surviving (score-sorted) boxes. Matching is redone per distinct prefix
+    because label assignment is IoU-ordered, not conf-ordered.
+    """
+    order = np.argsort(-scores, kind='stable')
+    boxes, scores, classes = boxes[order], scores[order], classes[order].astype(np.int32)
+    iou_pp = class_aware_iou(boxes, classes)
+    iou_gt = box_iou(gt_boxes, boxes)
+
+    cells = []
+    for t in iou_grid:
+        kept = np.flatnonzero(nms_from_iou(iou_pp, t))[:max_det]
+        lengths = (scores[kept][None, :] >= conf_grid[:, None]).sum(1)
+        memo = {}
+        row = []
+        for n in lengths:
+            if n not in memo:
+                idx = kept[:n]
+                tp = match_predictions(classes[idx], gt_classes, iou_gt[:, idx])
+                memo[n] = (tp, scores[idx], classes[idx], gt_classes)
+            row.append(memo[n])
+        cells.append(row)
+    return cells
+
+
+def threshold_sweep(split='val', imgsz=640, augment=True, conf_grid=CONF_GRID, iou_grid=IOU_GRID,
+                    candidate_conf=0.001, max_candidates=1000, refresh=False):
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+    names = load_data_config()['names']
+    model_path = resolve_model(BEST_MODEL)
+
+    print("="*70)
+    print("⚡ SINGLE-PASS THRESHOLD SWEEP")
+    print("="*70)
+    print(f"Model: {model_path}")
+    print(f"Grid:  {len(conf_grid)} conf x {len(iou_grid)} IoU values on '{split}' (TTA={augment})")
+    print("="*70 + "\n")
+
+    # 1. One inference pass: pre-NMS candidates (iou=1.0 suppresses nothing)
+    candidates = cached_predictions(model_path, split, imgsz=imgsz, augment=augment,
+                                    conf=candidate_conf, iou=1.0, max_det=max_candidates,
+                                    refresh=refresh)
+    ground_truth = load_ground_truth(candidates.files)
+
+    # 2. Offline NMS + matching for every grid cell
+    start = time.perf_counter()
+    grid_stats = [[[] for _ in conf_grid] for _ in iou_grid]
+    for i, (gt_classes, gt_boxes) in enumerate(ground_truth):
+        boxes, scores, classes = candidates[i]
+        cells = sweep_image(boxes, scores, classes, gt_classes, gt_boxes, iou_grid, conf_grid)
+        for a, row in enumerate(cells):
+            for b, stats in enumerate(row):
+                grid_stats[a][b].append(stats)
+
+    # 3. mAP per cell (rows: NMS IoU, cols: conf)
+    map50 = np.zeros((len(iou_grid), len(conf_grid)))
+    map5095 = np.zeros_like(map50)
+    class_ap50 = np.zeros((len(iou_grid), len(conf_grid), len(names)))
+    lowest_conf = {}
+    for a in range(len(iou_grid)):
+        for b in range(len(conf_grid)):
+            tp, conf, pred_cls, target_cls = (np.concatenate(s, 0) for s in zip(*grid_stats[a][b]))
+            r = ap_per_class(tp.astype(np.float64), conf, pred_cls, target_cls)
+            map50[a, b] = r['ap'][:, 0].mean() if len(r['ap']) else 0.0
+            map5095[a, b] = r['ap'].mean() if len(r['ap']) else 0.0
+            class_ap50[a, b, r['classes']] = r['ap'][:, 0]
+            if b == 0:
+                lowest_conf[a] = r
+        grid_stats[a] = None  # free memory as we go
+    print(f"   Re-scored {map50.size} threshold pairs in {time.perf_counter() - start:.1f}s")
+
+    # 4. Recommendations
+    a, b = np.unravel_index(np.lexsort((-map5095.ravel(), -map50.ravel()))[0], map50.shape)
+    map_conf, map_iou = float(conf_grid[b]), float(iou_grid[a])
+    operating = lowest_conf[a]
+    display_conf = round(operating['best_conf'], 3)
+
+    per_class = {}
+    for ci, c in enumerate(operating['classes']):
+        f1 = operating['f1_curve'][ci]
+        per_class[names[c]] = {
+            'conf': round(float(operating['x'][f1.argmax()]), 3),
+            'iou': float(iou_grid[class_ap50[:, 0, c].argmax()]),
+            'ap50': round(float(class_ap50[a, b, c]), 4),
+        }
+
+    out_dir = Path('runs/sweep')
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(out_dir / f'threshold_sweep_{split}.csv', 'w') as f:
+        f.write("iou,conf,map50,map50_95\n")
+        for a_, t in enumerate(iou_grid):
+            for b_, c in enumerate(conf_grid):
+                f.write(f"{t:g},{c:g},{map50[a_, b_]:.5f},{map5095[a_, b_]:.5f}\n")
+
+    save_thresholds({
+        'map': {'conf': map_conf, 'iou': map_iou},
+        'display': {'conf': display_conf, 'iou': map_iou},
+        'per_class': per_class,
+        'source': {'model': model_path, 'split': split, 'imgsz': imgsz, 'augment': augment},
+    })
+
+    # 5. Report
+    print("\n" + "="*70)
+    print("📊 mAP@0.5 BY NMS IoU (rows) x CONF (cols)")
+    print("="*70)
+    print("IoU   " + "".join(f"{c:>7g}" for c in conf_grid))
+    for a_, t in enumerate(iou_grid):
+        print(f"{t:<6g}" + "".join(f"{v:>7.3f}" for v in map50[a_]))
+
+    print("\n" + "="*70)
+    print("🏆 RECOMMENDED THRESHOLDS")
+    print("="*70)
+    print(f"Max mAP (test.py):     conf={map_conf:g}, iou={map_iou:g} "
+          f"-> mAP@0.5 {map50[a, b]:.4f}, mAP@0.5-0.95 {map5095[a, b]:.4f}")
+    print(f"Max F1 (app.py):       conf={display_conf:g}, iou={map_iou:g}")
+    print("-"*70)
+    print(f"{'Class':<22} {'conf':<8} {'iou':<8} {'AP@0.5'}")
+    for name, v in per_class.items():
+        print(f"{name:<22} {v['conf']:<8g} {v['iou']:<8g} {v['ap50']:.4f}")
+    print("="*70)
+    print(f"💾 Saved: {THRESHOLDS_FILE}, {out_dir / f'threshold_sweep_{split}.csv'}")
+    print("="*70 + "\n")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="TTA threshold search")
+    parser.add_argument('--mode', choices=['sweep', 'val'], default='sweep')
+    parser.add_argument('--split', default='val')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--no-tta', action='store_true')
+    parser.add_argument('--max-candidates', type=int, default=1000, help="Pre-NMS boxes kept per image")
+    parser.add_argument('--refresh', action='store_true', help="Ignore cached candidates")
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
-    quick_tta_validation()
+    args = parse_args()
+    if args.mode == 'val':
+        quick_tta_validation()
+    else:
+        threshold_sweep(split=args.split, imgsz=args.imgsz, augment=not args.no_tta,
+                        max_candidates=args.max_candidates, refresh=args.refresh)
@@ -0,0 +1,313 @@
+"""
+RUN REGISTRY - SQLite index of every run, checkpoint and artifact in runs/detect
+
+Entry points used to hard-code 'runs/detect/runs/detect/space_station_medium_final/
+weights/best.pt' with their own fallbacks, and val..val10 piled up unindexed.
+scan() walks runs/detect and records, per run directory, in runs/registry.sqlite:
+    runs        kind (train / val), weights path + sha256, best mAP@50 and
+                mAP@50-95 (and their epoch) from results.csv
+    artifacts   validation outputs (plots, predictions.json), reports and
+                exported models (weights/exports/...)
+    aliases     'best' (highest mAP@50), 'latest' (newest weights),
+                'latest-val' (newest validation folder), plus pinned aliases
+
+Scans are incremental: a run is re-read only when the stat signature of its
+folder, results.csv, best.pt or export folders changed, and weights are only
+re-hashed when best.pt changed. resolve_model() is a single indexed lookup
+(alias, then run name, then folder name) and never walks the tree; it only
+re-scans when the registry is missing or points at weights that are gone.
+
+Usage:
+    python run_registry.py                          # scan + list runs
+    python run_registry.py --resolve best
+    python run_registry.py --alias submission space_station_medium_final
+"""
+
+from contextlib import closing
+from pathlib import Path
+import argparse
+import sqlite3
+import json
+import time
+import os
+
+from backends import weights_hash
+from telemetry import CsvTail
+
+RUNS_ROOT = Path('runs/detect')
+REGISTRY_DB = Path('runs/registry.sqlite')
+PRETRAINED_FALLBACK = 'yolov8m.pt'
+
+# Files of a run folder worth indexing, by kind
+VAL_OUTPUTS = ('confusion_matrix.png', 'confusion_matrix_normalized.png', 'BoxPR_curve.png', 'BoxF1_curve.png',
+               'BoxP_curve.png', 'BoxR_curve.png', 'predictions.json')
+REPORTS = ('results.csv', 'results.png', 'args.yaml', 'epochs_to_target.json', 'labels.jpg')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    name TEXT PRIMARY KEY, short_name TEXT, dir TEXT, kind TEXT, signature TEXT,
+    weights TEXT, weights_sig TEXT, weights_hash TEXT, weights_mtime REAL,
+    best_map50 REAL, best_map REAL, best_epoch INTEGER, epochs INTEGER, updated REAL
+);
+CREATE INDEX IF NOT EXISTS runs_short_name ON runs(short_name);
+CREATE TABLE IF NOT EXISTS artifacts (run TEXT, kind TEXT, path TEXT, PRIMARY KEY (run, path));
+CREATE TABLE IF NOT EXISTS aliases (alias TEXT PRIMARY KEY, run TEXT, path TEXT, pinned INTEGER DEFAULT 0);
+"""
+
+
+def _connect(db=REGISTRY_DB):
+    db = Path(db)
+    db.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db, timeout=30)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _ensure(db):
+    """First use on this machine: build the registry before reading it."""
+    if not Path(db).exists():
+        scan(db=db)
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+        return [st.st_mtime_ns, st.st_size]
+    except OSError:
+        return None
+
+
+def _signature(run_dir):
+    exports = run_dir / 'weights' / 'exports'
+    parts = [_stat(run_dir), _stat(run_dir / 'results.csv'), _stat(run_dir / 'weights' / 'best.pt')]
+    if exports.is_dir():
+        parts += [[d.name, _stat(d)] for d in sorted(exports.iterdir()) if d.is_dir()]
+    return json.dumps(parts)
+
+
+def _run_kind(run_dir):
+    if (run_dir / 'weights' / 'best.pt').exists() or (run_dir / 'results.csv').exists():
+        return 'train'
+    if any((run_dir / f).exists() for f in VAL_OUTPUTS):
+        return 'val'
+    return None
+
+
+def best_metrics(csv_path):
+    """(best mAP@50, mAP@50-95 at that epoch, epoch, epochs) from a results.csv."""
+    tail = CsvTail(csv_path)
+    tail.poll()
+    if not tail.rows or 'metrics/mAP50(B)' not in tail.columns:
+        return None, None, None, len(tail.rows)
+    i50, i95, iep = (tail.columns.index(c) for c in ('metrics/mAP50(B)', 'metrics/mAP50-95(B)', 'epoch'))
+    best = max(tail.rows, key=lambda r: r[i50])
+    return best[i50], best[i95], int(best[iep]), len(tail.rows)
+
+
+def _artifacts(run_dir):
+    found = []
+    for name in VAL_OUTPUTS:
+        if (run_dir / name).exists():
+            found.append(('val', run_dir / name))
+    for name in REPORTS:
+        if (run_dir / name).exists():
+            found.append(('report', run_dir / name))
+    weights = run_dir / 'weights'
+    if weights.is_dir():
+        found += [('weights', p) for p in sorted(weights.glob('*.pt'))]
+        # weights/exports/<stem>/<hash>/<artifact> (backends.py, quantize.py)
+        found += [('export', p) for p in sorted(weights.glob('exports/*/*/*'))]
+    return found
+
+
+def register_run(run_dir, conn=None, root=RUNS_ROOT, force=False):
+    """Index (or re-index) one run folder. Returns True when the row changed."""
+    if conn is None:
+        with closing(_connect()) as conn:
+            changed = register_run(run_dir, conn, root, force)
+            if changed:
+                _refresh_aliases(conn)
+            conn.commit()
+            return changed
+    run_dir = Path(run_dir)
+    kind = _run_kind(run_dir)
+    if kind is None:
+        return False
+    try:
+        name = run_dir.resolve().relative_to(Path(root).resolve()).as_posix()
+    except ValueError:
+        return False  # not a run under root (e.g. hub weights next to the scripts)
+    signature = _signature(run_dir)
+    old = conn.execute("SELECT signature, weights_sig, weights_hash FROM runs WHERE name = ?", (name,)).fetchone()
+    if old is not None and old[0] == signature and not force:
+        return False
+
+    best_pt = run_dir / 'weights' / 'best.pt'
+    weights = weights_sig = digest = weights_mtime = None
+    if best_pt.exists():
+        weights, weights_sig = best_pt.as_posix(), json.dumps(_stat(best_pt))
+        digest = old[2] if old is not None and old[1] == weights_sig else weights_hash(best_pt)
+        weights_mtime = best_pt.stat().st_mtime
+    map50, map95, best_epoch, epochs = best_metrics(run_dir / 'results.csv') \
+        if (run_dir / 'results.csv').exists() else (None, None, None, 0)
+
+    conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                 (name, run_dir.name, run_dir.as_posix(), kind, signature, weights, weights_sig, digest,
+                  weights_mtime, map50, map95, best_epoch, epochs, run_dir.stat().st_mtime))
+    conn.execute("DELETE FROM artifacts WHERE run = ?", (name,))
+    conn.executemany("INSERT INTO artifacts VALUES (?, ?, ?)",
+                     [(name, kind_, p.as_posix()) for kind_, p in _artifacts(run_dir)])
+    return True
+
+
+def _refresh_aliases(conn):
+    """Recompute the derived aliases; pinned aliases are left alone."""
+    derived = {
+        'best': "SELECT name, weights FROM runs WHERE weights IS NOT NULL "
+                "ORDER BY best_map50 IS NULL, best_map50 DESC, weights_mtime DESC LIMIT 1",
+        'latest': "SELECT name, weights FROM runs WHERE weights IS NOT NULL ORDER BY weights_mtime DESC LIMIT 1",
+        'latest-val': "SELECT name, dir FROM runs WHERE kind = 'val' "
+                      "ORDER BY updated DESC, length(name) DESC, name DESC LIMIT 1",  # val10 after val9
+    }
+    for alias, query in derived.items():
+        row = conn.execute(query).fetchone()
+        if conn.execute("SELECT pinned FROM aliases WHERE alias = ?", (alias,)).fetchone() == (1,):
+            continue
+        if row is None:
+            conn.execute("DELETE FROM aliases WHERE alias = ?", (alias,))
+        else:
+            conn.execute("INSERT OR REPLACE INTO aliases VALUES (?, ?, ?, 0)", (alias, row[0], row[1]))
+
+
+def scan(root=RUNS_ROOT, db=REGISTRY_DB, verbose=False):
+    """Incrementally index every run folder under root. Returns the number of (re)indexed runs."""
+    root = Path(root)
+    start = time.perf_counter()
+    seen, changed = set(), 0
+    with closing(_connect(db)) as conn:
+        for dirpath, dirnames, _ in os.walk(root):
+            run_dir = Path(dirpath)
+            dirnames[:] = [d for d in dirnames if d != 'weights']  # exports are read per run
+            if _run_kind(run_dir) is None:
+                continue
+            seen.add(run_dir.resolve().relative_to(root.resolve()).as_posix())
+            changed += register_run(run_dir, conn, root)
+        stale = [r for (r,) in conn.execute("SELECT name FROM runs") if r not in seen]
+        conn.executemany("DELETE FROM runs WHERE name = ?", [(r,) for r in stale])
+        conn.executemany("DELETE FROM artifacts WHERE run = ?", [(r,) for r in stale])
+        _refresh_aliases(conn)
+        conn.commit()
+    if verbose:
+        print(f"   🗂️ Registry: {len(seen)} runs, {changed} re-indexed, {len(stale)} removed "
+              f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return changed
+
+
+def _lookup(conn, ref):
+    row = conn.execute("SELECT path FROM aliases WHERE alias = ?", (ref,)).fetchone()
+    if row is None:
+        row = conn.execute("SELECT weights FROM runs WHERE name = ? OR short_name = ? "
+                           "ORDER BY name = ? DESC, updated DESC LIMIT 1", (ref, ref, ref)).fetchone()
+    return row[0] if row is not None and row[0] else None
+
+
+def resolve_model(ref='best', db=REGISTRY_DB):
+    """Weights path for an alias ('best', 'latest', pinned), a run name or a plain path.
+
+    Aliases and runs without weights (validation folders, 'latest-val') raise
+    FileNotFoundError; their files are looked up with run_artifacts().
+    """
+    ref = str(ref or 'best')
+    if os.path.isfile(ref):
+        return ref
+    fresh = not Path(db).exists()
+    _ensure(db)
+    with closing(_connect(db)) as conn:
+        path = _lookup(conn, ref)
+    if (path is None or not os.path.exists(path)) and not fresh:
+        scan(db=db)  # registry is stale: weights moved, deleted or trained since the last scan
+        with closing(_connect(db)) as conn:
+            path = _lookup(conn, ref)
+    if path is not None and os.path.isfile(path):
+        return path
+    if path is not None and os.path.isdir(path):
+        raise FileNotFoundError(f"'{ref}' is the run folder {path}, not weights (use run_artifacts('{ref}'))")
+    if Path(ref).suffix:
+        return ref  # e.g. 'yolov8m.pt': ultralytics downloads hub weights by name
+    raise FileNotFoundError(f"No run or alias '{ref}' in {db} (run: python run_registry.py)")
+
+
+def run_artifacts(ref='latest-val', kind=None, db=REGISTRY_DB):
+    """{file name: path} of the artifacts of one run (alias or name)."""
+    _ensure(db)
+    with closing(_connect(db)) as conn:
+        row = conn.execute("SELECT run FROM aliases WHERE alias = ?", (ref,)).fetchone()
+        if row is None:
+            row = conn.execute("SELECT name FROM runs WHERE name = ? OR short_name = ? "
+                               "ORDER BY updated DESC LIMIT 1", (ref, ref)).fetchone()
+        if row is None:
+            return {}
+        rows = conn.execute("SELECT kind, path FROM artifacts WHERE run = ?", (row[0],)).fetchall()
+    return {Path(p).name: p for k, p in rows if kind is None or k == kind}
+
+
+def list_runs(kind=None, with_weights=False, db=REGISTRY_DB):
+    """Registry rows as dicts, best mAP@50 first."""
+    _ensure(db)
+    with closing(_connect(db)) as conn:
+        conn.row_factory = sqlite3.Row
+        query = "SELECT * FROM runs WHERE 1 = 1"
+        params = []
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        if with_weights:
+            query += " AND weights IS NOT NULL"
+        query += " ORDER BY best_map50 IS NULL, best_map50 DESC, updated DESC"
+        return [dict(r) for r in conn.execute(query, params)]
+
+
+def set_alias(alias, ref, db=REGISTRY_DB):
+    """Pin an alias to a run (by name) so scans no longer move it."""
+    _ensure(db)
+    with closing(_connect(db)) as conn:
+        row = conn.execute("SELECT name, COALESCE(weights, dir) FROM runs WHERE name = ? OR short_name = ? "
+                           "ORDER BY updated DESC LIMIT 1", (ref, ref)).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown run '{ref}'")
+        conn.execute("INSERT OR REPLACE INTO aliases VALUES (?, ?, ?, 1)", (alias, row[0], row[1]))
+        conn.commit()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Index runs/detect and resolve model aliases")
+    parser.add_argument('--resolve', default=None, metavar='REF', help="Print the weights path of REF and exit")
+    parser.add_argument('--alias', nargs=2, default=None, metavar=('ALIAS', 'RUN'), help="Pin ALIAS to RUN")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+    args = parse_args()
+    if args.resolve:
+        print(resolve_model(args.resolve))
+    else:
+        print("="*70)
+        print("🗂️ RUN REGISTRY")
+        print("="*70)
+        scan(verbose=True)
+        if args.alias:
+            set_alias(*args.alias)
+        print("-"*70)
+        print(f"{'Run':<48} {'Kind':<6} {'mAP@50':<8} {'mAP@50-95':<10} {'Epochs'}")
+        print("-"*70)
+        for r in list_runs():
+            map50 = f"{r['best_map50']:.4f}" if r['best_map50'] is not None else '-'
+            map95 = f"{r['best_map']:.4f}" if r['best_map'] is not None else '-'
+            print(f"{r['name']:<48} {r['kind']:<6} {map50:<8} {map95:<10} {r['epochs'] or '-'}")
+        print("-"*70)
+        with closing(_connect()) as conn:
+            for alias, run, pinned in conn.execute("SELECT alias, run, pinned FROM aliases ORDER BY alias"):
+                print(f"   {alias:<14} -> {run}{' (pinned)' if pinned else ''}")
+        print("="*70 + "\n")
@@ -4,74 +4,116 @@ Run this AFTER training completes to get maximum mAP scores
 
 TTA applies augmentations during inference and averages the results,
 which typically boosts mAP by 1-3 percentage points.
+
+--tta selective augments only the images selective_tta.py flags as ambiguous
+and scores them with evaluator.py; full TTA stays the default reference.
+
+STAGE_TIMING=1 also writes the per-image preprocess / forward / NMS split of
+both passes to runs/timing/val_tta.json (stage_timing.py).
+
+Usage:
+    python run_validation_with_tta.py                  # full TTA vs normal
+    python run_validation_with_tta.py --tta selective  # selective TTA vs normal
 """
 
-from ultralytics import YOLO
+import argparse
 import os
 
-def run_validation_with_tta():
+from backends import get_model
+from evaluator import evaluate
+from run_registry import register_run, resolve_model
+from selective_tta import selective_predictions
+from shard_cache import MemmapDetectionValidator
+from stage_timing import dump_json, print_summary, record_speed
+
+def box_scores(metrics):
+    """Headline numbers of a model.val() result."""
+    box = metrics.box
+    return {'map50': box.map50, 'map': box.map, 'p': box.mp, 'r': box.mr}
+
+def run_validation_with_tta(tta='full'):
     current_dir = os.path.dirname(os.path.abspath(__file__))
     os.chdir(current_dir)
     
-    # Use the best checkpoint from enhanced training
-    best_model = 'runs/detect/space_station_ENHANCED_v2/weights/best.pt'
-    
-    # Fallback to original if new training hasn't completed
-    if not os.path.exists(best_model):
-        best_model = 'runs/detect/runs/detect/space_station_medium_final/weights/best.pt'
-        print(f"⚠️ Enhanced model not found, using original: {best_model}")
+    # Best checkpoint in the run registry: the enhanced run once it beats the original
+    best_model = resolve_model('best')
     
     print(f"\n✅ Loading model: {best_model}\n")
-    model = YOLO(best_model)
+    model = get_model(best_model, backend='pytorch')  # TTA needs the PyTorch model
     
     # Run validation WITH Test-Time Augmentation
     print("="*70)
-    print("🔬 Running Validation WITH Test-Time Augmentation (TTA)")
+    print(f"🔬 Running Validation WITH {'Selective ' if tta == 'selective' else ''}Test-Time Augmentation (TTA)")
     print("="*70 + "\n")
     
-    results_tta = model.val(
-        data='yolo_params.yaml',
-        augment=True,              # ✅ ENABLE TTA
-        conf=0.20,                 # Lower confidence for better recall
-        iou=0.45,                  # Lower IoU for NMS
-        max_det=300,
-        plots=True,
-        save_json=True,            # Save results in COCO format
-        verbose=True
-    )
+    if tta == 'selective':
+        # Augmented pass only on images selective_tta.py flags as ambiguous, fused into the plain pass
+        preds = selective_predictions(best_model, 'val', iou=0.45)
+        result = evaluate(preds, conf=0.20)
+        scores_tta = {'map50': result['map50'], 'map': result['map'], 'p': result['mp'], 'r': result['mr']}
+        print(f"🎯 TTA ran on {preds.meta['n_triggered']}/{len(preds)} images")
+    else:
+        results_tta = model.val(
+            validator=MemmapDetectionValidator,  # Reads the val shard when shard_cache.py has built it
+            data='yolo_params.yaml',
+            augment=True,              # ✅ ENABLE TTA
+            conf=0.20,                 # Lower confidence for better recall
+            iou=0.45,                  # Lower IoU for NMS
+            max_det=300,
+            plots=True,
+            save_json=True,            # Save results in COCO format
+            verbose=True
+        )
+        register_run(results_tta.save_dir)
+        record_speed(results_tta.speed, prefix='val_tta/')
+        scores_tta = box_scores(results_tta)
     
     print("\n" + "="*70)
     print("📊 VALIDATION RESULTS WITH TTA:")
     print("="*70)
-    print(f"mAP@0.5:       {results_tta.box.map50:.4f}")
-    print(f"mAP@0.5-0.95:  {results_tta.box.map:.4f}")
-    print(f"Precision:     {results_tta.box.p:.4f}")
-    print(f"Recall:        {results_tta.box.r:.4f}")
+    print(f"mAP@0.5:       {scores_tta['map50']:.4f}")
+    print(f"mAP@0.5-0.95:  {scores_tta['map']:.4f}")
+    print(f"Precision:     {scores_tta['p']:.4f}")
+    print(f"Recall:        {scores_tta['r']:.4f}")
     print("="*70 + "\n")
     
     # Compare with regular validation
     print("🔬 Running Validation WITHOUT TTA (for comparison)")
     results_normal = model.val(
+        validator=MemmapDetectionValidator,
         data='yolo_params.yaml',
         augment=False,             # No TTA
         conf=0.25,
         iou=0.45,
         max_det=300
     )
+    register_run(results_normal.save_dir)
+    record_speed(results_normal.speed, prefix='val/')
+    scores_normal = box_scores(results_normal)
     
     print("\n" + "="*70)
     print("📊 COMPARISON: TTA vs Normal Validation")
     print("="*70)
-    print(f"              | Normal   | TTA      | Improvement")
+    print(f"              | Normal   | TTA      | Improvement ({tta} TTA)")
     print("-"*70)
-    print(f"mAP@0.5       | {results_normal.box.map50:.4f}   | {results_tta.box.map50:.4f}   | {(results_tta.box.map50 - results_normal.box.map50)*100:+.2f}%")
-    print(f"mAP@0.5-0.95  | {results_normal.box.map:.4f}   | {results_tta.box.map:.4f}   | {(results_tta.box.map - results_normal.box.map)*100:+.2f}%")
-    print(f"Precision     | {results_normal.box.p:.4f}   | {results_tta.box.p:.4f}   | {(results_tta.box.p - results_normal.box.p)*100:+.2f}%")
-    print(f"Recall        | {results_normal.box.r:.4f}   | {results_tta.box.r:.4f}   | {(results_tta.box.r - results_normal.box.r)*100:+.2f}%")
+    for label, key in (('mAP@0.5', 'map50'), ('mAP@0.5-0.95', 'map'), ('Precision', 'p'), ('Recall', 'r')):
+        print(f"{label:<14}| {scores_normal[key]:.4f}   | {scores_tta[key]:.4f}   | {(scores_tta[key] - scores_normal[key])*100:+.2f}%")
     print("="*70 + "\n")
     
+    timing_file = dump_json('val_tta')
+    if timing_file:
+        print_summary()
+        print(f"⏱️ Stage timing saved to {timing_file}\n")
+
     print("💾 Results saved in validation runs folder")
     print("✅ Use TTA results for your hackathon submission!\n")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Validation with vs without test-time augmentation")
+    parser.add_argument('--tta', choices=['full', 'selective'], default='full',
+                        help="full: augment every image (reference), selective: only ambiguous ones (selective_tta.py)")
+    return parser.parse_args()
+
 if __name__ == '__main__':
-    run_validation_with_tta()
+    args = parse_args()
+    run_validation_with_tta(tta=args.tta)
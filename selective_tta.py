@@ -0,0 +1,177 @@
+"""
+SELECTIVE TTA - Run test-time augmentation only where it can change the answer
+
+augment=True costs roughly 3 forward passes per image, on every image. Most
+images are easy: every detection is either clearly there or clearly noise.
+Here the plain pass runs first (and is reused from the prediction cache), and
+only images showing an uncertainty signal get the augmented pass:
+  - ambiguous: a detection with confidence inside --band (default 0.25-0.6)
+  - disagreement: two confident boxes of DIFFERENT classes on the same object
+    (IoU > --conflict-iou), i.e. the model cannot decide what it is looking at
+
+The augmented detections of a triggered image are fused into its plain ones
+(union + class-aware NMS, which keeps scores on the same scale as untriggered
+images, or WBF). The result is cached like any other prediction set, so
+ensemble_boost.py --selective-tta and evaluator.py can use it directly.
+
+Usage:
+    python selective_tta.py                      # val: plain vs selective vs full TTA
+    python selective_tta.py --band 0.2 0.7 --no-full
+"""
+
+from pathlib import Path
+import argparse
+import time
+import numpy as np
+import os
+
+from backends import get_model, weights_hash
+from box_ops import box_iou, nms, weighted_boxes_fusion
+from evaluator import evaluate, load_ground_truth
+from predict import prefetch_images, batched
+from prediction_cache import PredictionSet, cache_path, cached_predictions
+from run_registry import resolve_model
+
+BEST_MODEL = 'best'  # run_registry.py alias
+
+
+def tta_trigger(boxes, scores, classes, band=(0.25, 0.6), conflict_iou=0.6):
+    """Reason an image needs TTA ('ambiguous', 'disagreement') or None."""
+    lo, hi = band
+    if np.any((scores >= lo) & (scores < hi)):
+        return 'ambiguous'
+    confident = scores >= lo
+    if confident.sum() > 1:
+        b, c = boxes[confident], classes[confident]
+        iou = box_iou(b, b)
+        if np.any((iou > conflict_iou) & (c[:, None] != c[None, :])):
+            return 'disagreement'
+    return None
+
+
+def fuse_tta(base, augmented, method='nms', iou=0.7, max_det=300):
+    """Merge the augmented detections of one image into its plain detections."""
+    boxes = np.concatenate([base[0], augmented[0]])
+    scores = np.concatenate([base[1], augmented[1]])
+    classes = np.concatenate([base[2], augmented[2]]).astype(np.int32)
+    if method == 'wbf':
+        return weighted_boxes_fusion([base[0], augmented[0]], [base[1], augmented[1]],
+                                     [base[2], augmented[2]], iou_thr=0.55, max_det=max_det)
+    keep = nms(boxes, scores, classes, iou_thr=iou, max_det=max_det)
+    return boxes[keep], scores[keep], classes[keep]
+
+
+def selective_predictions(model_path, split, imgsz=640, conf=0.001, iou=0.7, max_det=300, batch=16,
+                          band=(0.25, 0.6), conflict_iou=0.6, fuse='nms', device=None, refresh=False):
+    """Cached plain pass + TTA on triggered images only. Returns a PredictionSet."""
+    digest = weights_hash(model_path)
+    path = cache_path(digest, split, imgsz, 'selective', conf, iou)
+    path = path.with_name(path.stem + f"_b{band[0]:g}-{band[1]:g}_{fuse}.npz")
+    if path.exists() and not refresh:
+        print(f"   💾 Cache hit: {path}")
+        return PredictionSet.load(path)
+
+    plain = cached_predictions(model_path, split, imgsz=imgsz, augment=False, conf=conf, iou=iou,
+                               max_det=max_det, batch=batch, device=device, refresh=refresh)
+    triggers = {}
+    for i in range(len(plain)):
+        reason = tta_trigger(*plain[i], band=band, conflict_iou=conflict_iou)
+        if reason:
+            triggers[i] = reason
+    print(f"   🎯 TTA triggered on {len(triggers)}/{len(plain)} images "
+          f"({sum(r == 'ambiguous' for r in triggers.values())} ambiguous, "
+          f"{sum(r == 'disagreement' for r in triggers.values())} disagreement)")
+
+    model = get_model(model_path, backend='pytorch')  # TTA needs the PyTorch model
+    detections = [plain[i] for i in range(len(plain))]
+    start = time.perf_counter()
+    todo = sorted(triggers)
+    frames = prefetch_images([Path(plain.files[i]) for i in todo], prefetch=4 * batch)
+    for chunk_ids, chunk in zip(batched(todo, batch), batched(frames, batch)):
+        ok = [(i, im) for i, (_, im) in zip(chunk_ids, chunk) if im is not None]
+        if not ok:
+            continue
+        results = model.predict([im for _, im in ok], imgsz=imgsz, conf=conf, iou=iou, max_det=max_det,
+                                augment=True, device=device, verbose=False)
+        for (i, _), r in zip(ok, results):
+            augmented = (r.boxes.xyxyn.cpu().numpy(), r.boxes.conf.cpu().numpy(), r.boxes.cls.cpu().numpy())
+            detections[i] = fuse_tta(detections[i], augmented, fuse, iou, max_det)
+    tta_seconds = time.perf_counter() - start
+
+    meta = dict(plain.meta, augment='selective', band=list(band), conflict_iou=conflict_iou, fuse=fuse,
+                weights_hash=digest, n_triggered=len(triggers), tta_seconds=tta_seconds,
+                triggers={plain.files[i]: r for i, r in triggers.items()})
+    preds = PredictionSet.from_images(plain.files, detections, plain.shapes, meta)
+    preds.save(path)
+    return preds
+
+
+def run_selective_tta(model_path=BEST_MODEL, split='val', imgsz=640, band=(0.25, 0.6), conflict_iou=0.6,
+                      fuse='nms', compare_full=True, refresh=False):
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+    model_path = resolve_model(model_path)
+
+    print("="*70)
+    print("🎯 SELECTIVE TEST-TIME AUGMENTATION")
+    print("="*70)
+    print(f"Model: {model_path}")
+    print(f"Band:  {band[0]:g}-{band[1]:g} | Conflict IoU: {conflict_iou:g} | Fuse: {fuse}")
+    print("="*70 + "\n")
+
+    print("🔬 Plain predictions")
+    plain = cached_predictions(model_path, split, imgsz=imgsz, augment=False, refresh=refresh)
+    print("🔬 Selective TTA predictions")
+    selective = selective_predictions(model_path, split, imgsz=imgsz, band=band, conflict_iou=conflict_iou,
+                                      fuse=fuse, refresh=refresh)
+    runs = [('Plain', plain), ('Selective TTA', selective)]
+    if compare_full:
+        print("🔬 Full TTA predictions")
+        runs.append(('Full TTA', cached_predictions(model_path, split, imgsz=imgsz, augment=True, refresh=refresh)))
+
+    ground_truth = load_ground_truth(plain.files)
+    scores = {name: evaluate(p, ground_truth if p.files == plain.files else None) for name, p in runs}
+    n_triggered = selective.meta['n_triggered']
+
+    print("\n" + "="*70)
+    print("📊 PLAIN vs SELECTIVE vs FULL TTA")
+    print("="*70)
+    print(f"{'Mode':<16} {'TTA images':<14} {'mAP@0.5':<10} {'mAP@0.5-0.95':<14} {'Recall'}")
+    print("-"*70)
+    tta_images = {'Plain': 0, 'Selective TTA': n_triggered, 'Full TTA': len(plain)}
+    for name, _ in runs:
+        m = scores[name]
+        print(f"{name:<16} {tta_images[name]:<14} {m['map50']:<10.4f} {m['map']:<14.4f} {m['mr']:.4f}")
+    print("-"*70)
+    print(f"TTA ran on {n_triggered}/{len(plain)} images ({n_triggered / max(len(plain), 1) * 100:.1f}%) "
+          f"in {selective.meta['tta_seconds']:.0f}s")
+    if compare_full:
+        gain_full = scores['Full TTA']['map50'] - scores['Plain']['map50']
+        gain_sel = scores['Selective TTA']['map50'] - scores['Plain']['map50']
+        kept = gain_sel / gain_full * 100 if gain_full > 0 else float('nan')
+        print(f"mAP@0.5 gain: selective {gain_sel * 100:+.2f}% vs full {gain_full * 100:+.2f}% "
+              f"({kept:.0f}% of the TTA gain)")
+    print("="*70 + "\n")
+    return scores
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Confidence-gated selective TTA")
+    parser.add_argument('--model', default=BEST_MODEL, help="Weights path, run name or alias")
+    parser.add_argument('--split', default='val')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--band', type=float, nargs=2, default=[0.25, 0.6], metavar=('LO', 'HI'),
+                        help="Confidence band that counts as ambiguous")
+    parser.add_argument('--conflict-iou', type=float, default=0.6,
+                        help="IoU above which two confident boxes of different classes disagree")
+    parser.add_argument('--fuse', choices=['nms', 'wbf'], default='nms')
+    parser.add_argument('--no-full', action='store_true', help="Skip the full-TTA comparison")
+    parser.add_argument('--refresh', action='store_true', help="Ignore cached predictions")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_selective_tta(model_path=args.model, split=args.split, imgsz=args.imgsz, band=tuple(args.band),
+                      conflict_iou=args.conflict_iou, fuse=args.fuse, compare_full=not args.no_full,
+                      refresh=args.refresh)
@@ -0,0 +1,326 @@
+"""
+SHARD CACHE - Decode + resize every split ONCE into a memory-mapped shard
+
+cache='ram' decodes the whole train split into every process on every run,
+cache=False decodes every image every epoch. Instead, each split from
+yolo_params.yaml is written once to runs/cache/shards/<split>_<imgsz>/:
+    images.u8    all images back to back, uint8 BGR, resized exactly like
+                 ultralytics load_image() (long side = imgsz, aspect kept;
+                 padding is added per batch by the pipeline)
+    index.npz    files, mtimes, sizes, offsets (n+1), shapes (h, w, 3), orig_shapes
+    labels.npz   packed labels: offsets (n+1), classes int16, boxes float32
+                 normalized xywh, plus the label file mtimes
+
+Readers open images.u8 with np.memmap in copy-on-write mode: reads are
+zero-copy out of the shared OS page cache (8 dataloader workers share one copy),
+and in-place augmentations write to private pages, never to the file.
+
+Rebuilds are incremental: unchanged images (same path, mtime and size) are
+copied over from the previous shard, only new or modified files are decoded.
+
+MemmapDetectionTrainer / MemmapDetectionValidator plug the shards into
+model.train(trainer=...) and model.val(validator=...); images without a
+shard entry (or a different imgsz) fall back to the normal decode path.
+
+Usage:
+    python shard_cache.py                      # build/refresh train, val, test at 640
+    python shard_cache.py --splits val --imgsz 640
+"""
+
+from pathlib import Path
+import argparse
+import math
+import json
+import time
+import numpy as np
+import cv2
+import os
+
+from ultralytics.data import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer, DetectionValidator
+from ultralytics.utils import colorstr
+try:
+    from ultralytics.utils.torch_utils import unwrap_model
+except ImportError:  # older ultralytics
+    from ultralytics.utils.torch_utils import de_parallel as unwrap_model
+
+from dataset_utils import img2label_path, load_data_config, read_labels, split_image_paths
+from predict import prefetch_images
+
+SHARD_DIR = Path('runs/cache/shards')
+
+
+def path_key(path):
+    """Normalized absolute path: the key shards and distill.py targets are looked up by."""
+    return os.path.normcase(os.path.abspath(str(path)))
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return 0, -1
+
+
+def resize_like_ultralytics(image, imgsz):
+    """Long side to imgsz, aspect kept (BaseDataset.load_image with rect_mode=True)."""
+    h0, w0 = image.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz)
+        image = cv2.resize(image, (w, h), interpolation=cv2.INTER_LINEAR)
+    return image
+
+
+class ShardCache:
+    """Read side of one shard: zero-copy images, packed labels, original shapes."""
+
+    def __init__(self, shard_dir):
+        self.dir = Path(shard_dir)
+        with np.load(self.dir / 'index.npz') as z:
+            self.files = z['files'].tolist()
+            self.offsets = z['offsets']
+            self.shapes = z['shapes']
+            self.orig_shapes = z['orig_shapes']
+            self.mtimes = z['mtimes']
+            self.sizes = z['sizes']
+            self.meta = json.loads(str(z['meta']))
+        with np.load(self.dir / 'labels.npz') as z:
+            self.label_offsets = z['offsets']
+            self.classes = z['classes']
+            self.boxes = z['boxes']
+            self.label_mtimes = z['label_mtimes']
+        self.lookup = {path_key(f): i for i, f in enumerate(self.files)}
+        self._images = None
+
+    @classmethod
+    def open(cls, split, imgsz=640, root=SHARD_DIR):
+        shard_dir = Path(root) / f"{split}_{imgsz}"
+        return cls(shard_dir) if (shard_dir / 'index.npz').exists() else None
+
+    @property
+    def imgsz(self):
+        return self.meta['imgsz']
+
+    @property
+    def images(self):
+        # Opened lazily so the memmap is never pickled into dataloader workers
+        if self._images is None:
+            size = int(self.offsets[-1])
+            self._images = np.memmap(self.dir / 'images.u8', dtype=np.uint8, mode='c', shape=(size,)) \
+                if size else np.zeros(0, dtype=np.uint8)
+        return self._images
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_images'] = None
+        return state
+
+    def __len__(self):
+        return len(self.files)
+
+    def index_of(self, path):
+        return self.lookup.get(path_key(path))
+
+    def image(self, i):
+        a, b = self.offsets[i], self.offsets[i + 1]
+        return self.images[a:b].reshape(self.shapes[i])
+
+    def labels(self, i):
+        """(classes int16, boxes float32 normalized xywh) of image i."""
+        a, b = self.label_offsets[i], self.label_offsets[i + 1]
+        return self.classes[a:b], self.boxes[a:b]
+
+
+def build_shard(split, imgsz=640, root=SHARD_DIR, workers=8, data=None):
+    """Create or incrementally refresh the shard of one split. Returns the ShardCache."""
+    data = data or load_data_config()
+    shard_dir = Path(root) / f"{split}_{imgsz}"
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    old = ShardCache(shard_dir) if (shard_dir / 'index.npz').exists() else None
+
+    paths = [str(p) for p in split_image_paths(split, data)]
+    stats = [_stat(p) for p in paths]
+    reuse = {}
+    if old is not None and old.imgsz == imgsz:
+        old_stats = {f: (int(m), int(z)) for f, m, z in zip(old.files, old.mtimes, old.sizes)}
+        reuse = {p: old.index_of(p) for p, st in zip(paths, stats) if old_stats.get(p) == st}
+    todo = [p for p in paths if p not in reuse]
+
+    print(f"   📦 {split}: {len(paths)} images, {len(reuse)} unchanged, {len(todo)} to decode")
+    start = time.perf_counter()
+    decoded = prefetch_images(todo, workers=workers, prefetch=4 * workers)  # same order as `paths`
+
+    # Stream the new image blob next to the old one, then swap
+    tmp = shard_dir / 'images.u8.tmp'
+    files, mtimes, sizes, offsets, shapes, orig_shapes = [], [], [], [0], [], []
+    with open(tmp, 'wb') as f:
+        for path, (mtime, size) in zip(paths, stats):
+            if path in reuse:
+                j = reuse[path]
+                f.write(old.image(j).tobytes())
+                shape, orig = tuple(old.shapes[j]), tuple(old.orig_shapes[j])
+            else:
+                _, image = next(decoded)
+                if image is None:
+                    print(f"   ⚠️ Could not decode: {path}")
+                    continue
+                orig = image.shape[:2]
+                image = resize_like_ultralytics(image, imgsz)
+                f.write(image.tobytes())
+                shape = image.shape
+            files.append(path)
+            mtimes.append(mtime)
+            sizes.append(size)
+            shapes.append(shape)
+            orig_shapes.append(orig)
+            offsets.append(offsets[-1] + int(np.prod(shape)))
+    if old is not None:
+        old._images = None  # release the mapping before replacing the file (Windows)
+    os.replace(tmp, shard_dir / 'images.u8')
+
+    # Packed labels, re-read only when the label file changed
+    label_offsets, classes, boxes, label_mtimes = [0], [], [], []
+    for path in files:
+        label_path = img2label_path(path)
+        mtime = _stat(label_path)[0]
+        j = old.index_of(path) if old is not None else None
+        if j is not None and old.label_mtimes[j] == mtime:
+            c, b = old.labels(j)
+        else:
+            c, xyxy = read_labels(label_path)
+            b = np.concatenate([(xyxy[:, :2] + xyxy[:, 2:]) / 2, xyxy[:, 2:] - xyxy[:, :2]], axis=1)
+        classes.append(np.asarray(c, dtype=np.int16))
+        boxes.append(np.asarray(b, dtype=np.float32).reshape(-1, 4))
+        label_mtimes.append(mtime)
+        label_offsets.append(label_offsets[-1] + len(c))
+
+    np.savez(shard_dir / 'labels.npz', offsets=np.asarray(label_offsets, dtype=np.int64),
+             classes=np.concatenate(classes) if classes else np.zeros(0, dtype=np.int16),
+             boxes=np.concatenate(boxes) if boxes else np.zeros((0, 4), dtype=np.float32),
+             label_mtimes=np.asarray(label_mtimes, dtype=np.int64))
+    meta = {'split': split, 'imgsz': imgsz, 'built': time.strftime('%Y-%m-%d %H:%M:%S')}
+    np.savez(shard_dir / 'index.npz', files=np.asarray(files), mtimes=np.asarray(mtimes, dtype=np.int64),
+             sizes=np.asarray(sizes, dtype=np.int64), offsets=np.asarray(offsets, dtype=np.int64),
+             shapes=np.asarray(shapes, dtype=np.int32).reshape(-1, 3),
+             orig_shapes=np.asarray(orig_shapes, dtype=np.int32).reshape(-1, 2), meta=np.asarray(json.dumps(meta)))
+    print(f"   ✅ {split}: {offsets[-1] / 1e9:.2f} GB in {time.perf_counter() - start:.0f}s -> {shard_dir}")
+    return ShardCache(shard_dir)
+
+
+def build_shards(splits=('train', 'val', 'test'), imgsz=640, root=SHARD_DIR, workers=8):
+    data = load_data_config()
+    return {split: build_shard(split, imgsz, root, workers, data) for split in splits if split in data}
+
+
+def _split_keys(paths):
+    return tuple(path_key(p) for p in (paths if isinstance(paths, (list, tuple)) else [paths]))
+
+
+def _split_of(img_path, data):
+    """Split name of a dataset path. List splits (distill.py appends unlabeled folders to train) match element-wise."""
+    keys = _split_keys(img_path)
+    for split in ('train', 'val', 'test'):
+        if split in data and _split_keys(data[split]) == keys:
+            return split
+    return None
+
+
+def attach_shard(dataset, shard):
+    """Point a MemmapYOLODataset at `shard`; None (or a different imgsz) keeps the normal decode path."""
+    if shard is None or shard.imgsz != dataset.imgsz:
+        dataset.shard, dataset.shard_ids = None, None
+        return dataset
+    dataset.shard = shard
+    dataset.shard_ids = [shard.index_of(f) for f in dataset.im_files]
+    hits = sum(i is not None for i in dataset.shard_ids)
+    print(f"   🗺️ {hits}/{len(dataset.im_files)} images served from {shard.dir}")
+    return dataset
+
+
+class MemmapImages:
+    """Mixin overriding BaseDataset.load_image with a zero-copy shard read."""
+
+    shard = None
+    shard_ids = None
+
+    def load_image(self, i, rect_mode=True, **kwargs):
+        j = self.shard_ids[i] if self.shard_ids is not None else None
+        if j is None or not rect_mode or kwargs.get('resize_short') or self.ims[i] is not None:
+            return super().load_image(i, rect_mode, **kwargs)
+        im = self.shard.image(j)
+        orig = tuple(self.shard.orig_shapes[j])
+        if self.augment and self.cache != 'ram':
+            # Same buffer bookkeeping as BaseDataset.load_image: Mosaic draws its extra images from the buffer
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = im, orig, im.shape[:2]
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                k = self.buffer.pop(0)
+                self.ims[k], self.im_hw0[k], self.im_hw[k] = None, None, None
+        return im, orig, im.shape[:2]
+
+
+class MemmapYOLODataset(MemmapImages, YOLODataset):
+    """YOLODataset whose images come from a shard (module level, so spawned dataloader workers can unpickle it)."""
+
+    def __init__(self, *args, shard=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        attach_shard(self, shard)
+
+
+def build_memmap_dataset(cfg, img_path, batch, data, mode='train', rect=False, stride=32, root=SHARD_DIR):
+    """ultralytics build_yolo_dataset(), constructing a MemmapYOLODataset on the split's shard."""
+    split = _split_of(img_path, data)
+    return MemmapYOLODataset(
+        img_path=img_path,
+        imgsz=cfg.imgsz,
+        batch_size=batch,
+        augment=mode == 'train',
+        hyp=cfg,
+        rect=cfg.rect or rect,
+        cache=cfg.cache or None,
+        single_cls=cfg.single_cls or False,
+        stride=int(stride),
+        pad=0.0 if mode == 'train' else 0.5,
+        prefix=colorstr(f"{mode}: "),
+        task=cfg.task,
+        classes=cfg.classes,
+        data=data,
+        fraction=cfg.fraction if mode == 'train' else 1.0,
+        shard=ShardCache.open(split, cfg.imgsz, root) if split else None,
+    )
+
+
+class MemmapDetectionTrainer(DetectionTrainer):
+    """DetectionTrainer whose train/val datasets read from the shard cache."""
+
+    def build_dataset(self, img_path, mode='train', batch=None):
+        gs = max(int(unwrap_model(self.model).stride.max() if self.model else 0), 32)
+        return build_memmap_dataset(self.args, img_path, batch, self.data, mode=mode, rect=mode == 'val', stride=gs)
+
+
+class MemmapDetectionValidator(DetectionValidator):
+    """DetectionValidator for model.val(validator=...) backed by the shard cache."""
+
+    def build_dataset(self, img_path, mode='val', batch=None):
+        return build_memmap_dataset(self.args, img_path, batch, self.data, mode=mode, stride=self.stride)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build memory-mapped image shards for each split")
+    parser.add_argument('--splits', nargs='+', default=['train', 'val', 'test'])
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--workers', type=int, default=8, help="Decode threads")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+    args = parse_args()
+    print("="*70)
+    print("🗺️ BUILDING IMAGE SHARDS")
+    print("="*70)
+    build_shards(args.splits, args.imgsz, workers=args.workers)
+    print("="*70 + "\n")
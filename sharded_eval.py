@@ -0,0 +1,153 @@
+"""
+SHARDED EVALUATION - Split a test set across CPU worker processes, merge exact mAP
+
+model.val(device=0) needs the GPU and runs one process. Here the image list
+is cut into contiguous shards that a pool of N worker processes (each with
+its own model and a fixed intra-op thread budget, so N x threads = cores)
+predicts and scores independently. A worker sends back only the compact
+per-image statistics evaluator.py already works with: a TP matrix over the 10
+IoU thresholds, confidences, predicted and target classes, plus a partial
+confusion matrix. The parent concatenates them in shard order and runs
+ap_per_class once, so mAP / P / R are exactly those of a single pass over the
+whole split.
+
+Predictions come from predict mode, which (like every evaluator.py dump)
+differs very slightly from model.val (multi-label NMS, rectangular batches).
+
+Usage:
+    python sharded_eval.py --split test --workers 8 --threads 2
+    python test.py --workers 8          # same, writes test_results.txt
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+from pathlib import Path
+import argparse
+import time
+import numpy as np
+import os
+
+from dataset_utils import load_data_config, split_image_paths
+from evaluator import _evaluate_chunk, save_report, summarize
+from predict import batched, prefetch_images
+
+THREAD_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+_models = {}  # per worker process: loaded once, reused for every shard it picks up
+
+
+def _eval_shard(model_path, files, backend, imgsz, conf, iou, max_det, augment, batch, threads, nc, cm_conf):
+    """Predict + score one shard. Returns (stats, confusion matrix, images, seconds)."""
+    import torch
+    from backends import get_model
+    torch.set_num_threads(threads)
+    start = time.perf_counter()
+    key = (model_path, backend, imgsz)
+    if key not in _models:
+        _models[key] = get_model(model_path, backend=backend, imgsz=imgsz)
+    model = _models[key]
+    detections = []
+    frames = prefetch_images([Path(f) for f in files], workers=2, prefetch=2 * batch)
+    for chunk in batched(frames, batch):
+        images = [im for _, im in chunk]
+        ok = [im is not None for im in images]
+        results = iter(model.predict([im for im in images if im is not None], imgsz=imgsz, conf=conf, iou=iou,
+                                     max_det=max_det, augment=augment, device='cpu', verbose=False)
+                       if any(ok) else [])
+        for good in ok:
+            if not good:
+                detections.append((np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int32)))
+                continue
+            r = next(results)
+            detections.append((r.boxes.xyxyn.cpu().numpy(), r.boxes.conf.cpu().numpy(),
+                               r.boxes.cls.cpu().numpy().astype(np.int32)))
+    stats, matrix = _evaluate_chunk(files, detections, None, None, max_det, nc, cm_conf)
+    return stats, matrix, len(files), time.perf_counter() - start
+
+
+def sharded_evaluation(model_path=None, split='test', workers=None, threads=1, imgsz=640, conf=0.001, iou=0.7,
+                       max_det=300, augment=False, batch=8, backend='auto', shards_per_worker=4, out_dir=None):
+    """mAP / P / R of a split, predicted and matched by `workers` processes x `threads` threads."""
+    from backends import resolve_model_path, select_backend
+    data = load_data_config()
+    names = data['names']
+    files = [str(f) for f in split_image_paths(split, data)]
+    model_path = resolve_model_path(model_path)
+    workers = workers or max(1, (os.cpu_count() or 1) // threads)
+    if augment:
+        backend = 'pytorch'  # TTA only exists for the PyTorch model
+    elif backend == 'auto':
+        backend = select_backend(model_path, imgsz)  # decide once here, not racing in every worker
+    cm_conf = 0.25 if conf in (None, 0.001) else conf
+
+    n_shards = min(len(files), workers * shards_per_worker) or 1
+    bounds = np.linspace(0, len(files), n_shards + 1).astype(int)
+    shards = [files[a:b] for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+    print("="*70)
+    print("🧩 SHARDED EVALUATION")
+    print("="*70)
+    print(f"Model:   {model_path} ({backend}{', TTA' if augment else ''})")
+    print(f"Split:   {split} ({len(files)} images in {len(shards)} shards)")
+    print(f"Workers: {workers} processes x {threads} threads")
+    print("="*70 + "\n")
+
+    start = time.perf_counter()
+    args = [(model_path, shard, backend, imgsz, conf, iou, max_det, augment, batch, threads, len(names), cm_conf)
+            for shard in shards]
+    # Spawned workers inherit the environment, so their OpenMP/MKL pools start at `threads`
+    saved = {var: os.environ.get(var) for var in THREAD_VARS}
+    os.environ.update({var: str(threads) for var in THREAD_VARS})
+    parts = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn')) as pool:
+            results = pool.map(_eval_shard, *zip(*args)) if args else []  # shard order = file order
+            for stats, matrix, n, seconds in results:
+                parts.append((stats, matrix))
+                print(f"   ✅ shard {len(parts)}/{len(shards)}: {n} images in {seconds:.1f}s")
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+    elapsed = time.perf_counter() - start
+
+    if not files:
+        print(f"⚠️ No images in split '{split}', nothing to score")
+    result = summarize([s for s, _ in parts])
+    nc = len(names)
+    result['confusion_matrix'] = sum((m for _, m in parts), np.zeros((nc + 1, nc + 1), dtype=np.int64))
+    result['n_images'] = len(files)
+    result['seconds'] = elapsed
+    out_dir = Path(out_dir or Path('runs/eval') / f"{split}_sharded")
+    save_report(result, names, out_dir)
+    result['save_dir'] = out_dir
+    print(f"\n⏱️ {len(files)} images in {elapsed:.1f}s ({len(files) / max(elapsed, 1e-9):.1f} img/s)")
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Multi-process CPU evaluation of a split")
+    parser.add_argument('--model', default=None, help="Weights path, run name or alias (default: best)")
+    parser.add_argument('--split', default='test')
+    parser.add_argument('--workers', type=int, default=None, help="Processes (default: cores / threads)")
+    parser.add_argument('--threads', type=int, default=1, help="Intra-op threads per process")
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--conf', type=float, default=0.001)
+    parser.add_argument('--iou', type=float, default=0.7)
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--tta', action='store_true')
+    parser.add_argument('--backend', default='auto', choices=['auto', 'pytorch', 'onnx', 'openvino', 'torchscript', 'onnx_int8'])
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+    args = parse_args()
+    result = sharded_evaluation(args.model, split=args.split, workers=args.workers, threads=args.threads,
+                                imgsz=args.imgsz, conf=args.conf, iou=args.iou, batch=args.batch,
+                                augment=args.tta, backend=args.backend)
+    print(f"mAP@50: {result['map50']:.4f} | mAP@50-95: {result['map']:.4f} | "
+          f"P: {result['mp']:.4f} | R: {result['mr']:.4f}")
+    print("="*70 + "\n")
@@ -0,0 +1,173 @@
+"""
+STAGE TIMING - Opt-in per-stage latency histograms for the inference path
+
+One process-wide registry of stage histograms shared by app.py, predict.py,
+inference_server.py and the validation scripts:
+
+    with stage_timing.stage('decode'):
+        image = Image.open(f)
+    results = model.predict(image)
+    stage_timing.record_speed(results)        # preprocess / forward / nms from ultralytics
+
+Disabled by default: stage() then hands back one shared no-op context, so the
+hooks cost a function call. Enable with STAGE_TIMING=1, enable(), the app's
+sidebar debug toggle or `inference_server.py --timing`.
+
+Each stage keeps Prometheus-style cumulative buckets (fixed, log-spaced, so
+memory does not grow with traffic), a running sum, count and max, and the
+last value. Percentiles are interpolated from the buckets (the +Inf bucket
+up to the max seen). Exposed as:
+    prometheus_text()     text exposition format (inference_server GET /metrics)
+    snapshot() / dump_json()   JSON (GET /metrics.json, runs/timing/*.json)
+"""
+
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+import threading
+import json
+import time
+import os
+
+# Bucket upper bounds in seconds (the last bucket is +Inf)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TIMING_DIR = Path('runs/timing')
+
+_enabled = os.environ.get('STAGE_TIMING', '') not in ('', '0')
+_lock = threading.Lock()
+_stages = {}
+_noop = nullcontext()
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.last = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += seconds
+        self.count += 1
+        self.last = seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Linear interpolation inside the bucket holding the q-th observation."""
+        if not self.count:
+            return None
+        target, seen = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= target and n:
+                lo = BUCKETS[i - 1] if i else 0.0
+                hi = BUCKETS[i] if i < len(BUCKETS) else max(self.max, lo)
+                return lo + (hi - lo) * (target - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = bool(on)
+
+
+def enabled():
+    return _enabled
+
+
+def observe(name, seconds):
+    if not _enabled:
+        return
+    with _lock:
+        hist = _stages.get(name)
+        if hist is None:
+            hist = _stages[name] = Histogram()
+        hist.observe(seconds)
+
+
+@contextmanager
+def _timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def stage(name):
+    """Context manager timing one stage; a shared no-op while timing is disabled."""
+    return _timed(name) if _enabled else _noop
+
+
+def record_speed(results, prefix=''):
+    """Stages from ultralytics' own per-image speed dict (ms): Results, list of Results or metrics.speed."""
+    if not _enabled:
+        return
+    if isinstance(results, dict):
+        speeds = [results]
+    else:
+        speeds = [r.speed for r in (results if isinstance(results, (list, tuple)) else [results])
+                  if getattr(r, 'speed', None)]
+    names = {'preprocess': 'preprocess', 'inference': 'forward', 'postprocess': 'nms', 'loss': 'loss'}
+    for speed in speeds:
+        for key, ms in speed.items():
+            if ms is not None:
+                observe(prefix + names.get(key, key), ms / 1000)
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+
+
+def snapshot():
+    """{stage: count, total / mean / p50 / p95 / p99 / last in ms, buckets} for every stage seen."""
+    with _lock:
+        out = {}
+        for name, h in _stages.items():
+            ms = lambda v: None if v is None else round(v * 1000, 3)
+            out[name] = {
+                'count': h.count, 'total_ms': ms(h.sum), 'mean_ms': ms(h.sum / h.count) if h.count else None,
+                'p50_ms': ms(h.quantile(0.5)), 'p95_ms': ms(h.quantile(0.95)), 'p99_ms': ms(h.quantile(0.99)),
+                'last_ms': ms(h.last), 'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], h.counts)),
+            }
+        return out
+
+
+def prometheus_text(metric='inference_stage_seconds'):
+    """All stages as one Prometheus histogram with a `stage` label."""
+    lines = [f"# HELP {metric} Latency of each inference stage in seconds.", f"# TYPE {metric} histogram"]
+    with _lock:
+        for name, h in sorted(_stages.items()):
+            cumulative = 0
+            for bound, n in zip([repr(b) for b in BUCKETS] + ['+Inf'], h.counts):
+                cumulative += n
+                lines.append(f'{metric}_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{stage="{name}"}} {h.sum:.6f}')
+            lines.append(f'{metric}_count{{stage="{name}"}} {h.count}')
+    return "\n".join(lines) + "\n"
+
+
+def dump_json(name, out_dir=TIMING_DIR):
+    """Write snapshot() to runs/timing/<name>.json (only when timing is enabled). Returns the path."""
+    if not _enabled:
+        return None
+    path = Path(out_dir) / f"{name}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'stages': snapshot()}, indent=2))
+    return path
+
+
+def print_summary():
+    stages = snapshot()
+    if not stages:
+        return
+    print(f"{'Stage':<22} {'Count':>7} {'Mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'Total s':>9}")
+    print("-"*70)
+    for name, s in sorted(stages.items(), key=lambda kv: -kv[1]['total_ms']):
+        print(f"{name:<22} {s['count']:>7} {s['mean_ms']:>9.2f} {s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} "
+              f"{s['total_ms'] / 1000:>9.2f}")
@@ -0,0 +1,148 @@
+"""
+TRAINING TELEMETRY - Tail results.csv of every run under runs/detect
+
+ultralytics appends one row to <run>/results.csv per epoch. CsvTail keeps
+the byte offset it has read up to and only parses what was appended since
+(a half-written last line is left for the next poll), and frame() extends a
+cached DataFrame with those rows only, so the cost per refresh does not grow
+with the number of epochs. A file that shrank (run
+restarted with exist_ok=True) is re-read from the start.
+
+TrainingTelemetry discovers results.csv files under a root (re-scanning the
+folder at most every `rescan_s` seconds) and keeps one tail per run; app.py
+holds one instance for all sessions and polls it from a fragment that
+re-runs every few seconds, so curves stream live during a long train.py run.
+
+Usage:
+    python telemetry.py                 # print new epochs of every run as they land
+"""
+
+from pathlib import Path
+import threading
+import time
+import pandas as pd
+import os
+
+RUNS_ROOT = 'runs/detect'
+
+
+class CsvTail:
+    """Incremental reader of one append-only CSV file."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.offset = 0
+        self.columns = None
+        self.rows = []
+        self.mtime = 0.0
+        self._frame = None   # DataFrame of rows[:_framed], extended by frame()
+        self._framed = 0
+
+    def poll(self):
+        """Parse rows appended since the last call. Returns the number of new rows."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return 0
+        if st.st_size < self.offset:  # truncated / restarted
+            self.offset, self.columns, self.rows = 0, None, []
+            self._frame, self._framed = None, 0
+        if st.st_size == self.offset:
+            return 0
+        self.mtime = st.st_mtime
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            chunk = f.read(st.st_size - self.offset)
+        end = chunk.rfind(b'\n') + 1  # only complete lines
+        self.offset += end
+        new = 0
+        for line in chunk[:end].decode('utf-8', errors='replace').splitlines():
+            values = [v.strip() for v in line.split(',')]
+            if self.columns is None:
+                self.columns = values
+                continue
+            try:
+                self.rows.append([float(v) for v in values])
+                new += 1
+            except ValueError:
+                continue
+        return new
+
+    def frame(self):
+        """All rows so far as a DataFrame indexed by epoch; only rows polled since the last call are converted."""
+        if self._frame is None or self._framed < len(self.rows):
+            new = pd.DataFrame(self.rows[self._framed:], columns=self.columns or [])
+            if 'epoch' in new.columns:
+                new = new.set_index('epoch')
+            self._frame = new if self._frame is None else pd.concat([self._frame, new])
+            self._framed = len(self.rows)
+        return self._frame
+
+
+class TrainingTelemetry:
+    """One CsvTail per results.csv under `root`."""
+
+    def __init__(self, root=RUNS_ROOT, rescan_s=30):
+        self.root = Path(root)
+        self.rescan_s = rescan_s
+        self.tails = {}
+        self.last_scan = 0.0
+        self.lock = threading.Lock()  # shared by all Streamlit sessions: readers too, poll() adds tails and rows
+
+    def _run_name(self, csv_path):
+        return csv_path.parent.relative_to(self.root).as_posix()
+
+    def scan(self):
+        if self.root.exists():
+            for csv_path in self.root.rglob('results.csv'):
+                name = self._run_name(csv_path)
+                if name not in self.tails:
+                    self.tails[name] = CsvTail(csv_path)
+        self.last_scan = time.time()
+
+    def poll(self):
+        """Pick up new runs (rate-limited) and new rows. Returns {run: n_new_rows}."""
+        with self.lock:
+            if time.time() - self.last_scan > self.rescan_s:
+                self.scan()
+            return {name: tail.poll() for name, tail in self.tails.items()}
+
+    def runs(self):
+        with self.lock:
+            return sorted(name for name, tail in self.tails.items() if tail.rows)
+
+    def active(self, within_s=600):
+        """Runs whose results.csv changed recently, i.e. still training."""
+        now = time.time()
+        with self.lock:
+            return sorted(name for name, tail in self.tails.items() if tail.rows and now - tail.mtime < within_s)
+
+    def overlay(self, column, runs):
+        """One column of several runs side by side (index = epoch), for a single chart."""
+        series = {}
+        with self.lock:
+            for name in runs:
+                tail = self.tails.get(name)
+                df = tail.frame() if tail is not None else None
+                if df is not None and column in df.columns:
+                    series[name] = df[column]
+        return pd.DataFrame(series)
+
+
+if __name__ == '__main__':
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+    telemetry = TrainingTelemetry()
+    print("="*70)
+    print(f"📡 TRAINING TELEMETRY - watching {RUNS_ROOT} (Ctrl+C to stop)")
+    print("="*70)
+    try:
+        while True:
+            for name, n in telemetry.poll().items():
+                if n:
+                    last = telemetry.tails[name].frame().iloc[-1]
+                    print(f"   {name:<45} epoch {int(last.name):>4} | "
+                          f"mAP@50 {last.get('metrics/mAP50(B)', float('nan')):.4f}")
+            time.sleep(5)
+    except KeyboardInterrupt:
+        print("="*70 + "\n")
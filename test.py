@@ -1,59 +1,104 @@
-from ultralytics import YOLO
+import argparse
+import torch
 import os
 
-def run_test():
+from backends import default_device, get_model
+from dataset_utils import load_data_config
+from evaluator import evaluate, save_report
+from run_registry import register_run, resolve_model
+from selective_tta import selective_predictions
+from shard_cache import MemmapDetectionValidator
+from sharded_eval import sharded_evaluation
+from stage_timing import dump_json, record_speed
+from thresholds import load_thresholds
+
+def run_test(workers=None, threads=1, tta='full'):
     # 1. Path Setup
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    # 2. Load your BEST trained model weights
-    # Adjusted path to match user's structure
-    model_path = os.path.join(current_dir, 'runs/detect/runs/detect/space_station_medium_final/weights/best.pt')
-    
-    if not os.path.exists(model_path):
-        print(f"Error: Could not find model at {model_path}")
-        # Try fallback path just in case
-        model_path = os.path.join(current_dir, 'runs/detect/space_station_medium_final/weights/best.pt')
-        if os.path.exists(model_path):
-            print(f"Found model at fallback path: {model_path}")
-        else:
-            return
-
-    model = YOLO(model_path)
+
+    os.chdir(current_dir)
+
+    # 2. Load your BEST trained model weights (highest val mAP@50 in the run registry)
+    try:
+        model_path = resolve_model('best')
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        return
+    print(f"Model: {model_path}")
+
+    thresholds = load_thresholds(os.path.join(current_dir, 'thresholds.json'))['map']
 
     # 3. Run Validation specifically on the TEST set
     print("Starting evaluation on 1,400 test images...")
-    
-    # The 'split' argument is used to specify which subset from your YAML to use.
-    # Ensure your yolo_params.yaml has a 'test:' path defined.
-    metrics = model.val(
-        data='yolo_params.yaml', 
-        split='test',            # Specify 'test' split from your yaml
-        imgsz=640,
-        batch=16,
-        augment=True,            # ✅ Enable Test-Time Augmentation (TTA) for max mAP
-        conf=0.2,                # Optimal confidence from our earlier test
-        iou=0.5,                 # Optimal IoU from our earlier test
-        device=0,                # Use your RTX 3050
-        save_json=True           # Saves results for hackathon reporting [cite: 78]
-    )
 
-    # [cite_start]4. Print Official Results for Submission [cite: 194, 195]
+    if tta == 'selective':
+        # Plain pass on every image, augmented pass only where selective_tta.py's triggers fire
+        preds = selective_predictions(model_path, 'test', imgsz=640, iou=thresholds['iou'], device=default_device())
+        result = evaluate(preds, conf=thresholds['conf'], workers=workers or os.cpu_count())
+        map50, map5095, precision, recall = result['map50'], result['map'], result['mp'], result['mr']
+        save_dir = os.path.join('runs', 'eval', 'test_selective_tta')
+        save_report(result, load_data_config()['names'], save_dir)
+        print(f"TTA ran on {preds.meta['n_triggered']}/{len(preds)} images")
+    elif workers or not torch.cuda.is_available():
+        # GPU-less node: shard the test images over worker processes (sharded_eval.py)
+        result = sharded_evaluation(model_path, split='test', workers=workers, threads=threads, imgsz=640,
+                                    conf=thresholds['conf'], iou=thresholds['iou'], augment=tta == 'full')
+        map50, map5095, precision, recall = result['map50'], result['map'], result['mp'], result['mr']
+        save_dir = result['save_dir']
+    else:
+        model = get_model(model_path, backend='pytorch')  # TTA needs the PyTorch model
+        # The 'split' argument is used to specify which subset from your YAML to use.
+        # Ensure your yolo_params.yaml has a 'test:' path defined.
+        metrics = model.val(
+            validator=MemmapDetectionValidator,  # Reads the test shard when shard_cache.py has built it
+            data='yolo_params.yaml',
+            split='test',            # Specify 'test' split from your yaml
+            imgsz=640,
+            batch=16,
+            augment=tta == 'full',   # ✅ Full Test-Time Augmentation (TTA): the reference mAP
+            conf=thresholds['conf'], # Optimal confidence from quick_tta_test.py sweep
+            iou=thresholds['iou'],   # Optimal IoU from quick_tta_test.py sweep
+            device=default_device(), # RTX 3050
+            save_json=True           # Saves results for hackathon reporting [cite: 78]
+        )
+        map50, map5095, precision, recall = metrics.box.map50, metrics.box.map, metrics.box.mp, metrics.box.mr
+        save_dir = metrics.save_dir
+        register_run(save_dir)  # index the new val folder (plots, predictions.json)
+        record_speed(metrics.speed, prefix='val/')  # per-image ms, kept when STAGE_TIMING=1
+
     # [cite_start]4. Print Official Results for Submission [cite: 194, 195]
     print("\n--- TEST RESULTS ---")
-    print(f"mAP@50 (Primary Metric): {metrics.box.map50:.4f}")
-    print(f"mAP@50-95: {metrics.box.map:.4f}")
-    print(f"Precision: {metrics.box.mp:.4f}")
-    print(f"Recall: {metrics.box.mr:.4f}")
-    print(f"Results saved in: {metrics.save_dir}")
-    
+    print(f"mAP@50 (Primary Metric): {map50:.4f}")
+    print(f"mAP@50-95: {map5095:.4f}")
+    print(f"Precision: {precision:.4f}")
+    print(f"Recall: {recall:.4f}")
+    print(f"TTA: {tta}")
+    print(f"Results saved in: {save_dir}")
+
     # Save to file
     with open('test_results.txt', 'w') as f:
         f.write("--- TEST RESULTS ---\n")
-        f.write(f"mAP@50: {metrics.box.map50:.4f}\n")
-        f.write(f"mAP@50-95: {metrics.box.map:.4f}\n")
-        f.write(f"Precision: {metrics.box.mp:.4f}\n")
-        f.write(f"Recall: {metrics.box.mr:.4f}\n")
-        f.write(f"Results dir: {metrics.save_dir}\n")
+        f.write(f"mAP@50: {map50:.4f}\n")
+        f.write(f"mAP@50-95: {map5095:.4f}\n")
+        f.write(f"Precision: {precision:.4f}\n")
+        f.write(f"Recall: {recall:.4f}\n")
+        f.write(f"TTA: {tta}\n")
+        f.write(f"Results dir: {save_dir}\n")
+
+    timing_file = dump_json('test')
+    if timing_file:
+        print(f"Stage timing: {timing_file}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Official test split evaluation")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Sharded CPU evaluation with N processes (default on machines without CUDA)")
+    parser.add_argument('--threads', type=int, default=1, help="Intra-op threads per worker process")
+    parser.add_argument('--tta', choices=['full', 'selective', 'none'], default='full',
+                        help="full: augment every image (reference), selective: only ambiguous ones (selective_tta.py)")
+    parser.add_argument('--no-tta', action='store_true', help="Same as --tta none")
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    run_test()
\ No newline at end of file
+    args = parse_args()
+    run_test(workers=args.workers, threads=args.threads, tta='none' if args.no_tta else args.tta)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('ultralytics')
+
+from types import SimpleNamespace
+from ultralytics.engine.validator import BaseValidator
+from ultralytics.utils import metrics as yolo_metrics
+
+from box_ops import box_iou
+from evaluator import IOU_THRESHOLDS, ap_per_class, match_predictions
+
+
+def random_stats(rng, n_pred=400, nc=4):
+    tp = rng.random((n_pred, len(IOU_THRESHOLDS))) < np.linspace(0.7, 0.2, len(IOU_THRESHOLDS))
+    conf = rng.random(n_pred).astype(np.float32)
+    pred_cls = rng.integers(0, nc, n_pred)
+    target_cls = rng.integers(0, nc, n_pred // 2)
+    return tp.astype(np.float64), conf, pred_cls, target_cls
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_ap_per_class_matches_ultralytics(seed):
+    tp, conf, pred_cls, target_cls = random_stats(np.random.default_rng(seed))
+    ours = ap_per_class(tp, conf, pred_cls, target_cls)
+    _, _, p, r, _, ap, classes, *_ = yolo_metrics.ap_per_class(tp, conf, pred_cls, target_cls)
+    np.testing.assert_array_equal(ours['classes'], classes)
+    np.testing.assert_allclose(ours['p'], p)
+    np.testing.assert_allclose(ours['r'], r)
+    np.testing.assert_allclose(ours['ap'], ap)
+
+
+def test_precision_drops_to_zero_after_max_recall():
+    # One of two targets found, at precision 1: AP@50 is ~0.5, not extrapolated out to recall 1
+    result = ap_per_class(np.ones((1, len(IOU_THRESHOLDS))), np.array([0.9]), np.array([0]), np.array([0, 0]))
+    assert result['ap'][0, 0] == pytest.approx(0.5, abs=0.01)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_match_predictions_matches_ultralytics(seed):
+    rng = np.random.default_rng(seed)
+    xy = rng.random((30, 2)) * 200
+    gt = np.concatenate([xy, xy + 20 + rng.random((30, 2)) * 40], 1).astype(np.float32)
+    pred = (gt[rng.integers(0, 30, 50)] + rng.normal(0, 6, (50, 4))).astype(np.float32)
+    gt_cls, pred_cls = rng.integers(0, 3, 30), rng.integers(0, 3, 50)
+    iou = box_iou(gt, pred)
+    validator = SimpleNamespace(iouv=torch.tensor(IOU_THRESHOLDS))
+    expected = BaseValidator.match_predictions(validator, torch.tensor(pred_cls), torch.tensor(gt_cls),
+                                               torch.tensor(iou))
+    np.testing.assert_array_equal(match_predictions(pred_cls, gt_cls, iou), expected.cpu().numpy())
@@ -0,0 +1,70 @@
+import pickle
+import numpy as np
+import pytest
+import cv2
+
+pytest.importorskip('ultralytics')
+
+from ultralytics.cfg import get_cfg
+from ultralytics.utils import DEFAULT_CFG
+
+from shard_cache import MemmapYOLODataset, ShardCache, build_memmap_dataset, build_shard
+
+IMGSZ = 320
+NAMES = {0: 'a', 1: 'b'}
+
+
+@pytest.fixture
+def shard_dataset(tmp_path):
+    images, labels = tmp_path / 'images', tmp_path / 'labels'
+    images.mkdir()
+    labels.mkdir()
+    rng = np.random.default_rng(0)
+    for i in range(6):
+        h, w = (int(v) for v in rng.integers(200, 480, size=2))
+        cv2.imwrite(str(images / f"{i}.png"), rng.integers(0, 255, (h, w, 3), dtype=np.uint8))
+        (labels / f"{i}.txt").write_text(f"{i % 2} 0.5 0.5 0.25 0.25\n")
+    data = {'path': str(tmp_path), 'train': 'images', 'nc': len(NAMES), 'names': NAMES}
+    shard = build_shard('train', IMGSZ, root=tmp_path / 'shards', workers=2, data=data)
+    hyp = get_cfg(DEFAULT_CFG, {'imgsz': IMGSZ, 'mosaic': 1.0})
+    return MemmapYOLODataset(img_path=str(images), imgsz=IMGSZ, batch_size=2, augment=True, hyp=hyp,
+                             data=data, shard=shard)
+
+
+def test_every_image_is_served_from_the_shard(shard_dataset):
+    assert isinstance(shard_dataset.shard, ShardCache)
+    assert all(j is not None for j in shard_dataset.shard_ids)
+    im, orig, resized = shard_dataset.load_image(0)
+    assert max(resized) == IMGSZ
+    assert np.array_equal(im, shard_dataset.shard.image(shard_dataset.shard_ids[0]))
+
+
+def test_mosaic_sample_from_shard(shard_dataset):
+    for i in range(len(shard_dataset)):
+        sample = shard_dataset[i]
+        assert tuple(sample['img'].shape) == (3, IMGSZ, IMGSZ)
+    # Shard reads feed the mosaic buffer like decoded reads do
+    assert 0 < len(shard_dataset.buffer) <= shard_dataset.max_buffer_length
+    assert all(shard_dataset.ims[i] is not None for i in shard_dataset.buffer)
+
+
+def test_dataset_pickles_for_spawned_workers(shard_dataset):
+    clone = pickle.loads(pickle.dumps(shard_dataset))
+    assert type(clone) is MemmapYOLODataset
+    assert clone.shard_ids == shard_dataset.shard_ids
+    assert tuple(clone[0]['img'].shape) == (3, IMGSZ, IMGSZ)
+
+
+def test_list_split_keeps_the_shard(shard_dataset, tmp_path):
+    # distill.py: train = [labeled images, unlabeled folder]
+    unlabeled = tmp_path / 'unlabeled'
+    unlabeled.mkdir()
+    for i in range(2):
+        cv2.imwrite(str(unlabeled / f"u{i}.png"), np.zeros((240, 320, 3), dtype=np.uint8))
+    train = [shard_dataset.img_path, str(unlabeled)]
+    data = {'path': str(tmp_path), 'train': train, 'nc': len(NAMES), 'names': NAMES}
+    cfg = get_cfg(DEFAULT_CFG, {'imgsz': IMGSZ})
+    dataset = build_memmap_dataset(cfg, list(train), 2, data, root=tmp_path / 'shards')
+    assert isinstance(dataset.shard, ShardCache)
+    assert sum(j is not None for j in dataset.shard_ids) == 6
+    assert len(dataset.shard_ids) == 8
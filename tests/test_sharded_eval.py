@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('ultralytics')
+
+from types import SimpleNamespace
+from ultralytics.engine.validator import BaseValidator
+from ultralytics.utils.metrics import DetMetrics, box_iou
+
+from dataset_utils import read_labels
+from evaluator import IOU_THRESHOLDS, _evaluate_chunk, summarize
+
+NAMES = {0: 'a', 1: 'b', 2: 'c'}
+
+
+@pytest.fixture
+def small_split(tmp_path):
+    """12 label files plus jittered / missed / spurious predictions for each image."""
+    images, labels = tmp_path / 'images', tmp_path / 'labels'
+    images.mkdir()
+    labels.mkdir()
+    rng = np.random.default_rng(0)
+    files, detections = [], []
+    for i in range(12):
+        n = int(rng.integers(0, 6))
+        xy = rng.random((n, 2)) * 0.7
+        wh = 0.05 + rng.random((n, 2)) * 0.25
+        classes = rng.integers(0, len(NAMES), n)
+        (labels / f"{i}.txt").write_text("".join(f"{c} {x + w / 2} {y + h / 2} {w} {h}\n"
+                                                 for c, (x, y), (w, h) in zip(classes, xy, wh)))
+        files.append(str(images / f"{i}.jpg"))
+        found = rng.random(n) < 0.7
+        boxes = np.concatenate([xy, xy + wh], 1)[found] + rng.normal(0, 0.01, (found.sum(), 4))
+        spurious = rng.random((int(rng.integers(0, 4)), 4)) * 0.5
+        boxes = np.concatenate([boxes, spurious + [0, 0, 0.2, 0.2]]).astype(np.float32)
+        pred_classes = np.concatenate([classes[found], rng.integers(0, len(NAMES), len(spurious))]).astype(np.int32)
+        pred_classes[rng.random(len(pred_classes)) < 0.1] = 0  # some wrong-class predictions
+        detections.append((boxes, rng.random(len(boxes)).astype(np.float32), pred_classes))
+    return files, detections
+
+
+def val_metrics(files, detections):
+    """mAP / P / R the way DetectionValidator computes them (ultralytics matching + DetMetrics)."""
+    validator = SimpleNamespace(iouv=torch.tensor(IOU_THRESHOLDS))
+    metrics = DetMetrics(NAMES)
+    for path, (boxes, scores, classes) in zip(files, detections):
+        gt_classes, gt_boxes = read_labels(path.replace('images', 'labels').replace('.jpg', '.txt'))
+        if len(gt_classes) and len(classes):
+            iou = box_iou(torch.tensor(gt_boxes), torch.tensor(boxes))
+            tp = BaseValidator.match_predictions(validator, torch.tensor(classes), torch.tensor(gt_classes),
+                                                 iou).numpy()
+        else:
+            tp = np.zeros((len(classes), len(IOU_THRESHOLDS)), dtype=bool)
+        metrics.update_stats({'tp': tp, 'conf': scores, 'pred_cls': classes, 'target_cls': gt_classes,
+                              'target_img': np.unique(gt_classes), 'im_name': path})
+    metrics.process()
+    return metrics.box
+
+
+def test_sharded_cpu_path_agrees_with_val(small_split):
+    files, detections = small_split
+    parts = [_evaluate_chunk(files[a:a + 5], detections[a:a + 5], None, None, 300, len(NAMES), 0.25)
+             for a in range(0, len(files), 5)]
+    ours = summarize([s for s, _ in parts])
+    box = val_metrics(files, detections)
+    assert ours['map50'] == pytest.approx(box.map50, abs=1e-9)
+    assert ours['map'] == pytest.approx(box.map, abs=1e-9)
+    assert ours['mp'] == pytest.approx(box.mp, abs=1e-9)
+    assert ours['mr'] == pytest.approx(box.mr, abs=1e-9)
+
+
+@pytest.mark.parametrize('stats', [[], [None, None]])
+def test_summarize_empty_split(stats):
+    result = summarize(stats)
+    assert result['map50'] == result['map'] == result['mp'] == result['mr'] == 0.0
@@ -0,0 +1,16 @@
+from stage_timing import BUCKETS, Histogram
+
+
+def test_inf_bucket_interpolates_up_to_the_max():
+    h = Histogram()
+    h.observe(BUCKETS[-1] * 3)
+    h.observe(BUCKETS[-1] * 1.2)  # the last sample is not the largest
+    assert h.quantile(1.0) == BUCKETS[-1] * 3
+    assert BUCKETS[-1] < h.quantile(0.75) < BUCKETS[-1] * 3
+
+
+def test_quantile_inside_a_bucket():
+    h = Histogram()
+    for _ in range(4):
+        h.observe(0.003)  # (0.0025, 0.005] bucket
+    assert h.quantile(0.5) == 0.0025 + (0.005 - 0.0025) * 0.5
@@ -0,0 +1,38 @@
+"""
+RECOMMENDED THRESHOLDS - Shared by test.py, app.py and the threshold sweep
+
+quick_tta_test.py writes thresholds.json after an offline sweep:
+  - 'map'       conf/iou that maximize mAP@50 (used for evaluation in test.py)
+  - 'display'   conf/iou at the max-F1 operating point (app.py slider defaults)
+  - 'per_class' F1-optimal conf and AP-optimal NMS IoU for every class
+Without the file, the values hand-picked earlier are used.
+"""
+
+import json
+import os
+
+THRESHOLDS_FILE = 'thresholds.json'
+
+DEFAULT_THRESHOLDS = {
+    'map': {'conf': 0.2, 'iou': 0.5},
+    'display': {'conf': 0.25, 'iou': 0.45},
+    'per_class': {},
+}
+
+
+def load_thresholds(path=THRESHOLDS_FILE):
+    thresholds = {k: dict(v) for k, v in DEFAULT_THRESHOLDS.items()}
+    if os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)
+        for key, value in saved.items():
+            if isinstance(value, dict) and key in thresholds:
+                thresholds[key].update(value)
+            else:
+                thresholds[key] = value
+    return thresholds
+
+
+def save_thresholds(thresholds, path=THRESHOLDS_FILE):
+    with open(path, 'w') as f:
+        json.dump(thresholds, f, indent=2)
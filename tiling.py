@@ -0,0 +1,111 @@
+"""
+TILED INFERENCE - Slice large frames into overlapping tiles and merge back
+
+Downscaling a 4K capture to imgsz=640 shrinks a FireAlarm to a few pixels.
+Here each frame is cut into overlapping imgsz x imgsz tiles that are run at
+native resolution:
+  - tiles of every image in a chunk are batched together, so a whole chunk
+    is one (or a few, --tile-batch) forward passes
+  - flat tiles (no texture on a 32x32 thumbnail) are skipped before inference
+  - an optional full-frame pass rides in the same batch to catch large
+    objects that no single tile contains
+  - detections are shifted back to frame coordinates and merged class-aware,
+    with NMS on intersection-over-smaller (a box cut at a tile border lies
+    inside its full twin from the neighbouring tile) or with WBF
+
+predict_tiled() returns ultralytics Results, so predict.py writes tiled and
+plain results with the same code.
+"""
+
+import numpy as np
+import torch
+import cv2
+
+from ultralytics.engine.results import Results
+
+from box_ops import box_ios, nms_from_iou, weighted_boxes_fusion
+
+
+def tile_grid(height, width, tile=640, overlap=0.2):
+    """Top-left aligned tile windows (x1, y1, x2, y2); the last row/column is flush with the edge."""
+    def starts(size):
+        if size <= tile:
+            return [0]
+        stride = max(1, int(tile * (1 - overlap)))
+        s = list(range(0, size - tile, stride))
+        return s + [size - tile]
+    return [(x, y, min(x + tile, width), min(y + tile, height)) for y in starts(height) for x in starts(width)]
+
+
+def is_flat(crop, min_std=3.0):
+    """True when a tile has (almost) no texture, i.e. nothing worth a forward pass."""
+    thumb = cv2.resize(cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY), (32, 32), interpolation=cv2.INTER_AREA)
+    return float(thumb.std()) < min_std
+
+
+def merge_detections(boxes, scores, classes, method='nms', thr=0.6, max_det=300):
+    """Class-aware cross-tile merge. 'nms' uses IoS, 'wbf' fuses IoU clusters, 'none' keeps everything."""
+    if method == 'none' or len(scores) == 0:
+        order = np.argsort(-scores, kind='stable')[:max_det]
+        return boxes[order], scores[order], classes[order]
+    if method == 'wbf':
+        return weighted_boxes_fusion([boxes], [scores], [classes], iou_thr=thr, max_det=max_det)
+    kept = []
+    for c in np.unique(classes):
+        idx = np.flatnonzero(classes == c)
+        idx = idx[np.argsort(-scores[idx], kind='stable')]
+        kept.append(idx[nms_from_iou(box_ios(boxes[idx], boxes[idx]), thr)])
+    kept = np.concatenate(kept)
+    kept = kept[np.argsort(-scores[kept], kind='stable')][:max_det]
+    return boxes[kept], scores[kept], classes[kept]
+
+
+def predict_tiled(model, images, imgsz=640, tile=None, overlap=0.2, conf=0.25, iou=0.45, full_frame=True,
+                  merge='nms', merge_thr=0.6, skip_flat=3.0, tile_batch=32, max_det=300, device=None, augment=False,
+                  paths=None):
+    """Tiled detection for a list of BGR images. Returns one ultralytics Results per image.
+
+    Images no larger than a tile get a single plain pass.
+    """
+    tile = tile or imgsz
+    crops, owners, offsets = [], [], []
+    for i, image in enumerate(images):
+        h, w = image.shape[:2]
+        windows = tile_grid(h, w, tile, overlap)
+        if len(windows) > 1:
+            for x1, y1, x2, y2 in windows:
+                crop = image[y1:y2, x1:x2]
+                if skip_flat and is_flat(crop, skip_flat):
+                    continue
+                crops.append(crop)
+                owners.append(i)
+                offsets.append((x1, y1))
+        if full_frame or len(windows) == 1:
+            crops.append(image)
+            owners.append(i)
+            offsets.append((0, 0))
+
+    per_image = [[] for _ in images]
+    for start in range(0, len(crops), tile_batch):
+        results = model.predict(crops[start:start + tile_batch], imgsz=imgsz, conf=conf, iou=iou,
+                                max_det=max_det, device=device, augment=augment, verbose=False)
+        for k, result in enumerate(results):
+            boxes = result.boxes
+            if not len(boxes):
+                continue
+            x, y = offsets[start + k]
+            det = np.concatenate([boxes.xyxy.cpu().numpy() + (x, y, x, y),
+                                  boxes.conf.cpu().numpy()[:, None],
+                                  boxes.cls.cpu().numpy()[:, None]], axis=1)
+            per_image[owners[start + k]].append(det)
+
+    names = model.names
+    outputs = []
+    for i, image in enumerate(images):
+        det = np.concatenate(per_image[i]) if per_image[i] else np.zeros((0, 6), dtype=np.float32)
+        boxes, scores, classes = merge_detections(det[:, :4], det[:, 4], det[:, 5].astype(np.int64),
+                                                  merge, merge_thr, max_det)
+        data = np.concatenate([boxes, scores[:, None], classes[:, None]], axis=1).astype(np.float32)
+        path = str(paths[i]) if paths is not None else ''
+        outputs.append(Results(image, path=path, names=names, boxes=torch.from_numpy(data)))
+    return outputs
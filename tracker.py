@@ -0,0 +1,211 @@
+"""
+TRACKER - Lightweight ByteTrack-style multi-object tracker (NumPy only)
+
+Each track carries a constant-velocity Kalman filter on (cx, cy, w, h).
+Association follows ByteTrack: confident detections are matched to tracks
+first, then the remaining tracks get a second chance with low-confidence
+detections (partially occluded objects), so IDs survive brief score dips.
+Matching is class-aware and IDs are counted per class, e.g. FireAlarm #3.
+
+predict() advances every track by one frame without a detection, which is
+what video.py uses on skipped frames; uncertainty() tells it when the
+predicted boxes have drifted too far to trust.
+"""
+
+import numpy as np
+
+from box_ops import box_iou
+
+TENTATIVE, CONFIRMED, LOST = 0, 1, 2
+
+
+def xyxy_to_cxcywh(box):
+    x1, y1, x2, y2 = box
+    return np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], dtype=np.float64)
+
+
+def cxcywh_to_xyxy(state):
+    cx, cy, w, h = state[:4]
+    return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], dtype=np.float32)
+
+
+class KalmanBox:
+    """Constant-velocity Kalman filter; noise scales with box height as in ByteTrack."""
+
+    STD_POSITION = 1 / 20
+    STD_VELOCITY = 1 / 160
+
+    F = np.eye(8)
+    F[:4, 4:] = np.eye(4)
+    H = np.eye(4, 8)
+
+    def __init__(self, box):
+        z = xyxy_to_cxcywh(box)
+        self.x = np.concatenate([z, np.zeros(4)])
+        h = max(z[3], 1.0)
+        std = np.array([2 * self.STD_POSITION * h] * 4 + [10 * self.STD_VELOCITY * h] * 4)
+        self.P = np.diag(std ** 2)
+
+    def _noise(self, position_scale, velocity_scale):
+        h = max(self.x[3], 1.0)
+        return np.array([position_scale * h] * 4 + [velocity_scale * h] * 4) ** 2
+
+    def predict(self):
+        self.x = self.F @ self.x
+        self.x[2:4] = np.maximum(self.x[2:4], 1.0)
+        self.P = self.F @ self.P @ self.F.T + np.diag(self._noise(self.STD_POSITION, self.STD_VELOCITY))
+
+    def update(self, box):
+        R = np.diag(self._noise(self.STD_POSITION, 0)[:4])
+        S = self.H @ self.P @ self.H.T + R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ (xyxy_to_cxcywh(box) - self.H @ self.x)
+        self.P = (np.eye(8) - K @ self.H) @ self.P
+
+    @property
+    def box(self):
+        return cxcywh_to_xyxy(self.x)
+
+    @property
+    def uncertainty(self):
+        """Positional standard deviation relative to the box height."""
+        return float(np.sqrt(self.P[0, 0] + self.P[1, 1]) / max(self.x[3], 1.0))
+
+
+class Track:
+    def __init__(self, cls, box, score):
+        self.id = None  # assigned on confirmation, so flickering false positives never use up an ID
+        self.cls = int(cls)
+        self.score = float(score)
+        self.kf = KalmanBox(box)
+        self.state = TENTATIVE
+        self.hits = 1
+        self.age = 0
+        self.since_update = 0
+
+    @property
+    def box(self):
+        return self.kf.box
+
+    def predict(self):
+        self.kf.predict()
+        self.age += 1
+        self.since_update += 1
+
+    def update(self, box, score):
+        self.kf.update(box)
+        self.score = float(score)
+        self.hits += 1
+        self.since_update = 0
+
+
+def greedy_match(iou, min_iou):
+    """Highest-IoU-first one-to-one matching. Returns (pairs, unmatched rows, unmatched cols)."""
+    pairs = []
+    if iou.size:
+        rows, cols = np.nonzero(iou >= min_iou)
+        order = np.argsort(-iou[rows, cols], kind='stable')
+        used_r, used_c = set(), set()
+        for r, c in zip(rows[order], cols[order]):
+            if r not in used_r and c not in used_c:
+                pairs.append((r, c))
+                used_r.add(r)
+                used_c.add(c)
+    matched_r = {r for r, _ in pairs}
+    matched_c = {c for _, c in pairs}
+    return (pairs, [r for r in range(iou.shape[0]) if r not in matched_r],
+            [c for c in range(iou.shape[1]) if c not in matched_c])
+
+
+class ByteTracker:
+    """Two-stage (high, then low confidence) association with per-class IDs."""
+
+    def __init__(self, nc, high_thr=0.5, low_thr=0.1, new_track_thr=0.6, match_iou=0.2,
+                 low_match_iou=0.5, min_hits=2, max_age=30):
+        self.high_thr = high_thr
+        self.low_thr = low_thr
+        self.new_track_thr = new_track_thr
+        self.match_iou = match_iou
+        self.low_match_iou = low_match_iou
+        self.min_hits = min_hits
+        self.max_age = max_age
+        self.tracks = []
+        self.next_id = [1] * nc
+        self.frame = 0
+
+    def _iou(self, tracks, boxes, classes):
+        if not tracks or not len(boxes):
+            return np.zeros((len(tracks), len(boxes)))
+        iou = box_iou(np.stack([t.box for t in tracks]), boxes)
+        iou *= np.array([t.cls for t in tracks])[:, None] == classes[None, :]
+        return iou
+
+    def _confirm(self, track):
+        track.state = CONFIRMED
+        if track.id is None:
+            track.id = self.next_id[track.cls]
+            self.next_id[track.cls] += 1
+
+    def predict(self):
+        """Advance every track one frame; returns the active tracks."""
+        self.frame += 1
+        for track in self.tracks:
+            track.predict()
+        return self.active()
+
+    def update(self, boxes, scores, classes):
+        """Associate one frame of detections. Call predict() for this frame first."""
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        scores = np.asarray(scores, dtype=np.float32)
+        classes = np.asarray(classes, dtype=np.int64)
+        high = np.flatnonzero(scores >= self.high_thr)
+        low = np.flatnonzero((scores >= self.low_thr) & (scores < self.high_thr))
+
+        established = [t for t in self.tracks if t.state != TENTATIVE]
+        tentative = [t for t in self.tracks if t.state == TENTATIVE]
+
+        # 1) confident detections vs established tracks
+        pairs, free_tracks, free_high = greedy_match(self._iou(established, boxes[high], classes[high]), self.match_iou)
+        for r, c in pairs:
+            established[r].update(boxes[high[c]], scores[high[c]])
+            self._confirm(established[r])
+        free_high = high[free_high]
+
+        # 2) leftover tracks that were visible last frame vs low-confidence detections
+        remaining = [established[r] for r in free_tracks if established[r].state == CONFIRMED]
+        pairs, _, _ = greedy_match(self._iou(remaining, boxes[low], classes[low]), self.low_match_iou)
+        for r, c in pairs:
+            remaining[r].update(boxes[low[c]], scores[low[c]])
+
+        # 3) tentative tracks vs what is left of the confident detections
+        pairs, free_tentative, free_new = greedy_match(
+            self._iou(tentative, boxes[free_high], classes[free_high]), self.match_iou)
+        for r, c in pairs:
+            track = tentative[r]
+            track.update(boxes[free_high[c]], scores[free_high[c]])
+            if track.hits >= self.min_hits:
+                self._confirm(track)
+        dropped = {id(tentative[r]) for r in free_tentative}
+
+        for track in established:
+            if track.since_update > 0:
+                track.state = LOST
+        self.tracks = [t for t in self.tracks if id(t) not in dropped and t.since_update <= self.max_age]
+
+        # 4) new tracks from unmatched confident detections
+        for i in free_high[free_new]:
+            if scores[i] < self.new_track_thr:
+                continue
+            track = Track(classes[i], boxes[i], scores[i])
+            if self.frame <= 1:
+                self._confirm(track)  # nothing to confirm against on the first frame
+            self.tracks.append(track)
+        return self.active()
+
+    def active(self):
+        """Confirmed tracks currently believed to be in view."""
+        return [t for t in self.tracks if t.state == CONFIRMED]
+
+    def uncertainty(self):
+        """Worst positional uncertainty among active tracks (0 when there are none)."""
+        return max((t.kf.uncertainty for t in self.active()), default=0.0)
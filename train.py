@@ -3,18 +3,28 @@ ENHANCED TRAINING SCRIPT - Maximum mAP Optimization
 Target: Push mAP from 0.79-0.80 to 0.85+
 
 Key Improvements:
-- Continue from best.pt checkpoint (space_station_medium_final)
+- Continue from the best checkpoint in the run registry (run_registry.py)
 - Advanced augmentations for class imbalance (copy-paste, mixup)
 - Multi-scale training enabled
 - Cosine learning rate schedule
 - Optimized hyperparameters for recall boost
 - Enhanced loss weights (increased cls weight)
+- Repeat-factor class-balanced sampling (rare classes drawn more often)
 """
 
 from ultralytics import YOLO
 import torch
 import os
 
+from class_balance import make_trainer, target_map_logger
+from run_registry import register_run, resolve_model
+from shard_cache import build_shards
+
+# Repeat-factor sampling (class_balance.py): oversample images with rare classes
+BALANCED_SAMPLING = True
+REPEAT_THRESHOLD = 0.1
+TARGET_MAP50 = 0.85   # epochs_to_target.json records when val mAP@50 first gets here
+
 def start_enhanced_training():
     # 1. Path Setup
     current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -22,26 +32,28 @@ def start_enhanced_training():
     print(f"Working Directory: {current_dir}")
 
     # 2. Load Best Checkpoint - Continue Training
-    # This is your trained model at 0.79-0.80 mAP
-    best_checkpoint = os.path.join(
-        current_dir, 
-        'runs/detect/runs/detect/space_station_medium_final/weights/best.pt'
-    )
-    
-    if os.path.exists(best_checkpoint):
+    # Highest val mAP@50 in the run registry (run_registry.py)
+    try:
+        best_checkpoint = resolve_model('best')
         print(f"\n✅ Loading your best checkpoint:")
         print(f"   {best_checkpoint}")
         print(f"   Current mAP: 0.79-0.80 → Target: 0.85+\n")
         model = YOLO(best_checkpoint)
-    else:
-        print(f"\n⚠️ Checkpoint not found at: {best_checkpoint}")
+    except FileNotFoundError:
+        print(f"\n⚠️ No trained checkpoint in the run registry")
         print("   Falling back to yolov8l.pt (larger model for higher mAP)")
         model = YOLO('yolov8l.pt')
 
-    # 3. ENHANCED TRAINING - All Optimizations Applied
+    # 3. Decode + resize train/val once into memory-mapped shards (incremental)
+    build_shards(('train', 'val'), imgsz=640)
+    model.add_callback('on_fit_epoch_end', target_map_logger(TARGET_MAP50))
+    trainer = make_trainer(BALANCED_SAMPLING, REPEAT_THRESHOLD)  # ✅ Shard cache (+ class-balanced sampler)
+
+    # 4. ENHANCED TRAINING - All Optimizations Applied
     print("🚀 Starting Enhanced Training with ALL Optimizations...\n")
     
     model.train(
+        trainer=trainer,
         # ===== BASIC CONFIGURATION =====
         data='yolo_params.yaml',
         epochs=400,                    # More epochs for convergence
@@ -98,7 +110,7 @@ def start_enhanced_training():
         # ===== PERFORMANCE =====
         device=0,                      # GPU
         workers=8,                     # Data loading workers
-        cache='ram',                   # ✅ Cache images in RAM (faster!)
+        cache=False,                   # ✅ Shards replace RAM caching (shared page cache across workers)
         amp=True,                      # Automatic Mixed Precision
         
         # ===== OUTPUT =====
@@ -110,6 +122,7 @@ def start_enhanced_training():
         plots=True,                    # Generate plots
         verbose=True
     )
+    register_run(model.trainer.save_dir)  # 'best' / 'latest' now see this run
     
     print("\n" + "="*70)
     print("✅ ENHANCED TRAINING COMPLETE!")
@@ -7,12 +7,21 @@ from ultralytics import YOLO
 import torch
 import os
 
+from class_balance import make_trainer, target_map_logger
+from run_registry import register_run, resolve_model
+from shard_cache import build_shards
+
+# Repeat-factor sampling (class_balance.py): oversample images with rare classes
+BALANCED_SAMPLING = True
+REPEAT_THRESHOLD = 0.1
+TARGET_MAP50 = 0.95   # epochs_to_target.json records when val mAP@50 first gets here
+
 def ultra_fast_training():
     current_dir = os.path.dirname(os.path.abspath(__file__))
     os.chdir(current_dir)
     
-    # Load your best checkpoint
-    best_checkpoint = 'runs/detect/runs/detect/space_station_medium_final/weights/best.pt'
+    # Load your best checkpoint (highest val mAP@50 in the run registry)
+    best_checkpoint = resolve_model('best')
     
     print("="*70)
     print("⚡ ULTRA-FAST TRAINING MODE - 1 HOUR TO 95+ mAP@50")
@@ -23,8 +32,14 @@ def ultra_fast_training():
     
     model = YOLO(best_checkpoint)
     
+    # Decode + resize once; later runs only decode new or changed images
+    build_shards(('train', 'val'), imgsz=640)
+    model.add_callback('on_fit_epoch_end', target_map_logger(TARGET_MAP50))
+    trainer = make_trainer(BALANCED_SAMPLING, REPEAT_THRESHOLD)  # ✅ Shard cache (+ class-balanced sampler)
+    
     # ULTRA-AGGRESSIVE SETTINGS FOR MAXIMUM mAP IN MINIMAL TIME
     model.train(
+        trainer=trainer,
         data='yolo_params.yaml',
         
         # FAST TRAINING
@@ -71,7 +86,7 @@ def ultra_fast_training():
         # PERFORMANCE
         device=0,
         workers=8,
-        cache=False,                   # Skip caching (faster start)
+        cache=False,                   # Shards instead: fast start AND no per-epoch decode
         amp=True,
         
         # OUTPUT
@@ -83,6 +98,7 @@ def ultra_fast_training():
         plots=True,
         verbose=True
     )
+    register_run(model.trainer.save_dir)
     
     print("\n" + "="*70)
     print("✅ TRAINING COMPLETE!")
@@ -0,0 +1,258 @@
+"""
+VIDEO MODE - Tracked detection on video files and live streams
+
+Pipeline:
+  decode thread --(bounded queue)--> scheduler --> model (key frames only)
+                                        |
+                                  ByteTracker (tracker.py)
+
+Full detection runs only on key frames. A frame becomes a key frame when the
+scene changed (thumbnail difference against the last key frame), when a track
+is uncertain (Kalman covariance grew too large or a new track still needs
+confirming), or after --max-skip frames at the latest. Frames in between are
+held back until the next key frame and their boxes are interpolated between
+the two key frames, so skipped frames cost no forward pass and still get
+smooth, ID-stable boxes.
+
+Counts are per track: every confirmed ID is one object, instead of the
+per-frame counts that double count the same extinguisher in every frame.
+
+Usage:
+    python video.py --source clip.mp4
+    python video.py --source 0 --no-save          # webcam
+    python video.py --source rtsp://camera/stream --max-skip 2
+"""
+
+from pathlib import Path
+import threading
+import argparse
+import queue
+import json
+import time
+import numpy as np
+import cv2
+import os
+
+from backends import get_model
+from thresholds import load_thresholds
+from tracker import ByteTracker, TENTATIVE
+
+# Box colors (BGR), same hues as the app overlay
+PALETTE = [(75, 75, 255), (77, 145, 255), (170, 255, 0), (255, 171, 77),
+           (87, 221, 255), (255, 120, 196), (255, 255, 255)]
+
+
+class FrameReader(threading.Thread):
+    """Decodes frames on its own thread into a bounded queue (back-pressure on decode)."""
+
+    def __init__(self, source, max_queue=32):
+        super().__init__(daemon=True)
+        self.cap = cv2.VideoCapture(int(source) if str(source).isdigit() else str(source))
+        if not self.cap.isOpened():
+            raise IOError(f"Cannot open video source: {source}")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.size = (int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.total = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+        self.frames = queue.Queue(maxsize=max_queue)
+        self.stopped = threading.Event()
+
+    def _put(self, item):
+        """Blocking put that gives up once stop() is called: nobody drains the queue after that."""
+        while not self.stopped.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(self):
+        index = 0
+        while not self.stopped.is_set():
+            ok, frame = self.cap.read()
+            if not ok or not self._put((index, frame)):
+                break
+            index += 1
+        self.cap.release()
+        self._put(None)
+
+    def __iter__(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                return
+            yield item
+
+    def stop(self):
+        self.stopped.set()
+
+
+def thumbnail(frame, size=(64, 36)):
+    return cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def snapshot(tracks):
+    """{(cls, id): (score, box)} for the active tracks."""
+    return {(t.cls, t.id): (t.score, t.box.copy()) for t in tracks}
+
+
+def interpolate(start, end, pending):
+    """Replace the extrapolated boxes of held-back frames by start->end interpolation."""
+    n = len(pending) + 1
+    for i, (_, _, tracks) in enumerate(pending, start=1):
+        t = i / n
+        for key in tracks.keys() & start.keys() & end.keys():
+            tracks[key] = (end[key][0], (1 - t) * start[key][1] + t * end[key][1])
+    return pending
+
+
+def track_stream(source, model=None, names=None, imgsz=640, conf=None, iou=None, max_skip=4,
+                 scene_thr=12.0, uncertainty_thr=0.25, device=None, max_queue=32, reader=None):
+    """Yield (frame_index, frame, {(cls, id): (score, box)}, is_key_frame) for every frame, in order."""
+    model = model or get_model()
+    names = names or model.names
+    names = [names[k] for k in sorted(names)] if isinstance(names, dict) else list(names)
+    display = load_thresholds()['display']
+    conf = display['conf'] if conf is None else conf
+    iou = display['iou'] if iou is None else iou
+    tracker = ByteTracker(len(names), high_thr=conf, new_track_thr=min(conf + 0.1, 0.9))
+
+    reader = reader or FrameReader(source, max_queue)
+    reader.start()
+    pending = []
+    anchor = {}
+    last_thumb = None
+    try:
+        for index, frame in reader:
+            active = tracker.predict()
+            thumb = thumbnail(frame)
+            is_key = (last_thumb is None or len(pending) >= max_skip
+                      or float(np.abs(thumb - last_thumb).mean()) > scene_thr
+                      or tracker.uncertainty() > uncertainty_thr
+                      or any(t.state == TENTATIVE for t in tracker.tracks))
+            if not is_key:
+                pending.append((index, frame, snapshot(active)))
+                continue
+
+            result = model.predict(frame, conf=tracker.low_thr, iou=iou, imgsz=imgsz, device=device, verbose=False)[0]
+            boxes = result.boxes
+            active = tracker.update(boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy())
+            current = snapshot(active)
+            for item in interpolate(anchor, current, pending):
+                yield item + (False,)
+            yield index, frame, current, True
+            pending, anchor, last_thumb = [], current, thumb
+        for item in pending:
+            yield item + (False,)
+    finally:
+        reader.stop()
+
+
+def draw_tracks(frame, tracks, names):
+    thickness = max(2, round(sum(frame.shape[:2]) / 600))
+    for (c, tid), (score, box) in tracks.items():
+        x1, y1, x2, y2 = box.astype(int)
+        color = PALETTE[c % len(PALETTE)]
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, thickness)
+        cv2.putText(frame, f"{names[c]} #{tid}", (x1, max(y1 - 6, 12)),
+                    cv2.FONT_HERSHEY_SIMPLEX, thickness / 3, color, max(1, thickness // 2))
+    return frame
+
+
+def track_counts(seen, names):
+    """Distinct objects per class from the set of (cls, id) keys seen so far."""
+    counts = {}
+    for c, _ in sorted(seen):
+        counts[names[c]] = counts.get(names[c], 0) + 1
+    return counts
+
+
+def process_video(source, out_dir='runs/video/exp', save=True, on_frame=None, **kwargs):
+    """Run track_stream over a whole source; write annotated video + summary.json.
+
+    on_frame(index, annotated_bgr, counts) is called for every frame (used by app.py).
+    """
+    model = kwargs.pop('model', None) or get_model()
+    names = model.names
+    names = [names[k] for k in sorted(names)] if isinstance(names, dict) else list(names)
+    reader = FrameReader(source, kwargs.pop('max_queue', 32))
+    out_dir = Path(out_dir)
+    writer = None
+    if save:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        writer = cv2.VideoWriter(str(out_dir / 'tracked.mp4'), cv2.VideoWriter_fourcc(*'mp4v'), reader.fps, reader.size)
+
+    seen = set()
+    n_frames = n_key = 0
+    start = time.perf_counter()
+    for index, frame, tracks, is_key in track_stream(source, model=model, names=names, reader=reader, **kwargs):
+        n_frames += 1
+        n_key += is_key
+        seen.update(tracks)
+        if writer is not None or on_frame is not None:
+            annotated = draw_tracks(frame, tracks, names)
+            if writer is not None:
+                writer.write(annotated)
+            if on_frame is not None:
+                on_frame(index, annotated, track_counts(seen, names))
+    elapsed = time.perf_counter() - start
+    if writer is not None:
+        writer.release()
+
+    summary = {
+        'source': str(source),
+        'frames': n_frames,
+        'key_frames': n_key,
+        'key_frame_ratio': n_key / max(n_frames, 1),
+        'processing_fps': n_frames / max(elapsed, 1e-9),
+        'source_fps': reader.fps,
+        'counts': track_counts(seen, names),
+    }
+    if save:
+        (out_dir / 'summary.json').write_text(json.dumps(summary, indent=2))
+    return summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Tracked detection on a video file or stream")
+    parser.add_argument('--source', required=True, help="Video file, stream URL or webcam index")
+    parser.add_argument('--model', default=None, help="Weights path, run name or alias (default: best)")
+    parser.add_argument('--backend', default='auto',
+                        choices=['auto', 'pytorch', 'onnx', 'openvino', 'torchscript', 'onnx_int8'])
+    parser.add_argument('--out', default='runs/video/exp')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--conf', type=float, default=None, help="Default: display threshold from thresholds.json")
+    parser.add_argument('--iou', type=float, default=None)
+    parser.add_argument('--max-skip', type=int, default=4, help="Max frames between two detections")
+    parser.add_argument('--scene-thr', type=float, default=12.0, help="Mean abs thumbnail diff that forces a detection")
+    parser.add_argument('--uncertainty-thr', type=float, default=0.25,
+                        help="Track position std / box height that forces a detection")
+    parser.add_argument('--no-save', action='store_true')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+    args = parse_args()
+
+    print("="*70)
+    print("🎬 VIDEO TRACKING")
+    print("="*70)
+    print(f"Source: {args.source}")
+    print("="*70 + "\n")
+
+    summary = process_video(args.source, out_dir=args.out, save=not args.no_save,
+                            model=get_model(args.model, backend=args.backend, imgsz=args.imgsz),
+                            imgsz=args.imgsz, conf=args.conf, iou=args.iou, max_skip=args.max_skip,
+                            scene_thr=args.scene_thr, uncertainty_thr=args.uncertainty_thr)
+
+    print(f"✅ {summary['frames']} frames, {summary['key_frames']} detected "
+          f"({summary['key_frame_ratio'] * 100:.0f}%), {summary['processing_fps']:.1f} FPS "
+          f"(source {summary['source_fps']:.1f} FPS)")
+    print("-"*70)
+    for name, n in summary['counts'].items():
+        print(f"   {name:<20} {n}")
+    if not args.no_save:
+        print(f"💾 Saved: {args.out}/tracked.mp4, {args.out}/summary.json")
+    print("="*70 + "\n")
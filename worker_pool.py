@@ -0,0 +1,297 @@
+"""
+WORKER POOL - Pre-forked CPU inference workers sharing ONE copy of the weights
+
+Every script and Streamlit process used to hold its own YOLO copy, so scaling
+across cores multiplied memory by the worker count. InferencePool loads and
+fuses the model once in the parent, moves its tensors to shared memory and
+then forks the workers: they all read the same weight pages (copy-on-write
+on Linux), only activations and the runtime are private per worker.
+
+Each worker pins its intra-op threads (torch.set_num_threads, and optionally
+a disjoint set of the CPUs this process is allowed on, via sched_setaffinity)
+so processes x threads never oversubscribes the node or its cgroup. Batches go through one shared task queue, so an idle
+worker always picks up the next batch, and every result carries its worker
+id and forward time for per-worker throughput, plus ultralytics' per-image
+preprocess / forward / NMS speeds, which the parent records in stage_timing.py
+(a forked worker's own histograms are never read). If a worker dies (OOM kill,
+segfault), every pending batch fails with its exit code instead of waiting
+forever, and the pool refuses new work.
+
+The parent never runs a forward pass before forking (an OpenMP pool created
+before fork() can hang the children). Where fork() is unavailable (Windows,
+macOS) workers are spawned and each loads the weights itself.
+
+Usage:
+    python worker_pool.py                          # sweep processes x threads on all cores
+    python worker_pool.py --cores 8 --images 128
+    python inference_server.py --workers 4 --threads 2
+"""
+
+from concurrent.futures import Future
+from pathlib import Path
+import multiprocessing as mp
+import itertools
+import queue
+import threading
+import argparse
+import json
+import time
+import numpy as np
+import torch
+import os
+
+from backends import get_model, resolve_model_path
+from stage_timing import record_speed
+
+SWEEP_FILE = Path('runs/benchmark/pool_sweep.json')
+LIVENESS_S = 1.0   # how often the collector checks for dead workers
+
+
+def allowed_cpus():
+    """CPU ids this process may run on (cgroup / taskset aware where the OS exposes it)."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _worker(worker_id, model, tasks, results, threads, cores, imgsz, device):
+    torch.set_num_threads(threads)
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    if isinstance(model, str):  # spawned: no inherited model
+        model = get_model(model, backend='pytorch')
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, images, conf, iou, max_det = task
+        start = time.perf_counter()
+        try:
+            predictions = model.predict(images, imgsz=imgsz, conf=conf, iou=iou, max_det=max_det,
+                                        device=device, verbose=False)
+            outputs = [(list(r.orig_shape), r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy(),
+                        r.boxes.cls.cpu().numpy().astype(np.int32)) for r in predictions]
+            speeds = [r.speed for r in predictions]
+            results.put((task_id, worker_id, outputs, time.perf_counter() - start, None, speeds))
+        except Exception as e:
+            results.put((task_id, worker_id, None, time.perf_counter() - start, repr(e), []))
+
+
+class InferencePool:
+    """N worker processes x T threads around one shared, fused PyTorch model."""
+
+    def __init__(self, model_path=None, workers=2, threads=None, imgsz=640, device='cpu', pin=True):
+        self.model_path = resolve_model_path(model_path)
+        self.workers = workers
+        cpus = allowed_cpus()
+        self.threads = threads or max(1, len(cpus) // workers)
+        self.imgsz = imgsz
+        method = 'fork' if 'fork' in mp.get_all_start_methods() else 'spawn'
+        ctx = mp.get_context(method)
+
+        torch.set_num_threads(1)  # no intra-op pool in the parent before fork()
+        model = get_model(self.model_path, backend='pytorch')
+        model.fuse()
+        model.model.eval()
+        for p in model.model.parameters():
+            p.requires_grad_(False)
+        model.model.share_memory()
+        self.names = model.names
+        self.model = model
+
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+        self.processes = []
+        for i in range(workers):
+            cores = [cpus[(i * self.threads + k) % len(cpus)] for k in range(self.threads)] if pin else None
+            p = ctx.Process(target=_worker, daemon=True,
+                            args=(i, model if method == 'fork' else self.model_path, self.tasks,
+                                  self.results, self.threads, cores, imgsz, device))
+            p.start()
+            self.processes.append(p)
+        self.start_method = method
+
+        self.futures = {}
+        self.error = None    # set once a worker dies; the pool then refuses new work
+        self.closing = False
+        self.lock = threading.Lock()
+        self.task_ids = itertools.count()
+        self.per_worker = [{'images': 0, 'batches': 0, 'busy_s': 0.0} for _ in range(workers)]
+        self.started = time.time()
+        self.collector = threading.Thread(target=self._collect, name='pool-results', daemon=True)
+        self.collector.start()
+
+    def _collect(self):
+        next_check = time.monotonic() + LIVENESS_S
+        while True:
+            try:
+                item = self.results.get(timeout=LIVENESS_S)
+            except queue.Empty:
+                item = False
+            if time.monotonic() >= next_check:  # also while the other workers keep results flowing
+                self._check_workers()
+                next_check = time.monotonic() + LIVENESS_S
+            if item is False:
+                continue
+            if item is None:
+                break
+            task_id, worker_id, outputs, elapsed, error, speeds = item
+            for speed in speeds:
+                record_speed(speed)  # the worker's preprocess / forward / nms, kept in this process
+            with self.lock:
+                if task_id not in self.futures:  # already failed by _check_workers()
+                    continue
+                future, n = self.futures.pop(task_id)
+                w = self.per_worker[worker_id]
+                w['batches'] += 1
+                w['images'] += n
+                w['busy_s'] += elapsed
+            if error is None:
+                future.set_result((outputs, worker_id, elapsed))
+            else:
+                future.set_exception(RuntimeError(f"worker {worker_id}: {error}"))
+
+    def _check_workers(self):
+        """Fail every pending batch once a worker has died (OOM kill, segfault, bad affinity).
+
+        The task the dead worker held is lost and there is no telling which one
+        it was, so nothing in flight can be trusted to resolve.
+        """
+        if self.closing or self.error is not None:
+            return
+        dead = [(i, p) for i, p in enumerate(self.processes) if not p.is_alive()]
+        if not dead:
+            return
+        with self.lock:
+            self.error = "; ".join(f"worker {i} (pid {p.pid}) exited with code {p.exitcode}" for i, p in dead)
+            pending = [future for future, _ in self.futures.values()]
+            self.futures.clear()
+        print(f"   ❌ Inference pool broken: {self.error}")
+        for future in pending:
+            future.set_exception(RuntimeError(self.error))
+
+    def submit(self, images, conf=0.25, iou=0.7, max_det=300):
+        """Queue one batch; the Future resolves to ([(shape, xyxy, conf, cls)], worker_id, seconds)."""
+        future = Future()
+        task_id = next(self.task_ids)
+        with self.lock:
+            if self.error is not None:
+                raise RuntimeError(f"inference pool broken: {self.error}")
+            self.futures[task_id] = (future, len(images))
+        self.tasks.put((task_id, list(images), conf, iou, max_det))
+        return future
+
+    def map(self, images, batch=8, **kwargs):
+        """Per-image outputs of `images` in order, batches spread over all workers."""
+        futures = [self.submit(images[i:i + batch], **kwargs) for i in range(0, len(images), batch)]
+        return [out for f in futures for out in f.result()[0]]
+
+    def reset_stats(self):
+        with self.lock:
+            self.per_worker = [{'images': 0, 'batches': 0, 'busy_s': 0.0} for _ in range(self.workers)]
+            self.started = time.time()
+
+    def stats(self):
+        wall = max(time.time() - self.started, 1e-9)
+        with self.lock:
+            workers = [dict(w, pid=p.pid, alive=p.is_alive(), images_per_s=round(w['images'] / max(w['busy_s'], 1e-9), 2),
+                            utilization=round(w['busy_s'] / wall, 3))
+                       for w, p in zip(self.per_worker, self.processes)]
+        memory = self.memory()
+        for w in workers:
+            w.update(memory.get(w['pid'], {}))
+        return {'workers': self.workers, 'threads': self.threads, 'start_method': self.start_method,
+                'error': self.error, 'throughput_ips': round(sum(w['images'] for w in workers) / wall, 2), 'per_worker': workers}
+
+    def memory(self):
+        """{pid: rss_mb, uss_mb} per worker; USS = memory private to that process (needs psutil)."""
+        try:
+            import psutil
+        except ImportError:
+            return {}
+        memory = {}
+        for p in self.processes:
+            try:
+                info = psutil.Process(p.pid).memory_full_info()
+                memory[p.pid] = {'rss_mb': round(info.rss / 1e6, 1), 'uss_mb': round(info.uss / 1e6, 1)}
+            except (psutil.Error, AttributeError):
+                pass
+        return memory
+
+    def close(self):
+        self.closing = True
+        for _ in self.processes:
+            self.tasks.put(None)
+        for p in self.processes:
+            p.join(timeout=10)
+        self.results.put(None)
+        self.collector.join(timeout=10)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def splits_for(cores):
+    """Every processes x threads split that uses exactly `cores` cores."""
+    return [(p, cores // p) for p in range(1, cores + 1) if cores % p == 0]
+
+
+def sweep(model_path=None, cores=None, images=64, batch=4, imgsz=640, split='val', warmup=1):
+    """Throughput and memory of every processes x threads split on this node."""
+    from benchmark import load_frames
+    cores = cores or len(allowed_cpus())
+    frames = load_frames(split, images)
+
+    print("="*70)
+    print(f"🧵 WORKER POOL SWEEP - {cores} cores, {len(frames)} images, batch {batch}")
+    print("="*70)
+    rows = []
+    for workers, threads in splits_for(cores):
+        with InferencePool(model_path, workers=workers, threads=threads, imgsz=imgsz) as pool:
+            pool.map(frames[:workers * batch * warmup], batch=batch)  # warm-up batches, not timed
+            pool.reset_stats()
+            start = time.perf_counter()
+            pool.map(frames, batch=batch)
+            wall = time.perf_counter() - start
+            stats = pool.stats()
+        per = stats['per_worker']
+        row = {'workers': workers, 'threads': threads, 'images_per_s': round(len(frames) / wall, 2),
+               'per_worker_ips': [w['images_per_s'] for w in per],
+               'uss_mb': round(sum(w.get('uss_mb', 0) for w in per), 1) or None,
+               'rss_mb': round(sum(w.get('rss_mb', 0) for w in per), 1) or None}
+        rows.append(row)
+        print(f"   {workers:>2} x {threads:<2} threads: {row['images_per_s']:>7.2f} img/s | per worker "
+              + ", ".join(f"{x:.1f}" for x in row['per_worker_ips'])
+              + (f" | private {row['uss_mb']:.0f} MB" if row['uss_mb'] else ""))
+
+    best = max(rows, key=lambda r: r['images_per_s'])
+    print("-"*70)
+    print(f"🏆 Best split: {best['workers']} processes x {best['threads']} threads "
+          f"({best['images_per_s']:.2f} img/s)")
+    print(f"   python inference_server.py --workers {best['workers']} --threads {best['threads']}")
+    print("="*70 + "\n")
+    SWEEP_FILE.parent.mkdir(parents=True, exist_ok=True)
+    SWEEP_FILE.write_text(json.dumps({'model': str(resolve_model_path(model_path)), 'cores': cores,
+                                      'batch': batch, 'imgsz': imgsz, 'results': rows}, indent=2))
+    return rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sweep processes x threads for the shared-weights worker pool")
+    parser.add_argument('--model', default=None, help="Weights path, run name or alias (default: best)")
+    parser.add_argument('--cores', type=int, default=None, help="Cores to split (default: all)")
+    parser.add_argument('--images', type=int, default=64)
+    parser.add_argument('--batch', type=int, default=4)
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--split', default='val', help="Images to time (synthetic frames if absent)")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(current_dir)
+    args = parse_args()
+    sweep(args.model, cores=args.cores, images=args.images, batch=args.batch, imgsz=args.imgsz, split=args.split)